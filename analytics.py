@@ -0,0 +1,261 @@
+# analytics.py - message counts per member and per day, kept up to date as messages arrive
+import os
+import heapq
+import threading
+import numpy as np
+from datetime import date, timedelta
+from typing import List, Dict, Optional, Tuple
+
+ANALYTICS_TOP_K = int(os.getenv("ANALYTICS_TOP_K", "10"))
+NO_DAY = np.iinfo(np.int64).min  # messages without a parseable timestamp
+EPOCH = date(1970, 1, 1)
+
+
+def _days(messages: List[Dict]) -> np.ndarray:
+    """Timestamps -> days since 1970-01-01 (UTC date as written in the timestamp)"""
+    stamps = np.array([(msg.get("timestamp") or "")[:10] for msg in messages], dtype="U10")
+    try:
+        days = stamps.astype("datetime64[D]")
+    except ValueError:
+        days = np.array([_parse_day(stamp) for stamp in stamps], dtype="datetime64[D]")
+    return np.where(np.isnat(days), NO_DAY, days.astype(np.int64))
+
+
+def _parse_day(stamp: str) -> np.datetime64:
+    try:
+        return np.datetime64(stamp, "D")
+    except ValueError:
+        return np.datetime64("NaT")
+
+
+def _to_day(value: date) -> int:
+    return (value - EPOCH).days
+
+
+def _to_date(day: int) -> str:
+    return (EPOCH + timedelta(days=int(day))).isoformat()
+
+
+class MessageAnalytics:
+    """
+    Columnar message aggregates. Each message is one row in user_codes / days;
+    per-member counts, the per-day histogram and a top-k min-heap are updated
+    per appended batch, so the unfiltered summary never touches the rows.
+    Filtered queries (member and/or date range) use two sort orders built
+    lazily after the last change: rows by day, and rows by (member, day).
+    """
+
+    def __init__(self, top_k: int = ANALYTICS_TOP_K):
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self.reset([])
+
+    def reset(self, messages: List[Dict]):
+        with self._lock:
+            self._clear()
+            self._append(messages)
+
+    def _clear(self):
+        self.names: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._lookup: Dict[str, int] = {}  # lowercased name -> code
+        self.user_codes = np.zeros(0, dtype=np.int32)
+        self.days = np.zeros(0, dtype=np.int64)
+        self.user_counts = np.zeros(0, dtype=np.int64)
+        self.day_counts = np.zeros(0, dtype=np.int64)
+        self.day_base = 0
+        self._top: List[List[int]] = []  # heap of [count, code]
+        self._top_entries: Dict[int, List[int]] = {}
+        self._by_day = None
+        self._by_user_day = None
+
+    def columns(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """(member names, per-row member codes, per-row days) - enough to rebuild everything else"""
+        with self._lock:
+            return list(self.names), self.user_codes, self.days
+
+    def load_columns(self, names: List[str], user_codes: np.ndarray, days: np.ndarray):
+        """
+        Rebuild from columns() output (e.g. memory-mapped from the shared
+        corpus) without parsing any messages; the row arrays are used as-is.
+        """
+        with self._lock:
+            self._clear()
+            for name in names:
+                self._code(name)
+            self.user_codes = user_codes
+            self.days = days
+            self.user_counts = np.bincount(user_codes, minlength=len(names)).astype(np.int64)
+            valid = days[days != NO_DAY]
+            if len(valid):
+                self._grow_days(int(valid.min()), int(valid.max()))
+                self.day_counts += np.bincount(valid - self.day_base, minlength=len(self.day_counts))
+            for code in np.flatnonzero(self.user_counts).tolist():
+                self._update_top(code, int(self.user_counts[code]))
+
+    def append(self, messages: List[Dict]):
+        with self._lock:
+            self._append(messages)
+
+    def _code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(name)
+            self._lookup.setdefault(name.lower(), code)
+        return code
+
+    def _append(self, messages: List[Dict]):
+        if not messages:
+            return
+        codes = np.fromiter((self._code(msg.get("user_name", "")) for msg in messages), dtype=np.int32, count=len(messages))
+        days = _days(messages)
+        self.user_codes = np.concatenate([self.user_codes, codes])
+        self.days = np.concatenate([self.days, days])
+
+        if len(self.names) > len(self.user_counts):
+            self.user_counts = np.pad(self.user_counts, (0, len(self.names) - len(self.user_counts)))
+        np.add.at(self.user_counts, codes, 1)
+
+        valid = days[days != NO_DAY]
+        if len(valid):
+            self._grow_days(int(valid.min()), int(valid.max()))
+            self.day_counts += np.bincount(valid - self.day_base, minlength=len(self.day_counts))
+
+        for code in np.unique(codes).tolist():
+            self._update_top(code, int(self.user_counts[code]))
+        self._by_day = None
+        self._by_user_day = None
+
+    def _grow_days(self, first: int, last: int):
+        if not len(self.day_counts):
+            self.day_base = first
+            self.day_counts = np.zeros(last - first + 1, dtype=np.int64)
+            return
+        base = min(self.day_base, first)
+        end = max(self.day_base + len(self.day_counts), last + 1)
+        if base != self.day_base or end != self.day_base + len(self.day_counts):
+            before = self.day_base - base
+            self.day_counts = np.pad(self.day_counts, (before, end - base - before - len(self.day_counts)))
+            self.day_base = base
+
+    def _update_top(self, code: int, count: int):
+        # Counts only grow, so a member outside the heap can only enter by beating its minimum
+        entry = self._top_entries.get(code)
+        if entry is not None:
+            entry[0] = count
+            heapq.heapify(self._top)
+        elif len(self._top) < self.top_k:
+            entry = self._top_entries[code] = [count, code]
+            heapq.heappush(self._top, entry)
+        elif count > self._top[0][0]:
+            entry = self._top_entries[code] = [count, code]
+            del self._top_entries[heapq.heapreplace(self._top, entry)[1]]
+
+    def __len__(self) -> int:
+        return len(self.user_codes)
+
+    def find_user(self, name: str) -> Optional[int]:
+        return self._lookup.get(name.strip().lower())
+
+    def summary(self) -> Dict:
+        """Totals and top members over everything (no per-row work)"""
+        with self._lock:
+            top = sorted(((count, code) for count, code in self._top), key=lambda x: (-x[0], x[1]))
+            return {
+                "total_messages": len(self.user_codes),
+                "unique_users": len(self.names),
+                "top_users": [{"name": self.names[code], "count": count} for count, code in top],
+                "first_day": _to_date(self.day_base) if len(self.day_counts) else None,
+                "last_day": _to_date(self.day_base + len(self.day_counts) - 1) if len(self.day_counts) else None
+            }
+
+    def member_counts(self) -> List[Tuple[str, int]]:
+        """(name, messages) for every member, most active first"""
+        with self._lock:
+            order = np.argsort(-self.user_counts, kind="stable")
+            return [(self.names[code], int(self.user_counts[code])) for code in order.tolist()]
+
+    def member_count(self, code: int) -> int:
+        return int(self.user_counts[code])
+
+    def rows_for_user(self, code: int) -> np.ndarray:
+        """Row numbers (= positions in the message list) of one member's messages, oldest first"""
+        with self._lock:
+            order, codes, _ = self._sorted_by_user_day()
+            return order[np.searchsorted(codes, code, "left"):np.searchsorted(codes, code, "right")]
+
+    def _sorted_by_day(self):
+        """(row order, days in that order), rebuilt after a change"""
+        if self._by_day is None:
+            order = np.argsort(self.days, kind="stable")
+            self._by_day = (order, self.days[order])
+        return self._by_day
+
+    def _sorted_by_user_day(self):
+        """(row order, member codes, days in that order), rebuilt after a change"""
+        if self._by_user_day is None:
+            order = np.lexsort((self.days, self.user_codes))
+            self._by_user_day = (order, self.user_codes[order], self.days[order])
+        return self._by_user_day
+
+    def _day_bounds(self, since: Optional[date], until: Optional[date]):
+        lo = _to_day(since) if since else NO_DAY + 1
+        hi = _to_day(until) + 1 if until else np.iinfo(np.int64).max
+        return lo, hi
+
+    def query(self, user: Optional[int] = None, since: Optional[date] = None, until: Optional[date] = None) -> Dict:
+        """
+        Counts for one member (by code from find_user) and/or an inclusive date
+        range, with a per-day histogram. Binary searches over the sort orders;
+        only the top-members-in-range case touches the rows in range.
+        """
+        with self._lock:
+            lo, hi = self._day_bounds(since, until)
+            if user is not None:
+                _, codes, all_days = self._sorted_by_user_day()
+                start, stop = np.searchsorted(codes, user, "left"), np.searchsorted(codes, user, "right")
+                member_days = all_days[start:stop]
+                if since is None and until is None:
+                    total = len(member_days)
+                    days = member_days[member_days != NO_DAY]
+                else:
+                    days = member_days[np.searchsorted(member_days, lo, "left"):np.searchsorted(member_days, hi, "left")]
+                    total = len(days)
+                per_day, counts = np.unique(days, return_counts=True)
+                return {
+                    "user": self.names[user],
+                    "total_messages": int(total),
+                    "messages_per_day": [{"date": _to_date(d), "count": int(c)} for d, c in zip(per_day, counts)]
+                }
+
+            order, days = self._sorted_by_day()
+            start, stop = np.searchsorted(days, lo, "left"), np.searchsorted(days, hi, "left")
+            user_counts = np.bincount(self.user_codes[order[start:stop]], minlength=len(self.names))
+            top = np.argsort(-user_counts, kind="stable")[:self.top_k] if len(user_counts) else user_counts
+
+            first = max(lo - self.day_base, 0)
+            last = min(hi - self.day_base, len(self.day_counts))
+            per_day = self.day_counts[first:last] if first < last else self.day_counts[:0]
+            return {
+                "total_messages": int(stop - start),
+                "unique_users": int(np.count_nonzero(user_counts)),
+                "top_users": [
+                    {"name": self.names[code], "count": int(user_counts[code])}
+                    for code in top.tolist() if user_counts[code]
+                ],
+                "messages_per_day": [
+                    {"date": _to_date(self.day_base + first + offset), "count": int(count)}
+                    for offset, count in enumerate(per_day.tolist()) if count
+                ]
+            }
+
+
+_analytics = None
+
+
+def get_analytics() -> MessageAnalytics:
+    global _analytics
+    if _analytics is None:
+        _analytics = MessageAnalytics()
+    return _analytics
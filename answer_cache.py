@@ -0,0 +1,236 @@
+# answer_cache.py - two-tier answer cache in front of the LLM
+import os
+import re
+import asyncio
+import time
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple, Callable, Awaitable, Hashable
+from metrics import CACHE_LOOKUPS
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2048"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "data/answer_cache.sqlite")
+ANSWER_CACHE_PERSIST = os.getenv("ANSWER_CACHE_PERSIST", "true").lower() == "true"
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(_PUNCT_RE.sub(" ", question.lower()).split())
+
+
+class AnswerCache:
+    """
+    Tier 1: exact LRU on the normalized question.
+    Tier 2: cosine nearest neighbour over cached question embeddings, kept in a
+    preallocated (size x dim) matrix with one slot per entry.
+    Every entry carries the dataset version it was answered against; entries
+    from another version never match. Optionally written through to SQLite so
+    the cache survives restarts; put_async does that write in a thread so the
+    event loop never waits on the disk.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        path: Optional[str] = ANSWER_CACHE_PATH if ANSWER_CACHE_PERSIST else None
+    ):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.path = path
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()          # the connection is shared with writer threads
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._matrix = None                       # (max_entries, dim) float32, unit rows
+        self._slot_keys: List[Optional[str]] = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+        self._conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, version TEXT, "
+                "answer TEXT, embedding BLOB, created_at REAL)"
+            )
+            self._conn.commit()
+
+    def load(self, version: str):
+        """Pull the most recent on-disk entries for `version` into memory"""
+        if self._conn is None:
+            return
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT key, answer, embedding FROM answers WHERE version = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (version, self.max_entries)
+            ).fetchall()
+            self._conn.execute("DELETE FROM answers WHERE version != ?", (version,))
+            self._conn.commit()
+        for key, answer, blob in reversed(rows):
+            embedding = np.frombuffer(blob, dtype=np.float32) if blob else None
+            self._insert(key, answer, version, embedding)
+        if rows:
+            print(f"📂 Loaded {len(rows)} cached answers (version {version})")
+
+    def _evict(self, key: str):
+        entry = self._entries.pop(key)
+        if entry["slot"] is not None:
+            self._slot_keys[entry["slot"]] = None
+            self._free_slots.append(entry["slot"])
+
+    def _insert(self, key: str, answer: str, version: str, embedding: Optional[np.ndarray]) -> Tuple:
+        """Add the entry in memory; returns the row to persist"""
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            while len(self._entries) >= self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+            slot = None
+            if embedding is not None:
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector = vector / (np.linalg.norm(vector) or 1.0)
+                if self._matrix is None:
+                    self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                slot = self._free_slots.pop()
+                self._matrix[slot] = vector
+                self._slot_keys[slot] = key
+
+            self._entries[key] = {"answer": answer, "version": version, "slot": slot}
+            blob = self._matrix[slot].tobytes() if slot is not None else None
+            return key, version, answer, blob, time.time()
+
+    def _persist(self, row: Tuple):
+        if self._conn is None:
+            return
+        with self._db_lock:
+            self._conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)", row)
+            self._conn.commit()
+
+    def get_exact(self, question: str, version: str) -> Optional[str]:
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["version"] != version:
+                self._evict(key)
+                entry = None
+            if entry is None:
+                CACHE_LOOKUPS.inc(1, "answer_exact", "miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits["exact"] += 1
+            CACHE_LOOKUPS.inc(1, "answer_exact", "hit")
+            return entry["answer"]
+
+    def get_similar(self, embedding: List[float], version: str) -> Optional[str]:
+        with self._lock:
+            if self._matrix is None or len(self._free_slots) == self.max_entries:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(1, "answer_semantic", "miss")
+                return None
+            query = np.asarray(embedding, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1.0)
+            scores = self._matrix @ query
+            # Empty slots are zero rows (score 0), far below any sensible threshold
+            best = int(np.argmax(scores))
+            key = self._slot_keys[best]
+            if key is None or scores[best] < self.threshold:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(1, "answer_semantic", "miss")
+                return None
+            entry = self._entries[key]
+            if entry["version"] != version:
+                self._evict(key)
+                self.misses += 1
+                CACHE_LOOKUPS.inc(1, "answer_semantic", "miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits["semantic"] += 1
+            CACHE_LOOKUPS.inc(1, "answer_semantic", "hit")
+            print(f"💾 Semantic cache hit ({scores[best]:.3f})")
+            return entry["answer"]
+
+    def put(self, question: str, answer: str, version: str, embedding: Optional[List[float]] = None):
+        self._persist(self._insert(normalize_question(question), answer, version, embedding))
+
+    async def put_async(self, question: str, answer: str, version: str, embedding: Optional[List[float]] = None):
+        """put() for the event loop: the entry is usable right away, the SQLite write runs in a thread"""
+        row = self._insert(normalize_question(question), answer, version, embedding)
+        if self._conn is not None:
+            await asyncio.to_thread(self._persist, row)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._slot_keys = [None] * self.max_entries
+            self._free_slots = list(range(self.max_entries - 1, -1, -1))
+            if self._matrix is not None:
+                self._matrix[:] = 0
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute("DELETE FROM answers")
+                self._conn.commit()
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "hits": dict(self.hits), "misses": self.misses}
+
+
+class SingleFlight:
+    """
+    Tier 0: answers still being computed. Concurrent callers with the same key
+    share one execution - the first starts it as a task, the rest await it.
+    The task is shielded, so a caller that disconnects doesn't cancel the
+    answer for everyone else (it still finishes and lands in the cache).
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable]):
+        key = (asyncio.get_running_loop(), key)  # tasks can't be awaited across loops
+        task = self._tasks.get(key)
+        if task is None:
+            CACHE_LOOKUPS.inc(1, "answer_inflight", "miss")
+            task = self._tasks[key] = asyncio.ensure_future(work())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            CACHE_LOOKUPS.inc(1, "answer_inflight", "hit")
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        self._tasks.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # mark retrieved - every caller may have gone away
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
+
+
+_in_flight: Optional[SingleFlight] = None
+
+
+def get_in_flight() -> SingleFlight:
+    global _in_flight
+    if _in_flight is None:
+        _in_flight = SingleFlight()
+    return _in_flight
@@ -1,35 +1,29 @@
 # answer_generator.py
 import os
-from openai import OpenAI
-from typing import List, Dict
-from dotenv import load_dotenv
-from vector_store import search_relevant_messages
-
-load_dotenv()
+import asyncio
+from typing import List, Dict, AsyncIterator, Optional, Tuple
+from answer_cache import get_answer_cache, get_in_flight, normalize_question
+from context_builder import build_context, CONTEXT_DEDUP
+from metrics import span, record_stage, LLM_TOKENS, CACHE_LOOKUPS
+from http_clients import get_llm_client, get_async_llm_client
+from rate_limiter import get_llm_admission, Overloaded, OVERLOADED
+from keyword_index import get_keyword_index
+from query_planner import plan_and_execute, plan_and_execute_async, extract_filters
+from search_filters import SearchFilter
+from sessions import get_session_store, Session
+from vector_store import (
+    search_relevant_messages, search_relevant_messages_async, search_relevant_messages_batch_async,
+    get_query_embedding_async, get_query_embeddings_async, get_dataset_version_async, to_messages, EMBED_TIMEOUT
+)
 
 MODEL_NAME = "qwen/qwen3-next-80b-a3b-instruct"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+SESSION_EXTEND_K = int(os.getenv("SESSION_EXTEND_K", "5"))  # keyword hits a follow-up may add
+NOT_INITIALIZED = "Vector store not initialized. Please run /refresh to initialize embeddings."
+RETRIEVAL_FAILED = "Error retrieving messages for this question. Please try again."
 
-def prepare_context(messages: List[Dict]) -> str:
-    context_lines = []
-    for msg in messages:
-        line = f"User: {msg['user_name']}\nDate: {msg['timestamp']}\nMessage: {msg['message']}"
-        context_lines.append(line)
-    return "\n---\n".join(context_lines)
-
-def generate_answer(question: str) -> str:
-    relevant_messages = search_relevant_messages(question, top_k=15)
-    
-    if relevant_messages is None:
-        return "Vector store not initialized. Please run /refresh to initialize embeddings."
-    
-    client = OpenAI(
-        api_key=os.getenv("NVIDIA_API_KEY"),
-        base_url=os.getenv("NVIDIA_BASE_URL")
-    )
-
-    context = prepare_context(relevant_messages)
-    
-    system_prompt = """You are a precise assistant that answers questions based on member messages.
+SYSTEM_PROMPT = """You are a precise assistant that answers questions based on member messages.
 
 CRITICAL RULES:
 1. Answer based ONLY on the information in the messages provided
@@ -41,33 +35,492 @@ CRITICAL RULES:
 7. Do NOT add explanations or caveats unless necessary
 8. Extract ONLY the specific information asked for"""
 
-    user_prompt = f"""Messages:
+
+def prepare_context(messages: List[Dict]) -> str:
+    """Retrieved messages (best first), deduplicated and packed into CONTEXT_TOKEN_BUDGET"""
+    return build_context(messages)
+
+
+def build_chat_messages(
+    question: str,
+    relevant_messages: List[Dict],
+    aggregate: Optional[Dict] = None,
+    context: Optional[str] = None,
+    history: Optional[str] = None
+) -> List[Dict]:
+    """
+    `aggregate` (from the query planner) replaces the retrieved context with its
+    exact summary; `context` is an already packed context (a session's) and
+    `history` the session's earlier turns.
+    """
+    if aggregate is not None:
+        context = aggregate["context"]
+        header = "Summary computed over the full message history, then the matching messages (grouped by member, each line is [date time] message):"
+    else:
+        if context is None:
+            context = prepare_context(relevant_messages)
+        header = "Messages (grouped by member, each line is [date time] message):"
+    
+    conversation = f"Earlier in this conversation:\n{history}\n\n" if history else ""
+
+    user_prompt = f"""{header}
 
 {context}
 
-Question: {question}
+{conversation}Question: {question}
 
 Answer concisely:"""
 
     print(f"Sending question to LLM: {question}")
     print(f"Using model: {MODEL_NAME}")
     print(f"Context size: {len(relevant_messages)} messages")
-    
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def generate_answer(question: str) -> str:
+    aggregate = plan_and_execute(question)
+    if aggregate is not None and "answer" in aggregate:
+        return aggregate["answer"]
+
+    if aggregate is not None:
+        relevant_messages = aggregate["messages"]
+    else:
+        relevant_messages = search_relevant_messages(question, top_k=15, query_filter=extract_filters(question))
+
+    if relevant_messages is None:
+        return NOT_INITIALIZED
+
+    client = get_llm_client()
+
     try:
         response = client.chat.completions.create(
             model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=build_chat_messages(question, relevant_messages, aggregate),
             temperature=0,
             max_tokens=200
         )
-        
+
         answer = response.choices[0].message.content.strip()
         print(f"✓ Got answer from LLM")
         return answer
-        
+
+    except Exception as e:
+        print(f"✗ Error calling LLM: {e}")
+        return f"Error generating answer: {str(e)}"
+
+
+async def _complete_async(
+    question: str,
+    relevant_messages: List[Dict],
+    aggregate: Optional[Dict] = None,
+    context: Optional[str] = None,
+    history: Optional[str] = None
+) -> str:
+    """
+    One chat completion under LLM_TIMEOUT, once admitted (the queue wait is
+    not part of LLM_TIMEOUT); raises on any failure, Overloaded if shed.
+    """
+    client = get_async_llm_client()
+    chat_messages = build_chat_messages(question, relevant_messages, aggregate, context, history)
+    
+    async with get_llm_admission(), span("llm"), asyncio.timeout(LLM_TIMEOUT):
+        response = await client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=chat_messages,
+            temperature=0,
+            max_tokens=200
+        )
+    
+    if response.usage is not None:
+        LLM_TOKENS.inc(response.usage.prompt_tokens or 0, "prompt")
+        LLM_TOKENS.inc(response.usage.completion_tokens or 0, "completion")
+    answer = response.choices[0].message.content.strip()
+    print(f"✓ Got answer from LLM")
+    return answer
+
+
+async def generate_answer_async(question: str, session_id: Optional[str] = None) -> str:
+    """
+    Non-blocking generate_answer for the /ask endpoint.
+    Each stage has its own timeout (EMBED_TIMEOUT, SEARCH_TIMEOUT, LLM_TIMEOUT);
+    on expiry the in-flight request is cancelled and TimeoutError is raised.
+    Answers are served from the answer cache when the same (or a close
+    paraphrase of the) question was answered against the current dataset.
+    Count / list / per-member questions skip retrieval (and the semantic
+    cache, where "how many did X" and "how many did Y" look alike) and are
+    answered from exact aggregates by the query planner.
+    Members and explicit dates named in the question narrow the search;
+    such questions skip the semantic cache too ("What does Sophia want?"
+    embeds close to "What does Layla want?").
+    Concurrent calls with the same normalized question share one run.
+    With a `session_id`, follow-ups ("where is she staying?") are answered
+    from the session's context instead (see _answer_follow_up_async).
+    Raises Overloaded when the LLM admission queue sheds the call.
+    """
+    version = await get_dataset_version_async()
+    if session_id is not None:
+        return await _answer_in_session_async(question, get_session_store().get(session_id), version)
+    answer, _ = await _answer_shared_async(question, version)
+    return answer
+
+
+async def _answer_shared_async(question: str, version: str) -> Tuple[str, List[Dict]]:
+    return await get_in_flight().run(
+        (normalize_question(question), version),
+        lambda: _generate_answer_async(question, version)
+    )
+
+
+async def _generate_answer_async(question: str, version: str) -> Tuple[str, List[Dict]]:
+    """(answer, the messages it was based on - [] when none were retrieved)"""
+    cache = get_answer_cache()
+    
+    cached = cache.get_exact(question, version)
+    if cached is not None:
+        print(f"💾 Exact cache hit")
+        return cached, []
+    
+    aggregate = await plan_and_execute_async(question)
+    if aggregate is not None:
+        return await _answer_aggregate_async(question, aggregate, version), aggregate["messages"]
+    
+    query_filter = extract_filters(question)
+    question_embedding = None
+    try:
+        async with span("embed_query"), asyncio.timeout(EMBED_TIMEOUT):
+            question_embedding = await get_query_embedding_async(question)
+    except TimeoutError:
+        print(f"⏱️ Query embedding timed out after {EMBED_TIMEOUT}s")
+        raise
+    except Exception as e:
+        # Search would only embed it again; without context the LLM can't answer anyway
+        print(f"❌ Error generating query embedding: {e}")
+        return f"Error embedding the question: {e}", []
+    
+    if query_filter is None:
+        cached = cache.get_similar(question_embedding, version)
+        if cached is not None:
+            return cached, []
+    
+    relevant_messages = await search_relevant_messages_async(
+        question, top_k=15, query_embedding=question_embedding, with_vectors=CONTEXT_DEDUP, query_filter=query_filter
+    )
+
+    if relevant_messages is None:
+        return NOT_INITIALIZED, []
+    if not relevant_messages:
+        return RETRIEVAL_FAILED, []  # search failed: don't pay for a no-context answer
+
+    try:
+        answer = await _complete_async(question, relevant_messages)
+        await cache.put_async(question, answer, version, question_embedding if query_filter is None else None)
+        return answer, relevant_messages
+
+    except TimeoutError:
+        print(f"⏱️ LLM call timed out after {LLM_TIMEOUT}s")
+        raise
+    except Overloaded as e:
+        print(f"🚦 LLM call shed: {e}")
+        raise
+    except Exception as e:
+        print(f"✗ Error calling LLM: {e}")
+        return f"Error generating answer: {str(e)}", []
+
+
+async def _answer_in_session_async(question: str, session: Session, version: str) -> str:
+    """
+    A standalone question runs the normal pipeline (answer cache and all) and
+    its messages become the session's context; a follow-up reuses them.
+    """
+    async with session.lock:
+        query_filter = extract_filters(question)
+        named = query_filter.user_names if query_filter else []
+        if session.is_follow_up(question, named):
+            answer = await _answer_follow_up_async(question, session, version, query_filter)
+        else:
+            answer, relevant_messages = await _answer_shared_async(question, version)
+            session.set_messages(relevant_messages, version)
+        session.record(question, answer)
+        return answer
+
+
+async def _answer_follow_up_async(question: str, session: Session, version: str, query_filter: Optional[SearchFilter]) -> str:
+    """
+    Answer against the session's packed context plus its earlier turns.
+    If the session has usable messages, no embedding or vector search is done:
+    a BM25 lookup restricted to the session's members (and any dates in the
+    question) adds up to SESSION_EXTEND_K messages for words the earlier
+    retrieval didn't cover. Otherwise (first turn was a cache hit, or the
+    dataset changed since) the question is retrieved together with the
+    previous one. Follow-up answers depend on the conversation, so they
+    bypass the answer cache.
+    """
+    if session.messages and session.version == version:
+        CACHE_LOOKUPS.inc(1, "session_context", "hit")
+        extension_filter = SearchFilter(
+            session.members(),
+            query_filter.since if query_filter else None,
+            query_filter.until if query_filter else None
+        )
+        hits = await asyncio.to_thread(get_keyword_index().search, question, SESSION_EXTEND_K, extension_filter)
+        if session.add_messages(to_messages(hits)):
+            print(f"🧵 Follow-up: extended session context to {len(session.messages)} messages")
+    else:
+        CACHE_LOOKUPS.inc(1, "session_context", "miss")
+        previous = session.turns[-1][0]
+        relevant_messages = await search_relevant_messages_async(
+            f"{previous} {question}", top_k=15, with_vectors=CONTEXT_DEDUP,
+            query_filter=query_filter or extract_filters(previous)
+        )
+        if relevant_messages is None:
+            return NOT_INITIALIZED
+        session.set_messages(relevant_messages, version)
+
+    if session.context is None:
+        session.context = prepare_context(session.messages)
+    try:
+        return await _complete_async(question, session.messages, context=session.context, history=session.summary())
+    except TimeoutError:
+        print(f"⏱️ LLM call timed out after {LLM_TIMEOUT}s")
+        raise
+    except Overloaded as e:
+        print(f"🚦 LLM call shed: {e}")
+        raise
     except Exception as e:
         print(f"✗ Error calling LLM: {e}")
         return f"Error generating answer: {str(e)}"
+
+
+async def _answer_aggregate_async(question: str, aggregate: Dict, version: str) -> str:
+    if "answer" in aggregate:
+        return aggregate["answer"]  # computed, no LLM needed (and never stale-cached)
+    try:
+        answer = await _complete_async(question, aggregate["messages"], aggregate)
+    except TimeoutError:
+        print(f"⏱️ LLM call timed out after {LLM_TIMEOUT}s")
+        raise
+    except Overloaded as e:
+        print(f"🚦 LLM call shed: {e}")
+        raise
+    except Exception as e:
+        print(f"✗ Error calling LLM: {e}")
+        return f"Error generating answer: {str(e)}"
+    await get_answer_cache().put_async(question, answer, version)  # exact only: no embedding was made
+    return answer
+
+
+async def generate_answers_batch_async(questions: List[str]) -> List[Dict]:
+    """
+    Answer many questions at once: cache lookups, aggregate questions via the
+    query planner, then one multi-input embedding request and one batched
+    search for the rest, then the LLM calls concurrently (at most
+    BATCH_LLM_CONCURRENCY in flight).
+    Returns one {"question", "answer"} or {"question", "error"} per input, in order.
+    """
+    cache = get_answer_cache()
+    version = await get_dataset_version_async()
+    results: List[Dict] = [None] * len(questions)
+    
+    pending = []
+    for idx, question in enumerate(questions):
+        cached = cache.get_exact(question, version)
+        if cached is not None:
+            results[idx] = {"question": question, "answer": cached}
+        else:
+            pending.append(idx)
+    
+    def fail(indices: List[int], error: str):
+        for idx in indices:
+            results[idx] = {"question": questions[idx], "error": error}
+    
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    
+    async def answer_aggregate(idx: int, aggregate: Dict):
+        question = questions[idx]
+        async with semaphore:
+            try:
+                answer = await _answer_aggregate_async(question, aggregate, version)
+            except TimeoutError:
+                results[idx] = {"question": question, "error": "Timed out while generating the answer"}
+                return
+            except Overloaded:
+                results[idx] = {"question": question, "error": OVERLOADED}
+                return
+        results[idx] = {"question": question, "answer": answer}
+    
+    # Aggregate questions bypass embedding and search entirely
+    aggregates = await asyncio.gather(*(plan_and_execute_async(questions[idx]) for idx in pending))
+    llm_jobs = [answer_aggregate(idx, aggregate) for idx, aggregate in zip(pending, aggregates) if aggregate is not None]
+    pending = [idx for idx, aggregate in zip(pending, aggregates) if aggregate is None]
+    
+    embeddings: List[List[float]] = []
+    if pending:
+        try:
+            async with span("embed_query_batch"), asyncio.timeout(EMBED_TIMEOUT):
+                embeddings = await get_query_embeddings_async([questions[idx] for idx in pending])
+        except TimeoutError:
+            fail(pending, "Timed out while embedding the questions")
+            pending = []
+        except Exception as e:
+            fail(pending, f"Error embedding questions: {e}")
+            pending = []
+    
+    query_filters = {idx: extract_filters(questions[idx]) for idx in pending}
+    to_search = []
+    for idx, embedding in zip(pending, embeddings):
+        cached = cache.get_similar(embedding, version) if query_filters[idx] is None else None
+        if cached is not None:
+            results[idx] = {"question": questions[idx], "answer": cached}
+        else:
+            to_search.append((idx, embedding))
+    
+    if to_search:
+        try:
+            retrieved = await search_relevant_messages_batch_async(
+                [questions[idx] for idx, _ in to_search],
+                [embedding for _, embedding in to_search],
+                top_k=15,
+                with_vectors=CONTEXT_DEDUP,
+                query_filters=[query_filters[idx] for idx, _ in to_search]
+            )
+        except TimeoutError:
+            retrieved = []
+            fail([idx for idx, _ in to_search], "Timed out while retrieving messages")
+        except Exception as e:
+            retrieved = []
+            fail([idx for idx, _ in to_search], f"Search error: {e}")
+        
+        if retrieved is None:
+            for idx, _ in to_search:
+                results[idx] = {"question": questions[idx], "answer": NOT_INITIALIZED}
+        elif retrieved:
+            async def answer_one(idx: int, embedding: List[float], relevant_messages: List[Dict]):
+                question = questions[idx]
+                if not relevant_messages:
+                    results[idx] = {"question": question, "error": RETRIEVAL_FAILED}
+                    return
+                async with semaphore:
+                    try:
+                        answer = await _complete_async(question, relevant_messages)
+                    except TimeoutError:
+                        results[idx] = {"question": question, "error": "Timed out while generating the answer"}
+                        return
+                    except Overloaded:
+                        results[idx] = {"question": question, "error": OVERLOADED}
+                        return
+                    except Exception as e:
+                        results[idx] = {"question": question, "error": f"Error generating answer: {e}"}
+                        return
+                await cache.put_async(question, answer, version, embedding if query_filters[idx] is None else None)
+                results[idx] = {"question": question, "answer": answer}
+            
+            llm_jobs.extend(
+                answer_one(idx, embedding, relevant_messages)
+                for (idx, embedding), relevant_messages in zip(to_search, retrieved)
+            )
+    
+    await asyncio.gather(*llm_jobs)
+    return results
+
+
+async def stream_answer_async(question: str) -> AsyncIterator[Dict]:
+    """
+    Yield {"event", "data"} dicts for /ask/stream:
+    "retrieval" (matched message ids) as soon as search finishes, then one
+    "token" per streamed delta, then "done" - or "error" if a stage fails.
+    Aggregate questions report the messages behind the exact summary instead.
+    """
+    aggregate = await plan_and_execute_async(question)
+    if aggregate is not None:
+        relevant_messages = aggregate["messages"]
+    else:
+        try:
+            relevant_messages = await search_relevant_messages_async(
+                question, top_k=15, with_vectors=CONTEXT_DEDUP, query_filter=extract_filters(question)
+            )
+        except TimeoutError:
+            yield {"event": "error", "data": {"error": "Timed out while retrieving messages"}}
+            return
+
+    if relevant_messages is None:
+        yield {"event": "error", "data": {"error": NOT_INITIALIZED}}
+        return
+
+    yield {
+        "event": "retrieval",
+        "data": {
+            "message_ids": [msg["id"] for msg in relevant_messages],
+            "count": len(relevant_messages)
+        }
+    }
+
+    if aggregate is not None and "answer" in aggregate:
+        yield {"event": "token", "data": {"text": aggregate["answer"]}}
+        yield {"event": "done", "data": {"answer": aggregate["answer"]}}
+        return
+
+    client = get_async_llm_client()
+    chat_messages = build_chat_messages(question, relevant_messages, aggregate)
+    answer_parts = []
+
+    admission = get_llm_admission()
+    try:
+        await admission.acquire()
+    except Overloaded as e:
+        print(f"🚦 LLM stream shed: {e}")
+        yield {"event": "error", "data": {"error": OVERLOADED, "retry_after": e.retry_after}}
+        return
+
+    # One deadline for the whole generation, but never yield inside a timeout
+    # block: the cancellation would land in the consumer instead of here.
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + LLM_TIMEOUT
+    first_token_seen = False
+
+    try:
+        async with asyncio.timeout_at(deadline):
+            stream = await client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=chat_messages,
+                temperature=0,
+                max_tokens=200,
+                stream=True
+            )
+        chunks = stream.__aiter__()
+
+        while True:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            if chunk.usage is not None:  # only sent by servers that report usage on streams
+                LLM_TOKENS.inc(chunk.usage.prompt_tokens or 0, "prompt")
+                LLM_TOKENS.inc(chunk.usage.completion_tokens or 0, "completion")
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not first_token_seen:
+                    first_token_seen = True
+                    record_stage("llm_first_token", loop.time() - started)
+                answer_parts.append(delta)
+                yield {"event": "token", "data": {"text": delta}}
+
+        record_stage("llm_stream", loop.time() - started)
+        print(f"✓ Streamed answer from LLM")
+        yield {"event": "done", "data": {"answer": "".join(answer_parts).strip()}}
+
+    except TimeoutError:
+        print(f"⏱️ LLM stream timed out after {LLM_TIMEOUT}s")
+        yield {"event": "error", "data": {"error": "Timed out while generating the answer"}}
+    except Exception as e:
+        print(f"✗ Error streaming from LLM: {e}")
+        yield {"event": "error", "data": {"error": f"Error generating answer: {str(e)}"}}
+    finally:
+        admission.release()
@@ -0,0 +1,6 @@
+# benchmarks - offline load/latency benchmarks against local stand-ins
+#
+#   python -m benchmarks.run ask --messages 3k --concurrency 16 --requests 500
+#   python -m benchmarks.run refresh --messages 100k --output bench.jsonl
+#   python -m benchmarks.retrieval --messages 20k --queries 200 --output retrieval.jsonl
+#   python -m benchmarks.compare before.jsonl after.jsonl
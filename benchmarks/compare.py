@@ -0,0 +1,77 @@
+# benchmarks/compare.py - diff two benchmark result files (JSONL from run.py / retrieval.py --output)
+#
+#   python -m benchmarks.compare before.jsonl after.jsonl
+import sys
+import json
+from typing import Dict, List, Optional, Tuple
+
+# (label, path into the report, lower is better)
+METRICS = [
+    ("throughput rps", ("throughput_rps",), False),
+    ("p50 ms", ("latency_ms", "p50"), True),
+    ("p95 ms", ("latency_ms", "p95"), True),
+    ("p99 ms", ("latency_ms", "p99"), True),
+    ("refresh s", ("seconds",), True),
+    ("recall@k", ("recall",), False),
+    ("MRR", ("mrr",), False),
+]
+
+
+def load(path: str) -> Dict[Tuple, Dict]:
+    """Last report per (scenario, config) in the file"""
+    reports = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                report = json.loads(line)
+                reports[(report["scenario"], json.dumps(report["config"], sort_keys=True))] = report
+    return reports
+
+
+def _get(section: Dict, path: Tuple[str, ...]) -> Optional[float]:
+    for key in path:
+        if not isinstance(section, dict) or key not in section:
+            return None
+        section = section[key]
+    return section
+
+
+def compare(before: Dict, after: Dict) -> List[str]:
+    lines = []
+    sections = sorted(set(before["results"]) | set(after["results"]))
+    for name in sections:
+        old, new = before["results"].get(name), after["results"].get(name)
+        if not isinstance(old, dict) or not isinstance(new, dict):
+            continue
+        for label, path, lower_is_better in METRICS:
+            a, b = _get(old, path), _get(new, path)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a * 100 if a else 0.0
+            better = (change < 0) == lower_is_better if change else None
+            marker = "" if better is None else (" ✓" if better else " ✗")
+            lines.append(f"  {name:<20} {label:<15} {a:>10.2f} -> {b:>10.2f}  ({change:+.1f}%){marker}")
+    a, b = before["results"].get("peak_rss_mb"), after["results"].get("peak_rss_mb")
+    if a and b:
+        lines.append(f"  {'peak rss':<20} {'MB':<15} {a:>10.1f} -> {b:>10.1f}  ({(b - a) / a * 100:+.1f}%)")
+    return lines
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("usage: python -m benchmarks.compare BEFORE.jsonl AFTER.jsonl")
+        sys.exit(2)
+    before, after = load(sys.argv[1]), load(sys.argv[2])
+    for key in sorted(set(before) & set(after)):
+        old, new = before[key], after[key]
+        config = old["config"]
+        print(f"{key[0]} ({config['messages']} messages, concurrency {config['concurrency']}, {config['backend']}): "
+              f"{old['commit']} -> {new['commit']}")
+        print("\n".join(compare(old, new)) or "  (nothing comparable)")
+    unmatched = set(before) ^ set(after)
+    if unmatched:
+        print(f"{len(unmatched)} result(s) without a counterpart in the other file")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# benchmarks/corpus.py - deterministic synthetic messages, questions and vectors
+import uuid
+import random
+import hashlib
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+FIRST_NAMES = [
+    "Layla", "Vikram", "Amira", "Sophia", "Armand", "Hans", "Fatima", "Lorenzo", "Thiago", "Lily",
+    "Mei", "Omar", "Priya", "Noah", "Elena", "Kenji", "Zara", "Mateo", "Ingrid", "Kwame"
+]
+LAST_NAMES = [
+    "Kawaguchi", "Desai", "Al-Farsi", "Dupont", "Müller", "El-Sayed", "Cavalli", "Monteiro", "O'Sullivan",
+    "Chen", "Haddad", "Nair", "Fischer", "Rossi", "Tanaka", "Okafor", "Lindqvist", "Mensah", "Silva", "Novak"
+]
+REQUESTS = [
+    "Please book a table for {n} at {place} on {day}.",
+    "Can you arrange a private car to {place} this {day}?",
+    "I need two tickets to the opera in {city} next month.",
+    "Update my phone number to 555-{n}{n}{n}-{n}{n}{n}{n}.",
+    "Book me a suite in {city} for {n} nights starting {day}.",
+    "Could you find a yoga instructor for my stay in {city}?",
+    "Please confirm my flight to {city} on {day}.",
+    "What is the status of my reservation at {place}?",
+]
+PLACES = ["Nobu", "The Ritz", "Le Bernardin", "Osteria Francescana", "Sketch", "Eleven Madison Park"]
+CITIES = ["London", "Milan", "Paris", "Tokyo", "New York", "Dubai", "Lisbon", "Singapore"]
+DAYS = ["Monday", "Tuesday", "Friday", "Saturday", "next weekend", "June 3rd"]
+TOPICS = ["restaurants", "travel plans", "cars", "hotel bookings", "tickets", "phone number"]
+
+N_USERS = len(FIRST_NAMES) * len(LAST_NAMES)
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def user_name(user: int) -> str:
+    return f"{FIRST_NAMES[user % len(FIRST_NAMES)]} {LAST_NAMES[user // len(FIRST_NAMES) % len(LAST_NAMES)]}"
+
+
+def make_message(i: int, seed: int = 0) -> Dict:
+    """Message i of the corpus; the same (i, seed) always gives the same message"""
+    rng = random.Random(f"{seed}:{i}")
+    user = rng.randrange(N_USERS)
+    text = rng.choice(REQUESTS).format(
+        n=rng.randint(1, 9), place=rng.choice(PLACES), city=rng.choice(CITIES), day=rng.choice(DAYS)
+    )
+    return {
+        "id": str(uuid.UUID(int=(seed << 64) | i)),
+        "user_id": str(uuid.UUID(int=(seed << 96) | user)),
+        "user_name": user_name(user),
+        "timestamp": (EPOCH + timedelta(seconds=i * 37)).isoformat(),
+        "message": text
+    }
+
+
+def make_question(i: int, seed: int = 0) -> str:
+    rng = random.Random(f"q{seed}:{i}")
+    return f"What did {user_name(rng.randrange(N_USERS))} say about {rng.choice(TOPICS)}? (#{i})"
+
+
+def seeded_vector(text: str, dim: int) -> np.ndarray:
+    """Stand-in embedding: a float32 normal vector seeded by the text's hash"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim, dtype=np.float32)
+
+
+def parse_size(value: str) -> int:
+    """3000, 3k, 100k, 1m -> int"""
+    value = value.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
@@ -0,0 +1,124 @@
+# benchmarks/fake_services.py - local stand-ins for the message feed, NVIDIA embeddings and chat
+#
+#   python -m benchmarks.fake_services --port 8765 --messages 3000 --embed-latency-ms 20
+import json
+import time
+import random
+import asyncio
+import argparse
+from fastapi import FastAPI, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from benchmarks.corpus import make_message, seeded_vector
+
+config = {
+    "messages": 3000,
+    "seed": 0,
+    "dim": 1024,
+    "embed_latency_ms": 20.0,
+    "embed_latency_per_input_ms": 0.1,
+    "embed_429_rate": 0.0,
+    "chat_latency_ms": 300.0,
+    "chat_tokens": 20,
+    "feed_latency_ms": 5.0,
+}
+counters = {"pages": 0, "embedding_requests": 0, "embedding_inputs": 0, "rate_limited": 0, "chat_requests": 0}
+_rng = random.Random(0)
+
+app = FastAPI(title="qa-system benchmark stand-ins")
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "config": config}
+
+
+@app.get("/counters")
+def get_counters():
+    return counters
+
+
+@app.get("/messages/")
+async def messages(skip: int = Query(0), limit: int = Query(100)):
+    await asyncio.sleep(config["feed_latency_ms"] / 1000)
+    counters["pages"] += 1
+    end = min(skip + limit, config["messages"])
+    return {"items": [make_message(i, config["seed"]) for i in range(skip, end)], "total": config["messages"]}
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    counters["embedding_requests"] += 1
+
+    if _rng.random() < config["embed_429_rate"]:
+        counters["rate_limited"] += 1
+        return JSONResponse(status_code=429, content={"error": "rate limited"}, headers={"Retry-After": "0.2"})
+
+    await asyncio.sleep((config["embed_latency_ms"] + config["embed_latency_per_input_ms"] * len(texts)) / 1000)
+    counters["embedding_inputs"] += len(texts)
+    return {
+        "object": "list",
+        "model": body.get("model"),
+        "data": [
+            {"object": "embedding", "index": idx, "embedding": seeded_vector(text, config["dim"]).tolist()}
+            for idx, text in enumerate(texts)
+        ]
+    }
+
+
+def _completion(content: str, prompt_tokens: int) -> dict:
+    return {
+        "id": "bench", "object": "chat.completion", "created": int(time.time()), "model": "bench",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": config["chat_tokens"],
+            "total_tokens": prompt_tokens + config["chat_tokens"]
+        }
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["chat_requests"] += 1
+    prompt_tokens = sum(len(m.get("content", "")) for m in body["messages"]) // 4
+    words = [f"word{i}" for i in range(config["chat_tokens"])]
+
+    if not body.get("stream"):
+        await asyncio.sleep(config["chat_latency_ms"] / 1000)
+        return _completion(" ".join(words), prompt_tokens)
+
+    async def stream():
+        # Spread the latency over the tokens, like a real decoder
+        delay = config["chat_latency_ms"] / 1000 / max(1, len(words))
+        for word in words:
+            await asyncio.sleep(delay)
+            chunk = {
+                "id": "bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": "bench",
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake message feed, embeddings and chat services")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    for key, value in config.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    for key in config:
+        config[key] = getattr(args, key)
+    _rng.seed(config["seed"])
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
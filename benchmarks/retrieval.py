@@ -0,0 +1,287 @@
+# benchmarks/retrieval.py - recall@k, MRR, latency and memory of each search profile vs exact search
+#
+#   python -m benchmarks.retrieval --messages 20k --queries 200 --k 15
+#   python -m benchmarks.retrieval --qdrant-url http://localhost:6333 --profiles default,hnsw_m8,scalar,binary
+#   python -m benchmarks.retrieval --from-collection --questions labelled.jsonl --qdrant-url http://localhost:6333
+#
+# Every profile gets its own scratch collection holding the same vectors. The
+# ground truth is brute-force float32 cosine in NumPy, so recall@k says how many
+# of the exact top k a profile returned. MRR is taken against the labels: with
+# synthetic data each query is a noisy copy of one message, which is its label;
+# --questions takes JSONL lines {"question": ..., "relevant_ids": [point ids]}
+# (the ids /ask/stream reports) and embeds the questions with the embedding service.
+#
+# Without --qdrant-url the profiles run in embedded Qdrant, which always does
+# a full scan and ignores HNSW / quantization / on-disk settings. That still
+# checks the harness and payload selection, but use a real server to choose
+# HNSW or quantization settings. The local_float16 / local_int8 rows
+# (VECTOR_BACKEND=local) are measured for real either way.
+import os
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import numpy as np
+from typing import Dict, List, Tuple
+from benchmarks.corpus import make_message, seeded_vector, parse_size
+from benchmarks.run import _git_commit, _rss_mb
+
+LOCAL_DTYPES = ("float16", "int8")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def synthetic_corpus(count: int, seed: int) -> Tuple[List[str], List[Dict], np.ndarray]:
+    """(point ids, payloads, vectors) for benchmark messages [0, count)"""
+    from vector_store import message_point_id, message_payload, message_to_text, EXPECTED_DIM
+
+    messages = [make_message(i, seed) for i in range(count)]
+    vectors = np.stack([seeded_vector(message_to_text(msg), EXPECTED_DIM) for msg in messages])
+    return [message_point_id(msg) for msg in messages], [message_payload(msg) for msg in messages], vectors
+
+
+def live_corpus() -> Tuple[List[str], List[Dict], np.ndarray]:
+    """Every point of the live collection (QDRANT_URL / QDRANT_LOCATION), vectors included"""
+    from vector_store import get_client, COLLECTION_NAME
+
+    ids, payloads, vectors = [], [], []
+    offset = None
+    while True:
+        records, offset = get_client().scroll(
+            collection_name=COLLECTION_NAME, limit=1000, offset=offset, with_payload=True, with_vectors=True
+        )
+        for r in records:
+            ids.append(str(r.id))
+            payloads.append({k: v for k, v in r.payload.items() if k != "sync_run"})
+            vectors.append(r.vector)
+        if offset is None:
+            return ids, payloads, np.asarray(vectors, dtype=np.float32)
+
+
+def synthetic_queries(ids: List[str], vectors: np.ndarray, count: int, noise: float, seed: int) -> Tuple[np.ndarray, List[List[str]]]:
+    """Each query is one message's vector plus Gaussian noise (`noise` x its norm); that message is the label"""
+    rng = np.random.default_rng(seed)
+    targets = rng.choice(len(ids), size=min(count, len(ids)), replace=False)
+    base = _normalize(vectors[targets].astype(np.float32))
+    queries = base + noise * rng.standard_normal(base.shape, dtype=np.float32) / np.sqrt(base.shape[1])
+    return queries, [[ids[t]] for t in targets]
+
+
+def labelled_queries(path: str) -> Tuple[np.ndarray, List[List[str]]]:
+    from vector_store import get_query_embeddings_async
+    from http_clients import aclose_async_client
+
+    with open(path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+
+    async def embed():
+        try:
+            return await get_query_embeddings_async([row["question"] for row in rows])
+        finally:
+            await aclose_async_client()
+
+    return np.asarray(asyncio.run(embed()), dtype=np.float32), [[str(i) for i in row["relevant_ids"]] for row in rows]
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int, block_rows: int = 65536) -> np.ndarray:
+    """Row indices of the exact top k (cosine) for every query, best first"""
+    queries = _normalize(queries.astype(np.float32))
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = _normalize(np.asarray(vectors[start:start + block_rows], dtype=np.float32))
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+        keep = np.argsort(-scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_rows = np.take_along_axis(rows, keep, axis=1)
+    return best_rows
+
+
+def quality(returned: List[List[str]], exact: List[List[str]], labels: List[List[str]], k: int) -> Dict:
+    recall = np.mean([len(set(got[:k]) & set(truth[:k])) / min(k, len(truth)) for got, truth in zip(returned, exact)])
+    ranks = []
+    for got, relevant in zip(returned, labels):
+        rank = next((i + 1 for i, point_id in enumerate(got[:k]) if point_id in relevant), None)
+        ranks.append(1 / rank if rank else 0.0)
+    return {
+        "recall": round(float(recall), 4),
+        "mrr": round(float(np.mean(ranks)), 4),
+        "hit_rate": round(float(np.mean([r > 0 for r in ranks])), 4)
+    }
+
+
+def latency_summary(latencies: List[float]) -> Dict:
+    values = np.asarray(latencies) * 1000
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3)
+    }
+
+
+def estimated_memory_mb(profile, count: int, dim: int) -> float:
+    """RAM Qdrant needs for the vectors and graph of this profile (payloads not included)"""
+    vector_bytes = 0 if profile.on_disk else count * dim * 4
+    if profile.quantization == "scalar":
+        vector_bytes += count * dim
+    elif profile.quantization == "binary":
+        vector_bytes += count * dim // 8
+    graph_bytes = count * 2 * (profile.m or 16) * 4  # layer-0 links dominate
+    return round((vector_bytes + graph_bytes) / 2**20, 1)
+
+
+def _points(ids: List[str], payloads: List[Dict], vectors: np.ndarray, start: int, stop: int):
+    from qdrant_client.models import PointStruct
+
+    return [PointStruct(id=ids[i], vector=vectors[i].tolist(), payload=payloads[i]) for i in range(start, stop)]
+
+
+def wait_until_indexed(backend, timeout: float = 900) -> Dict:
+    """Wait for the collection's optimizers to finish; returns indexed vs total points"""
+    from qdrant_client.models import CollectionStatus
+
+    deadline = time.monotonic() + timeout
+    while True:
+        info = backend.client.get_collection(backend.collection_name)
+        if info.status == CollectionStatus.GREEN or time.monotonic() > deadline:
+            return {"indexed_vectors": info.indexed_vectors_count, "points": info.points_count, "status": str(info.status.value)}
+        time.sleep(0.5)
+
+
+def run_backend(backend, ids, payloads, vectors, queries, k: int, batch_size: int = 500) -> Tuple[List[List[str]], Dict]:
+    """Load the vectors into `backend`, then time one search per query"""
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    backend.ensure_collection(force_recreate=True)
+    for start in range(0, len(ids), batch_size):
+        backend.upsert(_points(ids, payloads, vectors, start, min(len(ids), start + batch_size)))
+    backend.flush()
+    stats = {"load_seconds": round(time.perf_counter() - started, 3)}
+    if hasattr(backend, "client"):
+        stats.update(wait_until_indexed(backend))
+    stats["rss_delta_mb"] = round(_rss_mb() - rss_before, 1)
+
+    backend.search(queries[0].tolist(), k)  # warm up
+    returned, latencies = [], []
+    for query in queries:
+        query = query.tolist()
+        started = time.perf_counter()
+        hits = backend.search(query, k)
+        latencies.append(time.perf_counter() - started)
+        returned.append([hit["id"] for hit in hits])
+    stats["latency_ms"] = latency_summary(latencies)
+    stats["payload_bytes_per_hit"] = round(float(np.mean([len(json.dumps(hit["payload"])) for hit in hits])), 1) if hits else 0
+    return returned, stats
+
+
+def main():
+    from vector_store import SEARCH_PROFILES
+
+    parser = argparse.ArgumentParser(description="Retrieval quality vs latency for each search profile")
+    parser.add_argument("--messages", type=parse_size, default="20k", help="synthetic corpus size: 3k, 20k, 100k, ...")
+    parser.add_argument("--queries", type=int, default=200, help="synthetic labelled queries")
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--noise", type=float, default=8.0, help="synthetic query noise, relative to the vector norm")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profiles", default=",".join(SEARCH_PROFILES), help="comma-separated SEARCH_PROFILES names")
+    parser.add_argument("--no-local", action="store_true", help="skip the local_float16 / local_int8 rows")
+    parser.add_argument("--qdrant-url", default=None, help="Qdrant server for the scratch collections (default: embedded)")
+    parser.add_argument("--from-collection", action="store_true", help="use the live collection's vectors instead of synthetic ones")
+    parser.add_argument("--questions", default=None, help="labelled JSONL; needs --from-collection")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch collections")
+    parser.add_argument("--output", default=None, help="append the JSON result to this .jsonl file")
+    args = parser.parse_args()
+    if args.questions and not args.from_collection:
+        parser.error("--questions labels point ids of the live collection; add --from-collection")
+    unknown = [name for name in args.profiles.split(",") if name not in SEARCH_PROFILES]
+    if unknown:
+        parser.error(f"unknown profiles: {', '.join(unknown)} (one of {', '.join(SEARCH_PROFILES)})")
+
+    from qdrant_client import QdrantClient
+    from vector_store import QdrantBackend
+    from local_index import LocalBackend
+
+    started = time.perf_counter()
+    ids, payloads, vectors = live_corpus() if args.from_collection else synthetic_corpus(args.messages, args.seed)
+    if args.questions:
+        queries, labels = labelled_queries(args.questions)
+    else:
+        queries, labels = synthetic_queries(ids, vectors, args.queries, args.noise, args.seed)
+    print(f"📦 {len(ids)} vectors, {len(queries)} queries ({time.perf_counter() - started:.1f}s)")
+
+    exact_rows = exact_top_k(vectors, queries, args.k)
+    exact = [[ids[row] for row in rows] for rows in exact_rows]
+    results = {"numpy_exact": quality(exact, exact, labels, args.k)}
+
+    client = QdrantClient(url=args.qdrant_url, api_key=os.getenv("QDRANT_API_KEY"), timeout=300) if args.qdrant_url else QdrantClient(location=":memory:")
+    if not args.qdrant_url:
+        print("⚠️ Embedded Qdrant ignores HNSW / quantization settings; pass --qdrant-url to measure them")
+    for name in args.profiles.split(","):
+        profile = SEARCH_PROFILES[name]
+        backend = QdrantBackend(client, f"retrieval_bench_{name}", profile)
+        print(f"⏱️ {name}: {profile.describe()}")
+        returned, stats = run_backend(backend, ids, payloads, vectors, queries, args.k)
+        results[name] = {
+            **quality(returned, exact, labels, args.k),
+            **stats,
+            "estimated_memory_mb": estimated_memory_mb(profile, len(ids), vectors.shape[1]),
+            "profile": profile.describe()
+        }
+        if not args.keep:
+            backend.drop()
+
+    if not args.no_local:
+        workdir = tempfile.mkdtemp(prefix="qa-retrieval-")
+        try:
+            for dtype in LOCAL_DTYPES:
+                backend = LocalBackend(os.path.join(workdir, dtype), dtype)
+                print(f"⏱️ local_{dtype}")
+                returned, stats = run_backend(backend, ids, payloads, vectors, queries, args.k)
+                results[f"local_{dtype}"] = {
+                    **quality(returned, exact, labels, args.k),
+                    **stats,
+                    "estimated_memory_mb": round(vectors.shape[0] * vectors.shape[1] * np.dtype(dtype).itemsize / 2**20, 1)
+                }
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'':<16} {'recall@' + str(args.k):>10} {'MRR':>7} {'p50 ms':>8} {'p99 ms':>8} {'est MB':>8}")
+    for name, row in results.items():
+        latency = row.get("latency_ms")
+        timing = f"{latency['p50']:>8.2f} {latency['p99']:>8.2f} {row['estimated_memory_mb']:>8.1f}" if latency else f"{'-':>8} {'-':>8} {'-':>8}"
+        print(f"{name:<16} {row['recall']:>10.3f} {row['mrr']:>7.3f} {timing}")
+
+    report = {
+        "scenario": "retrieval",
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "config": {
+            "messages": len(ids),
+            "queries": len(queries),
+            "k": args.k,
+            "noise": None if args.questions else args.noise,
+            "seed": args.seed,
+            "concurrency": 1,
+            "backend": args.qdrant_url or "embedded",
+            "source": "live" if args.from_collection else "synthetic",
+            "labels": args.questions or "synthetic",
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+
+if __name__ == "__main__":
+    main()
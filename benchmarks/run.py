@@ -0,0 +1,354 @@
+# benchmarks/run.py - drive /ask, /refresh or /stats against local stand-ins and report JSON
+#
+#   python -m benchmarks.run ask --messages 3k --concurrency 16 --requests 500
+#   python -m benchmarks.run refresh --messages 100k --preseeded 0.9 --concurrency 4 --requests 200
+#   python -m benchmarks.run stats --messages 1m --backend local --concurrency 8 --requests 100
+#
+# The app runs in this process (driven through httpx's ASGI transport, lifespan
+# included); the message feed, embeddings and chat model are served by
+# benchmarks.fake_services in a subprocess, and Qdrant runs embedded in memory.
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import resource
+import httpx
+import numpy as np
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+from benchmarks.corpus import make_message, make_question, seeded_vector, parse_size
+
+SCENARIOS = ("ask", "refresh", "stats")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RSSSampler:
+    """Peak resident set size while the measured phase runs (sampled every 50ms)"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = _rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_mb())
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_fake_services(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "benchmarks.fake_services",
+        "--port", str(port),
+        "--messages", str(args.messages),
+        "--seed", str(args.seed),
+        "--embed-latency-ms", str(args.embed_latency_ms),
+        "--embed-429-rate", str(args.embed_429_rate),
+        "--chat-latency-ms", str(args.chat_latency_ms),
+    ]
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("fake services exited during startup")
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("fake services did not start within 30s")
+
+
+def configure_environment(args, workdir: str, port: int):
+    """Point the app at the stand-ins and a scratch data dir (must run before importing it)"""
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        "VECTOR_BACKEND": args.backend,
+        "QDRANT_LOCATION": ":memory:",
+        "EMBEDDING_URL": f"{base}/v1/embeddings",
+        "NVIDIA_BASE_URL": f"{base}/v1",
+        "NVIDIA_API_KEY": "benchmark",
+        "MESSAGES_API_URL": f"{base}/messages/",
+        "ANSWER_CACHE_PERSIST": "false",
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "local_index"),
+        "KEYWORD_INDEX_PATH": os.path.join(workdir, "keyword_index.npz"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite"),
+        "MESSAGE_SNAPSHOT_PATH": os.path.join(workdir, "messages.jsonl.zst"),
+        "SHARED_CORPUS_DIR": os.path.join(workdir, "corpus"),
+        "DATASET_VERSION_PATH": os.path.join(workdir, "dataset_version"),
+        "INGEST_CHECKPOINT_PATH": os.path.join(workdir, "ingest_checkpoint.json"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "answer_cache.sqlite"),
+        "PROFILE_DIR": os.path.join(workdir, "profiles"),
+    })
+    if args.embed_rate is not None:
+        os.environ["EMBED_RATE"] = str(args.embed_rate)
+        os.environ["EMBED_MAX_RATE"] = str(max(args.embed_rate, float(os.getenv("EMBED_MAX_RATE", "20"))))
+
+
+def seed_corpus(count: int, seed: int, batch_size: int = 2000):
+    """
+    Load messages [0, count) straight into the store, keyword index and
+    message snapshot - the state a finished /refresh would leave behind -
+    without going through the embedding service.
+    """
+    from qdrant_client.models import PointStruct
+    from keyword_index import get_keyword_index
+    from message_fetcher import save_snapshot
+    from vector_store import (
+        get_backend, bump_dataset_version, message_point_id, message_payload, message_to_text, EXPECTED_DIM
+    )
+
+    backend = get_backend()
+    backend.ensure_collection()
+    keyword_index = get_keyword_index()
+    messages = []
+    for start in range(0, count, batch_size):
+        chunk = [make_message(i, seed) for i in range(start, min(count, start + batch_size))]
+        ids = [message_point_id(msg) for msg in chunk]
+        payloads = [message_payload(msg) for msg in chunk]
+        backend.upsert([
+            PointStruct(id=point_id, vector=seeded_vector(message_to_text(msg), EXPECTED_DIM).tolist(), payload=payload)
+            for point_id, msg, payload in zip(ids, chunk, payloads)
+        ])
+        keyword_index.upsert(ids, payloads)
+        messages.extend(chunk)
+    backend.flush()
+    keyword_index.flush()
+    save_snapshot(messages)
+    bump_dataset_version(f"bench-{seed}-{count}")
+
+
+def summarize(latencies: List[float], statuses: Counter, wall: float) -> Dict:
+    values = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if status != 200),
+        "statuses": {str(status): n for status, n in statuses.items()},
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_ms": {
+            "mean": round(float(values.mean()), 2),
+            "p50": round(float(np.percentile(values, 50)), 2),
+            "p95": round(float(np.percentile(values, 95)), 2),
+            "p99": round(float(np.percentile(values, 99)), 2),
+            "max": round(float(values.max()), 2),
+        } if len(values) else None
+    }
+
+
+async def run_load(client, send: Callable, total: int, concurrency: int, stop: Optional[asyncio.Event] = None) -> Dict:
+    """`total` requests (or until `stop` is set, if given) from `concurrency` workers"""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            if stop is not None and stop.is_set():
+                return
+            start = time.perf_counter()
+            try:
+                status = (await send(client, i)).status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def ask_sender(args) -> Callable:
+    async def send(client, i: int):
+        # A --repeat fraction of the questions reuse earlier ones (answer cache hits)
+        index = i % max(1, int(args.requests * (1 - args.repeat))) if args.repeat else i
+        return await client.get("/ask", params={"question": make_question(index, args.seed)})
+    return send
+
+
+async def scenario_ask(client, args) -> Dict:
+    return {"ask": await run_load(client, ask_sender(args), args.requests, args.concurrency)}
+
+
+async def scenario_stats(client, args) -> Dict:
+    async def send(client, i: int):
+        return await client.get("/stats")
+    return {"stats": await run_load(client, send, args.requests, args.concurrency)}
+
+
+async def scenario_refresh(client, args) -> Dict:
+    """One /refresh job; with --requests > 0, /ask load runs alongside until the job finishes"""
+    started = time.perf_counter()
+    response = await client.post("/refresh", params={"full": str(args.full).lower()})
+    job_id = response.json()["job"]["job_id"]
+    done = asyncio.Event()
+
+    async def poll():
+        while True:
+            job = (await client.get(f"/refresh/{job_id}")).json()
+            if job["status"] not in ("queued", "running"):
+                done.set()
+                return job
+            await asyncio.sleep(0.2)
+
+    if args.requests and args.concurrency:
+        job, ask = await asyncio.gather(
+            poll(), run_load(client, ask_sender(args), args.requests, args.concurrency, stop=done)
+        )
+    else:
+        job, ask = await poll(), None
+
+    elapsed = time.perf_counter() - started
+    total = (job.get("result") or {}).get("total") or 0
+    result = {
+        "refresh": {
+            "status": job["status"],
+            "error": job["error"],
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(total / elapsed, 1) if elapsed else None,
+            "job": job["result"]
+        }
+    }
+    if ask is not None:
+        result["ask_during_refresh"] = ask
+    return result
+
+
+def stage_summary() -> Dict:
+    from metrics import STAGE_SECONDS
+    return {
+        values[0]: {"count": count, "mean_ms": round(total / count * 1000, 2)}
+        for values, (count, total) in sorted(STAGE_SECONDS.totals().items()) if count
+    }
+
+
+async def run_scenario(args) -> Dict:
+    import main as app_module
+
+    app = app_module.app
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            with RSSSampler() as rss:
+                results = await globals()[f"scenario_{args.scenario}"](client, args)
+    results["peak_rss_mb"] = round(rss.peak, 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load/latency benchmark for the QA service")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--messages", type=parse_size, default="3k", help="corpus size: 3k, 100k, 1m, ...")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--backend", choices=("qdrant", "local"), default="qdrant")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=float, default=0.0, help="fraction of repeated /ask questions")
+    parser.add_argument("--preseeded", type=float, default=None,
+                        help="fraction of the corpus loaded before the run (default: 1 for ask/stats, 0 for refresh)")
+    parser.add_argument("--full", action="store_true", help="refresh: full rebuild + alias swap")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--embed-429-rate", type=float, default=0.0)
+    parser.add_argument("--embed-rate", type=float, default=None, help="override EMBED_RATE (req/s) for ingest")
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--workdir", default=None, help="scratch dir (default: a temp dir, removed afterwards)")
+    parser.add_argument("--output", default=None, help="append the JSON result to this .jsonl file")
+    args = parser.parse_args()
+    if args.preseeded is None:
+        args.preseeded = 0.0 if args.scenario == "refresh" else 1.0
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="qa-bench-")
+    port = _free_port()
+    services = start_fake_services(args, port)
+    try:
+        configure_environment(args, workdir, port)
+        seed_started = time.perf_counter()
+        seed_corpus(int(args.messages * args.preseeded), args.seed)
+        seed_seconds = time.perf_counter() - seed_started
+        rss_after_seed = _rss_mb()
+
+        results = asyncio.run(run_scenario(args))
+        service_counters = httpx.get(f"http://127.0.0.1:{port}/counters").json()
+    finally:
+        services.terminate()
+        services.wait()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "scenario": args.scenario,
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "config": {
+            "messages": args.messages,
+            "preseeded": args.preseeded,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "backend": args.backend,
+            "full": args.full,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "embed_latency_ms": args.embed_latency_ms,
+            "embed_429_rate": args.embed_429_rate,
+            "embed_rate": args.embed_rate,
+            "chat_latency_ms": args.chat_latency_ms,
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "rss_after_seed_mb": round(rss_after_seed, 1),
+        "results": results,
+        "stages": stage_summary(),
+        "services": service_counters,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+
+if __name__ == "__main__":
+    main()
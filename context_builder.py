@@ -0,0 +1,164 @@
+# context_builder.py - pack retrieved messages into a token-budgeted LLM context
+import os
+import numpy as np
+from collections import OrderedDict
+from typing import List, Dict
+from metrics import CONTEXT_TOKENS
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+CONTEXT_DEDUP = os.getenv("CONTEXT_DEDUP", "true").lower() == "true"
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.95"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CHARS_PER_TOKEN = 4  # rough, but only used to compare against the budget
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def compact_timestamp(timestamp: str) -> str:
+    """2025-05-05T07:47:20.159073+00:00 -> 2025-05-05 07:47"""
+    if len(timestamp) >= 16 and timestamp[10] == "T":
+        return f"{timestamp[:10]} {timestamp[11:16]}"
+    return timestamp
+
+
+def _message_line(msg: Dict) -> str:
+    return f"- [{compact_timestamp(msg['timestamp'])}] {msg['message']}"
+
+
+def _normalized_text(msg: Dict) -> str:
+    return " ".join(msg["message"].lower().split())
+
+
+def select_messages(
+    messages: List[Dict],
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD
+) -> List[Dict]:
+    """
+    Greedy MMR over the retrieval ranking.
+    Relevance is the hit's position in the (possibly RRF-fused) ranking scaled
+    to (0, 1]; redundancy is its highest cosine similarity to a message already
+    picked. A message from the same member that is at least `dedup_threshold`
+    similar (or has identical text, for hits without a vector) is dropped.
+    Messages are taken in MMR order while their serialized line fits `budget`.
+    """
+    n = len(messages)
+    if n == 0:
+        return []
+
+    relevance = 1.0 - np.arange(n) / n
+    has_vector = np.array([msg.get("vector") is not None for msg in messages])
+    similarity = np.zeros((n, n), dtype=np.float32)
+    if has_vector.any():
+        dim = len(next(msg["vector"] for msg in messages if msg.get("vector") is not None))
+        vectors = np.zeros((n, dim), dtype=np.float32)
+        for idx in np.flatnonzero(has_vector):
+            vectors[idx] = messages[idx]["vector"]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors /= norms
+        similarity = vectors @ vectors.T
+
+    texts = [_normalized_text(msg) for msg in messages]
+    for i in range(n):
+        for j in range(i + 1, n):
+            if texts[i] == texts[j]:
+                similarity[i, j] = similarity[j, i] = 1.0
+
+    redundancy = np.zeros(n, dtype=np.float32)
+    duplicate_of_picked = np.zeros(n, dtype=bool)
+    remaining = list(range(n))
+    selected, seen_users, used = [], set(), 0
+
+    while remaining:
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy[remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        if duplicate_of_picked[best]:
+            continue
+
+        msg = messages[best]
+        cost = estimate_tokens(_message_line(msg))
+        if msg["user_name"] not in seen_users:
+            cost += estimate_tokens(f"{msg['user_name']}:")
+        if used + cost > budget:
+            continue  # a shorter message further down may still fit
+
+        selected.append(best)
+        seen_users.add(msg["user_name"])
+        used += cost
+        redundancy = np.maximum(redundancy, similarity[best])
+        for idx in remaining:
+            if similarity[best, idx] >= dedup_threshold and messages[idx]["user_id"] == msg["user_id"]:
+                duplicate_of_picked[idx] = True
+
+    return [messages[idx] for idx in selected]
+
+
+def pack_in_order(messages: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET) -> List[Dict]:
+    """Messages in their given order (no reranking) while their serialized lines fit `budget`"""
+    selected, seen_users, used = [], set(), 0
+    for msg in messages:
+        cost = estimate_tokens(_message_line(msg))
+        if msg["user_name"] not in seen_users:
+            cost += estimate_tokens(f"{msg['user_name']}:")
+        if used + cost > budget:
+            break
+        selected.append(msg)
+        seen_users.add(msg["user_name"])
+        used += cost
+    return selected
+
+
+def serialize_messages(messages: List[Dict]) -> str:
+    """
+    One block per member, one line per message:
+
+        Sophia Al-Farsi:
+        - [2025-05-05 07:47] Please book ...
+    """
+    groups: "OrderedDict[str, List[str]]" = OrderedDict()
+    for msg in messages:
+        groups.setdefault(msg["user_name"], []).append(_message_line(msg))
+    return "\n\n".join(f"{user}:\n" + "\n".join(lines) for user, lines in groups.items())
+
+
+def build_context(messages: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Deduplicate, diversify and pack `messages` (best first) into at most ~`budget` tokens"""
+    selected = select_messages(messages, budget=budget)
+    context = serialize_messages(selected)
+    tokens = estimate_tokens(context)
+    CONTEXT_TOKENS.observe(tokens)
+    print(f"📦 Context: {len(selected)}/{len(messages)} messages, ~{tokens} tokens")
+    return context
+
+
+if __name__ == "__main__":
+    # Prompt-size report on the fixed question set: legacy layout vs packed context
+    import asyncio
+    from test_questions import test_cases
+    from http_clients import aclose_async_client
+    from vector_store import search_relevant_messages_async, message_to_text
+
+    async def report():
+        legacy_total = packed_total = 0
+        try:
+            for question in test_cases:
+                messages = await search_relevant_messages_async(question, top_k=15, with_vectors=CONTEXT_DEDUP)
+                if not messages:
+                    print(f"⚠️ No messages for: {question}")
+                    continue
+                legacy = estimate_tokens("\n---\n".join(message_to_text(msg) for msg in messages))
+                packed = estimate_tokens(build_context(messages))
+                legacy_total += legacy
+                packed_total += packed
+                print(f"{legacy:5d} -> {packed:5d} tokens  {question}")
+        finally:
+            await aclose_async_client()
+        if legacy_total:
+            print(f"Total: {legacy_total} -> {packed_total} tokens "
+                  f"({(1 - packed_total / legacy_total) * 100:.1f}% smaller)")
+
+    asyncio.run(report())
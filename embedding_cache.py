@@ -0,0 +1,80 @@
+# embedding_cache.py - content-addressed embedding cache on disk
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List, Dict, Optional
+
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embeddings.sqlite")
+
+
+def cache_key(text: str, model: str, input_type: str) -> str:
+    return hashlib.sha256(f"{model}\x00{input_type}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite table of float32 vectors keyed by sha256(model, input_type, text).
+    Identical text is never embedded twice, regardless of message order or ids.
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER, vector BLOB)"
+        )
+        self._conn.commit()
+
+    def get_many(self, texts: List[str], model: str, input_type: str) -> Dict[int, List[float]]:
+        """Return {index in texts: vector} for every text already cached"""
+        keys = [cache_key(t, model, input_type) for t in texts]
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                found.update(rows)
+
+        return {
+            idx: np.frombuffer(found[key], dtype=np.float32).tolist()
+            for idx, key in enumerate(keys)
+            if key in found
+        }
+
+    def put_many(self, texts: List[str], vectors: List[List[float]], model: str, input_type: str):
+        rows = [
+            (cache_key(t, model, input_type), len(v), np.asarray(v, dtype=np.float32).tobytes())
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
@@ -0,0 +1,13 @@
+# gunicorn.conf.py - multi-worker serving: `gunicorn -c gunicorn.conf.py main:app`
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+
+
+def on_starting(server):
+    """Publish the shared message corpus once, before any worker forks, so every worker just maps it"""
+    from message_fetcher import prepare_shared_corpus
+    prepare_shared_corpus()
@@ -0,0 +1,132 @@
+# http_clients.py - shared keep-alive HTTP clients for all outbound calls
+import os
+import asyncio
+import weakref
+import httpx
+from typing import List, Dict, TYPE_CHECKING
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI  # imported on first use: ~0.3s we don't want at import time
+
+load_dotenv()
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+_sync_client = None
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncClient
+_async_llm_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+_llm_client = None
+
+
+def _client_options() -> dict:
+    return {
+        "timeout": httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        "http2": HTTP2_ENABLED
+    }
+
+
+def get_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        _sync_client = httpx.Client(**_client_options())
+    return _sync_client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Pooled async client for the running event loop.
+    Connections are bound to the loop that opened them, so code that runs its
+    own loop (e.g. the asyncio.run() sync wrappers) gets a separate pool.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(**_client_options())
+        _async_clients[loop] = client
+    return client
+
+
+async def aclose_async_client():
+    """Close the pool owned by the running event loop"""
+    loop = asyncio.get_running_loop()
+    _async_llm_clients.pop(loop, None)
+    client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+def get_llm_client() -> "OpenAI":
+    """OpenAI-compatible client that rides on the shared sync pool"""
+    global _llm_client
+    if _llm_client is None:
+        from openai import OpenAI
+        _llm_client = OpenAI(
+            api_key=os.getenv("NVIDIA_API_KEY"),
+            base_url=os.getenv("NVIDIA_BASE_URL"),
+            http_client=get_sync_client()
+        )
+    return _llm_client
+
+
+def get_async_llm_client() -> "AsyncOpenAI":
+    """AsyncOpenAI client that rides on the running loop's async pool"""
+    loop = asyncio.get_running_loop()
+    client = _async_llm_clients.get(loop)
+    if client is None:
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(
+            api_key=os.getenv("NVIDIA_API_KEY"),
+            base_url=os.getenv("NVIDIA_BASE_URL"),
+            http_client=get_async_client()
+        )
+        _async_llm_clients[loop] = client
+    return client
+
+
+def startup():
+    """Open the pools up front (called from the FastAPI lifespan)"""
+    get_sync_client()
+    get_async_client()
+    print(f"🌐 HTTP pools ready (max {HTTP_MAX_CONNECTIONS} connections, http2={HTTP2_ENABLED})")
+
+
+async def preconnect_async(urls: List[str]) -> Dict[str, str]:
+    """
+    Open a pooled connection (DNS, TCP, TLS, HTTP/2 setup) to each URL's host
+    with a HEAD request, so the first real call doesn't pay for it. Any HTTP
+    status counts as connected. Returns url -> status code or error.
+    """
+    client = get_async_client()
+
+    async def connect(url: str) -> str:
+        try:
+            response = await client.head(url, timeout=HTTP_CONNECT_TIMEOUT)
+            return str(response.status_code)
+        except httpx.HTTPError as e:
+            return f"{type(e).__name__}: {e}"
+
+    urls = [url for url in dict.fromkeys(urls) if url]
+    results = dict(zip(urls, await asyncio.gather(*(connect(url) for url in urls))))
+    print(f"🔌 Preconnected: {results}")
+    return results
+
+
+async def shutdown():
+    global _sync_client, _llm_client
+    await aclose_async_client()
+    if _sync_client is not None:
+        _sync_client.close()
+    _sync_client = None
+    _llm_client = None
+    print("🌐 HTTP pools closed")
@@ -0,0 +1,258 @@
+# ingest_pipeline.py - streaming fetch -> embed -> upsert ingestion
+import os
+import json
+import time
+import uuid
+import asyncio
+from typing import List, Dict, Optional, Callable
+from message_fetcher import iter_message_pages_async, PAGE_SIZE
+from keyword_index import get_keyword_index, promote_keyword_index
+from vector_store import (
+    get_backend, get_collection_state, bump_dataset_version, promote_backend,
+    embed_batch_async, message_point_id, message_payload, EMBED_BATCH_SIZE
+)
+from metrics import span, INGESTED_MESSAGES
+
+CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT_PATH", "data/ingest_checkpoint.json")
+CHECKPOINT_INTERVAL = float(os.getenv("INGEST_CHECKPOINT_INTERVAL", "5"))
+_DONE = object()
+
+
+def load_checkpoint() -> Optional[Dict]:
+    try:
+        with open(CHECKPOINT_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_checkpoint(checkpoint: Dict):
+    if os.path.dirname(CHECKPOINT_PATH):
+        os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
+    tmp_path = f"{CHECKPOINT_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+
+def clear_checkpoint():
+    try:
+        os.remove(CHECKPOINT_PATH)
+    except FileNotFoundError:
+        pass
+
+
+async def _embed_page(backend, keyword_index, items: List[Dict], run_id: str) -> List:
+    """Tag already-stored messages with this run, embed the rest"""
+    ids = [message_point_id(msg) for msg in items]
+    # The keyword index tracks seen ids itself and only tokenizes messages it
+    # lacks (this also backfills points embedded before it existed)
+    keyword_index.mark_seen(ids, run_id)
+    indexed = keyword_index.existing_ids(ids)
+    fresh = [(point_id, msg) for point_id, msg in zip(ids, items) if point_id not in indexed]
+    if fresh:
+        keyword_index.upsert([point_id for point_id, _ in fresh], [message_payload(msg) for _, msg in fresh])
+    existing = await asyncio.to_thread(backend.existing_ids, ids)
+
+    if existing:
+        await asyncio.to_thread(backend.mark_seen, list(existing), run_id)
+
+    new_messages = [msg for msg, point_id in zip(items, ids) if point_id not in existing]
+    points = []
+    for i in range(0, len(new_messages), EMBED_BATCH_SIZE):
+        points.extend(await embed_batch_async(
+            new_messages[i:i + EMBED_BATCH_SIZE], extra_payload={"sync_run": run_id}
+        ))
+    return points
+
+
+async def run_ingest_pipeline(
+    force_recreate: bool = False,
+    progress_callback: Optional[Callable] = None,
+    embed_workers: int = 3,
+    queue_depth: int = 4,
+    page_size: int = PAGE_SIZE,
+    backend=None,
+    keyword_index=None,
+    checkpoint: bool = True,
+    publish: bool = True,
+    collect_messages: bool = False
+) -> Dict:
+    """
+    Stream the message feed into the vector store with the three stages running concurrently:
+
+        fetcher --page_queue--> embed workers --point_queue--> upsert writer
+
+    Both queues are bounded, so memory is capped at roughly
+    (2 * queue_depth + embed_workers) pages regardless of corpus size.
+    As contiguous pages are written, the backend is flushed and the next skip
+    offset checkpointed (at most every CHECKPOINT_INTERVAL seconds); a crashed run resumes from there under the same run id. Once the whole feed
+    has been seen (up to the `total` it reports), points not tagged with the
+    run id (messages that vanished) are deleted.
+
+    `backend`/`keyword_index` default to the live ones; a staging build passes
+    its own with checkpoint=False (the checkpoint belongs to the live store)
+    and publish=False (the caller bumps the dataset version after the swap).
+    With collect_messages, the summary also carries the fetched feed as
+    "messages" when this run saw all of it (not when it resumed part way).
+    """
+    if backend is None:
+        backend = get_backend()
+    if keyword_index is None:
+        keyword_index = get_keyword_index()
+
+    if force_recreate:
+        clear_checkpoint()
+        keyword_index.clear()
+    await asyncio.to_thread(backend.ensure_collection, force_recreate)
+    get_collection_state().invalidate()
+
+    saved = load_checkpoint() if checkpoint else None
+    if saved and saved.get("page_size") == page_size:
+        run_id = saved["run_id"]
+        start_skip = saved["next_skip"]
+        print(f"⏯️ Resuming ingest run {run_id} from message {start_skip}")
+    else:
+        run_id = uuid.uuid4().hex
+        start_skip = 0
+
+    page_queue = asyncio.Queue(maxsize=queue_depth)
+    point_queue = asyncio.Queue(maxsize=queue_depth)
+    stats = {"seen": start_skip, "embedded": 0, "total": 0}
+    pages: Optional[Dict[int, List[Dict]]] = {} if collect_messages and start_skip == 0 else None
+
+    async def fetcher():
+        async for skip, items, total in iter_message_pages_async(start_skip, page_size):
+            stats["total"] = total
+            if pages is not None:
+                pages[skip] = items
+            await page_queue.put((skip, items))
+        for _ in range(embed_workers):
+            await page_queue.put(_DONE)
+
+    async def embedder():
+        while True:
+            page = await page_queue.get()
+            if page is _DONE:
+                await point_queue.put(_DONE)
+                return
+            skip, items = page
+            async with span("ingest_embed_page"):
+                points = await _embed_page(backend, keyword_index, items, run_id)
+            await point_queue.put((skip, len(items), points))
+
+    async def writer():
+        finished_workers = 0
+        completed = {}  # skip -> page length, for pages finished out of order
+        next_skip = start_skip
+        last_checkpoint = time.monotonic()
+
+        while finished_workers < embed_workers:
+            result = await point_queue.get()
+            if result is _DONE:
+                finished_workers += 1
+                continue
+            skip, count, points = result
+            if points:
+                async with span("ingest_upsert"):
+                    await asyncio.to_thread(backend.upsert, points)
+
+            INGESTED_MESSAGES.inc(count, "seen")
+            INGESTED_MESSAGES.inc(len(points), "embedded")
+            stats["seen"] += count
+            stats["embedded"] += len(points)
+            completed[skip] = count
+            while next_skip in completed:
+                next_skip += completed.pop(next_skip)
+            if checkpoint and time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                async with span("ingest_flush"):
+                    await asyncio.to_thread(backend.flush)
+                    await asyncio.to_thread(keyword_index.flush)
+                save_checkpoint({
+                    "run_id": run_id,
+                    "next_skip": next_skip,
+                    "page_size": page_size,
+                    "updated_at": time.time()
+                })
+                last_checkpoint = time.monotonic()
+
+            print(f"  📊 {stats['seen']}/{stats['total']} seen, {stats['embedded']} embedded")
+            if progress_callback:
+                progress_callback(stats["seen"], stats["total"], "ingest")
+
+    print(f"🚰 Streaming ingest (run {run_id}, {embed_workers} embed workers, queue depth {queue_depth})")
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(fetcher())
+            for _ in range(embed_workers):
+                tg.create_task(embedder())
+            tg.create_task(writer())
+    except ExceptionGroup as eg:
+        # Surface the stage's own error; the checkpoint is kept for the next run
+        raise eg.exceptions[0]
+
+    deleted = 0
+    complete = stats["total"] and stats["seen"] >= stats["total"]
+    if complete:
+        async with span("ingest_delete_stale"):
+            deleted = await asyncio.to_thread(backend.delete_unseen, run_id)
+            keyword_index.delete_unseen(run_id)
+    else:
+        # An empty or short page ends the stream early; what wasn't seen hasn't vanished
+        print(f"⚠️ Feed ended at {stats['seen']}/{stats['total']} messages, keeping unseen points")
+    if deleted:
+        INGESTED_MESSAGES.inc(deleted, "deleted")
+        print(f"🗑️ Deleted {deleted} stale points")
+    async with span("ingest_flush"):
+        await asyncio.to_thread(backend.flush)
+        await asyncio.to_thread(keyword_index.flush)
+    if publish:
+        bump_dataset_version(run_id)
+
+    if checkpoint:
+        clear_checkpoint()
+    print(f"✅ Ingest complete: {stats['seen']} messages, {stats['embedded']} embedded")
+    summary = {
+        "run_id": run_id,
+        "total": stats["seen"],
+        "embedded": stats["embedded"],
+        "deleted": deleted,
+        "resumed_from": start_skip
+    }
+    if pages is not None and complete:
+        summary["messages"] = [msg for skip in sorted(pages) for msg in pages[skip]]
+    return summary
+
+
+async def rebuild_and_swap_async(progress_callback: Optional[Callable] = None, **pipeline_options) -> Dict:
+    """
+    Full rebuild without downtime: stream the whole feed into a fresh staging
+    store and keyword index while the live ones keep serving, then swap both
+    in. Unchanged messages come out of the embedding cache, so this costs
+    little more than an incremental sync. A failed build leaves the live
+    store untouched and drops the staging one.
+    """
+    staging = await asyncio.to_thread(get_backend().create_staging)
+    staging_keywords = get_keyword_index().create_staging()
+    print(f"🏗️ Rebuilding into staging store {getattr(staging, 'collection_name', staging.name)}")
+
+    try:
+        summary = await run_ingest_pipeline(
+            progress_callback=progress_callback,
+            backend=staging,
+            keyword_index=staging_keywords,
+            checkpoint=False,
+            publish=False,
+            **pipeline_options
+        )
+    except BaseException:
+        await asyncio.to_thread(staging.drop)
+        raise
+
+    if progress_callback:
+        progress_callback(summary["total"], summary["total"], "swap")
+    await asyncio.to_thread(promote_backend, staging)
+    await asyncio.to_thread(promote_keyword_index, staging_keywords)
+    bump_dataset_version(summary["run_id"])
+    print(f"✅ Swapped in rebuilt store ({summary['total']} messages)")
+    return summary
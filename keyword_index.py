@@ -0,0 +1,326 @@
+# keyword_index.py - BM25 inverted index over message text and user names
+import os
+import re
+import json
+import math
+import threading
+import numpy as np
+from typing import List, Dict, Optional, Tuple, Set
+from search_filters import SearchFilter, PayloadColumns
+
+KEYWORD_INDEX_PATH = os.getenv("KEYWORD_INDEX_PATH", "data/keyword_index.npz")
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset("""
+a an and are as at be but by can could did do does for from had has have how i if in
+is it its me my of on or our please so that the their them there this to was we were
+what when where which who whom why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def document_text(payload: Dict) -> str:
+    return f"{payload.get('user_name', '')} {payload.get('message', '')}"
+
+
+class KeywordIndex:
+    """
+    Inverted index in CSR form: postings for term t are
+    doc_ids[indptr[t]:indptr[t + 1]] with matching term frequencies in tfs.
+    Upserts/deletes are buffered and merged into new arrays on the next
+    search or flush, so a refresh only tokenizes the documents it touches.
+    Ingest runs record the ids they saw with mark_seen (persisted with the
+    index, so a resumed run keeps them) instead of re-upserting every
+    document, and delete_unseen drops the rest.
+    """
+
+    def __init__(self, path: str = KEYWORD_INDEX_PATH, load: bool = True):
+        self.path = path
+        self._lock = threading.RLock()
+        self.clear()
+        if load:
+            self._load()
+
+    def clear(self):
+        with self._lock:
+            self.vocab: Dict[str, int] = {}
+            self.indptr = np.zeros(1, dtype=np.int64)
+            self.doc_ids = np.zeros(0, dtype=np.int32)
+            self.tfs = np.zeros(0, dtype=np.float32)
+            self.doc_lengths = np.zeros(0, dtype=np.float32)
+            self.ids: List[str] = []
+            self.payloads: List[Dict] = []
+            self.columns = PayloadColumns()
+            self._rows: Dict[str, int] = {}
+            self._deleted = set()
+            self._pending: Dict[str, Dict] = {}
+            self._seen_run: Optional[str] = None
+            self._seen: Set[str] = set()
+            self._loaded_mtime = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.ids) - len(self._deleted) + len(self._pending)
+
+    def _load(self):
+        try:
+            self._loaded_mtime = os.stat(self.path).st_mtime_ns
+            data = np.load(self.path, allow_pickle=False)
+        except FileNotFoundError:
+            return
+        docs = json.loads(str(data["docs"]))
+        terms = json.loads(str(data["terms"]))
+        self.vocab = {term: idx for idx, term in enumerate(terms)}
+        self.indptr = data["indptr"]
+        self.doc_ids = data["doc_ids"]
+        self.tfs = data["tfs"]
+        self.doc_lengths = data["doc_lengths"]
+        self.ids = [d["id"] for d in docs]
+        self.payloads = [d["payload"] for d in docs]
+        self.columns = PayloadColumns.from_payloads(self.payloads)
+        self._rows = {point_id: idx for idx, point_id in enumerate(self.ids)}
+        if "seen" in data.files:
+            seen = json.loads(str(data["seen"]))
+            self._seen_run, self._seen = seen["run_id"], set(seen["ids"])
+        print(f"📂 Loaded keyword index ({len(self.ids)} docs, {len(self.vocab)} terms)")
+
+    def reload_if_changed(self) -> bool:
+        """Reload if another process rewrote the index file (never over unflushed writes)"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if mtime == self._loaded_mtime or self._pending or self._deleted:
+                return False
+            self.clear()
+            self._load()
+        return True
+
+    def upsert(self, ids: List[str], payloads: List[Dict]):
+        with self._lock:
+            for point_id, payload in zip(ids, payloads):
+                if point_id in self._rows:
+                    self._deleted.add(self._rows[point_id])
+                self._pending[point_id] = payload
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            for point_id in ids:
+                self._pending.pop(point_id, None)
+                if point_id in self._rows:
+                    self._deleted.add(self._rows[point_id])
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        with self._lock:
+            return {
+                point_id for point_id in ids
+                if point_id in self._pending
+                or (point_id in self._rows and self._rows[point_id] not in self._deleted)
+            }
+
+    def replace_all(self, ids: List[str], payloads: List[Dict]):
+        """Make the index hold exactly these documents, tokenizing only the ones it lacks (ids are content-addressed)"""
+        with self._lock:
+            wanted = set(ids)
+            indexed = self.existing_ids(ids)
+            self.delete([p for p in self.ids if p not in wanted] + [p for p in self._pending if p not in wanted])
+            fresh = [(p, payload) for p, payload in zip(ids, payloads) if p not in indexed]
+            self.upsert([p for p, _ in fresh], [payload for _, payload in fresh])
+
+    def mark_seen(self, ids: List[str], run_id: str):
+        """Record that ingest run `run_id` saw these documents (a new run id starts a new set)"""
+        with self._lock:
+            if run_id != self._seen_run:
+                self._seen_run, self._seen = run_id, set()
+            self._seen.update(ids)
+
+    def delete_unseen(self, run_id: str) -> int:
+        """Drop documents that ingest run `run_id` didn't mark as seen"""
+        with self._lock:
+            seen = self._seen if run_id == self._seen_run else set()
+            stale = [
+                point_id for idx, point_id in enumerate(self.ids)
+                if idx not in self._deleted and point_id not in seen
+            ]
+            stale += [p for p in self._pending if p not in seen]
+            self.delete(stale)
+            return len(stale)
+
+    def _compact(self):
+        """Merge pending changes: CSR -> (term, doc, tf) triples -> filter/append -> CSR"""
+        if not self._pending and not self._deleted:
+            return
+
+        n_old = len(self.ids)
+        keep = np.ones(n_old, dtype=bool)
+        if self._deleted:
+            keep[list(self._deleted)] = False
+        remap = np.cumsum(keep) - 1  # old doc row -> new doc row
+
+        terms = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        mask = keep[self.doc_ids] if n_old else np.zeros(0, dtype=bool)
+        term_parts = [terms[mask]]
+        doc_parts = [remap[self.doc_ids[mask]].astype(np.int32)]
+        tf_parts = [self.tfs[mask]]
+
+        ids = [point_id for point_id, k in zip(self.ids, keep) if k]
+        payloads = [payload for payload, k in zip(self.payloads, keep) if k]
+        lengths = [self.doc_lengths[keep]]
+        n_kept = len(ids)
+
+        new_terms, new_docs, new_tfs, new_lengths = [], [], [], []
+        for point_id, payload in self._pending.items():
+            row = len(ids)
+            tokens = tokenize(document_text(payload))
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                term_id = self.vocab.setdefault(token, len(self.vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            new_terms.extend(counts.keys())
+            new_docs.extend([row] * len(counts))
+            new_tfs.extend(counts.values())
+            new_lengths.append(len(tokens))
+            ids.append(point_id)
+            payloads.append(payload)
+
+        term_parts.append(np.asarray(new_terms, dtype=np.int64))
+        doc_parts.append(np.asarray(new_docs, dtype=np.int32))
+        tf_parts.append(np.asarray(new_tfs, dtype=np.float32))
+        lengths.append(np.asarray(new_lengths, dtype=np.float32))
+
+        all_terms = np.concatenate(term_parts)
+        all_docs = np.concatenate(doc_parts)
+        order = np.lexsort((all_docs, all_terms))
+        self.doc_ids = all_docs[order]
+        self.tfs = np.concatenate(tf_parts)[order]
+        self.indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_terms, minlength=len(self.vocab)), out=self.indptr[1:])
+        self.doc_lengths = np.concatenate(lengths)
+        self.ids = ids
+        self.payloads = payloads
+        self.columns.select(keep)
+        self.columns.extend(payloads[n_kept:])
+        self._rows = {point_id: idx for idx, point_id in enumerate(ids)}
+        self._deleted = set()
+        self._pending = {}
+
+    def search(self, query: str, top_k: int, query_filter: Optional[SearchFilter] = None) -> List[Dict]:
+        """BM25 top-k (among documents passing `query_filter`); hits shaped like RetrievalBackend.search results"""
+        with self._lock:
+            self._compact()
+            n_docs = len(self.ids)
+            if n_docs == 0:
+                return []
+            term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+            if not term_ids:
+                return []
+
+            avg_length = float(self.doc_lengths.mean()) or 1.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / avg_length)
+            scores = np.zeros(n_docs, dtype=np.float32)
+            for term_id in term_ids:
+                start, end = self.indptr[term_id], self.indptr[term_id + 1]
+                if start == end:
+                    continue
+                docs = self.doc_ids[start:end]
+                tf = self.tfs[start:end]
+                df = end - start
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm[docs])
+
+            if query_filter:
+                scores[~self.columns.mask(query_filter)] = 0
+            hits = np.flatnonzero(scores)
+            if len(hits) > top_k:
+                hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+            hits = hits[np.argsort(-scores[hits])]
+            return [{"id": self.ids[i], "score": float(scores[i]), "payload": self.payloads[i]} for i in hits]
+
+    def matching(self, term_groups: List[List[str]], require_all: bool = True) -> List[Dict]:
+        """
+        Every document (not just the top k) containing, for each group, at least
+        one of its terms - or, with require_all=False, any term of any group.
+        Hits come back in index order without a score.
+        """
+        with self._lock:
+            self._compact()
+            matched = None
+            for terms in term_groups:
+                term_ids = [self.vocab[t] for t in terms if t in self.vocab]
+                docs = np.unique(np.concatenate(
+                    [self.doc_ids[self.indptr[t]:self.indptr[t + 1]] for t in term_ids]
+                )) if term_ids else np.zeros(0, dtype=np.int32)
+                if matched is None:
+                    matched = docs
+                elif require_all:
+                    matched = np.intersect1d(matched, docs, assume_unique=True)
+                else:
+                    matched = np.union1d(matched, docs)
+            if matched is None:
+                return []
+            return [{"id": self.ids[i], "payload": self.payloads[i]} for i in matched.tolist()]
+
+    def flush(self):
+        with self._lock:
+            self._compact()
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            terms = sorted(self.vocab, key=self.vocab.get)
+            docs = [{"id": point_id, "payload": payload} for point_id, payload in zip(self.ids, self.payloads)]
+            tmp_path = f"{self.path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                indptr=self.indptr,
+                doc_ids=self.doc_ids,
+                tfs=self.tfs,
+                doc_lengths=self.doc_lengths,
+                terms=np.array(json.dumps(terms)),
+                docs=np.array(json.dumps(docs)),
+                seen=np.array(json.dumps({"run_id": self._seen_run, "ids": sorted(self._seen)}))
+            )
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = os.stat(self.path).st_mtime_ns
+
+    def create_staging(self) -> "KeywordIndex":
+        """Empty index written next to this one, for a full rebuild"""
+        root, ext = os.path.splitext(self.path)
+        return KeywordIndex(f"{root}.staging{ext}", load=False)
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], top_k: int, k: int = 60) -> List[Dict]:
+    """Merge ranked lists by sum of 1 / (k + rank); the first list's copy of each hit is kept"""
+    fused: Dict[str, Tuple[float, Dict]] = {}
+    for results in result_lists:
+        for rank, hit in enumerate(results, start=1):
+            score, first_hit = fused.get(hit["id"], (0.0, hit))
+            fused[hit["id"]] = (score + 1.0 / (k + rank), first_hit)
+
+    ranked = sorted(fused.values(), key=lambda item: item[0], reverse=True)[:top_k]
+    return [dict(hit, score=score) for score, hit in ranked]
+
+
+_keyword_index: Optional[KeywordIndex] = None
+
+
+def get_keyword_index() -> KeywordIndex:
+    global _keyword_index
+    if _keyword_index is None:
+        _keyword_index = KeywordIndex()
+    return _keyword_index
+
+
+def promote_keyword_index(staging: KeywordIndex):
+    """Make a rebuilt staging index the live one (file and in-memory)"""
+    global _keyword_index
+    live_path = get_keyword_index().path
+    with staging._lock:
+        staging.flush()
+        os.replace(staging.path, live_path)
+        staging.path = live_path
+    _keyword_index = staging
@@ -0,0 +1,441 @@
+# local_index.py - in-process NumPy vector index (VECTOR_BACKEND=local)
+import os
+import json
+import shutil
+import threading
+import numpy as np
+from typing import List, Dict, Optional, Set
+from qdrant_client.models import PointStruct
+from vector_store import RetrievalBackend, EXPECTED_DIM
+from search_filters import SearchFilter, PayloadColumns
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "data/local_index")
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float16").lower()  # float16 | int8
+SEARCH_BLOCK_ROWS = 65536
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """
+    Unit-normalize rows and store them compactly.
+    int8 keeps one float32 scale per row (symmetric, max-abs) so scores are
+    (q8 @ query) * scale.
+    """
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(np.float16), None
+
+
+class LocalBackend(RetrievalBackend):
+    """
+    Embedding matrix + parallel id/payload arrays, persisted under LOCAL_INDEX_DIR
+    as versioned directories (v000001, v000002, ...) with a CURRENT pointer.
+    The matrix is memory-mapped on load; writes are buffered and folded into a
+    new matrix on flush(), which publishes the next version. Until then search
+    skips deleted rows and scores the buffered points as a small second matrix. A flush with no
+    rows added or deleted writes nothing, except the ingest tags (sync_run)
+    set since the version was written, kept beside it in sync_runs.json.
+    A staging instance (publish=False) writes versions without touching
+    CURRENT until promote() hands it over.
+    """
+    name = "local_numpy"
+
+    def __init__(self, root: str = LOCAL_INDEX_DIR, dtype: str = LOCAL_INDEX_DTYPE, publish: bool = True):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported LOCAL_INDEX_DTYPE: {dtype}")
+        self.root = root
+        self.dtype = dtype
+        self.version = 0
+        self.publish = publish
+        self._lock = threading.RLock()
+        self._reset()
+        if publish:
+            self._load()
+
+    def _reset(self):
+        self.vectors = None       # (N, dim) float16/int8, possibly memory-mapped
+        self.scales = None        # (N,) float32 for int8, else None
+        self.ids: List[str] = []
+        self.payloads: List[Dict] = []
+        self.columns = PayloadColumns()  # user_name / timestamp "payload indexes"
+        self._rows: Dict[str, int] = {}
+        self._deleted: Set[int] = set()
+        self._pending: Dict[str, PointStruct] = {}
+        self._pending_index = None            # the pending points quantized for search, built on demand
+        self._sync_runs: Dict[str, str] = {}  # sync_run tags not in the version's payloads.jsonl
+        self._dirty = False                   # rows added or deleted since the last version
+        self._sync_runs_dirty = False
+        self._exists = False
+
+    def _version_dir(self, version: int) -> str:
+        return os.path.join(self.root, f"v{version:06d}")
+
+    def _next_version(self) -> int:
+        """One past the highest version directory on disk (live and staging share the root)"""
+        versions = [self.version]
+        if os.path.isdir(self.root):
+            versions += [int(d[1:]) for d in os.listdir(self.root) if d.startswith("v") and d[1:].isdigit()]
+        return max(versions) + 1
+
+    def _write_pointer(self, version: int):
+        tmp_pointer = os.path.join(self.root, "CURRENT.tmp")
+        with open(tmp_pointer, "w") as f:
+            f.write(str(version))
+        os.replace(tmp_pointer, os.path.join(self.root, "CURRENT"))
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.root, "CURRENT")) as f:
+                version = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return
+
+        path = self._version_dir(version)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "payloads.jsonl")) as f:
+            rows = [json.loads(line) for line in f]
+
+        self.version = version
+        self.dtype = meta["dtype"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        scales_path = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        self.ids = [row["id"] for row in rows]
+        self.payloads = [row["payload"] for row in rows]
+        columns_path = os.path.join(path, "columns.npz")
+        if os.path.exists(columns_path):
+            self.columns = PayloadColumns.load(columns_path)
+        else:
+            self.columns = PayloadColumns.from_payloads(self.payloads)  # written before columns existed
+        self._rows = {point_id: idx for idx, point_id in enumerate(self.ids)}
+        sync_runs_path = os.path.join(path, "sync_runs.json")
+        if os.path.exists(sync_runs_path):
+            with open(sync_runs_path) as f:
+                self._sync_runs = json.load(f)
+            for point_id, run_id in self._sync_runs.items():
+                if point_id in self._rows:
+                    self.payloads[self._rows[point_id]]["sync_run"] = run_id
+        self._exists = True
+        print(f"📂 Loaded local index v{version} ({len(self.ids)} vectors, {self.dtype})")
+
+    def reload_if_changed(self) -> bool:
+        """Load the version CURRENT points at if another process published it (never over unflushed writes)"""
+        if not self.publish:
+            return False
+        try:
+            with open(os.path.join(self.root, "CURRENT")) as f:
+                version = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return False
+        with self._lock:
+            if version == self.version or self._pending or self._deleted:
+                return False
+            try:
+                self._reset()
+                self._load()
+            except FileNotFoundError:
+                return False  # superseded while we read it; the next check gets the newer one
+        return True
+
+    def _compact(self):
+        """Fold pending upserts and deletions into fresh in-memory arrays"""
+        if not self._pending and not self._deleted:
+            return
+        keep = [idx for idx in range(len(self.ids)) if idx not in self._deleted]
+        new_points = list(self._pending.values())
+
+        dim = self.vectors.shape[1] if self.vectors is not None else EXPECTED_DIM
+        parts = [np.asarray(self.vectors[keep])] if keep else [np.empty((0, dim), dtype=self.dtype)]
+        scale_parts = [self.scales[keep]] if self.scales is not None and keep else []
+        if new_points:
+            q, scales = quantize([p.vector for p in new_points], self.dtype)
+            parts.append(q)
+            if scales is not None:
+                scale_parts.append(scales)
+
+        self.vectors = np.concatenate(parts)
+        if self.dtype == "int8":
+            self.scales = np.concatenate(scale_parts) if scale_parts else np.zeros(0, np.float32)
+        else:
+            self.scales = None
+        self.ids = [self.ids[idx] for idx in keep] + [str(p.id) for p in new_points]
+        self.payloads = [self.payloads[idx] for idx in keep] + [dict(p.payload or {}) for p in new_points]
+        self.columns.select(np.asarray(keep, dtype=np.int64))
+        self.columns.extend(self.payloads[len(keep):])
+        self._rows = {point_id: idx for idx, point_id in enumerate(self.ids)}
+        self._deleted = set()
+        self._pending = {}
+        self._pending_index = None
+
+    def ensure_collection(self, force_recreate: bool = False):
+        with self._lock:
+            if force_recreate and self._exists:
+                print("🔄 Clearing local index...")
+                self._reset()
+                self._dirty = True
+            if not self._exists:
+                self._exists = True
+                self._dirty = True
+
+    def dimension(self) -> Optional[int]:
+        if not self._exists:
+            return None
+        return self.vectors.shape[1] if self.vectors is not None else EXPECTED_DIM
+
+    def count(self) -> int:
+        with self._lock:
+            # An upsert over an existing row marks that row deleted, so this never double counts
+            return len(self.ids) - len(self._deleted) + len(self._pending)
+
+    def all_ids(self) -> Set[str]:
+        with self._lock:
+            live = {point_id for idx, point_id in enumerate(self.ids) if idx not in self._deleted}
+            return live | set(self._pending)
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        with self._lock:
+            return {
+                point_id for point_id in ids
+                if point_id in self._pending
+                or (point_id in self._rows and self._rows[point_id] not in self._deleted)
+            }
+
+    def upsert(self, points: List[PointStruct]):
+        with self._lock:
+            for point in points:
+                point_id = str(point.id)
+                if point_id in self._rows:
+                    self._deleted.add(self._rows[point_id])
+                self._pending[point_id] = point
+                self._pending_index = None
+                self._dirty = True
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            for point_id in ids:
+                if self._pending.pop(point_id, None) is not None:
+                    self._pending_index = None
+                    self._dirty = True
+                if point_id in self._rows and self._rows[point_id] not in self._deleted:
+                    self._deleted.add(self._rows[point_id])
+                    self._dirty = True
+
+    def mark_seen(self, ids: List[str], run_id: str):
+        with self._lock:
+            for point_id in ids:
+                if point_id in self._pending:
+                    self._pending[point_id].payload["sync_run"] = run_id
+                elif point_id in self._rows and self._sync_runs.get(point_id) != run_id:
+                    self.payloads[self._rows[point_id]]["sync_run"] = run_id
+                    self._sync_runs[point_id] = run_id
+                    self._sync_runs_dirty = True
+
+    def delete_unseen(self, run_id: str) -> int:
+        with self._lock:
+            stale = [
+                point_id for idx, point_id in enumerate(self.ids)
+                if idx not in self._deleted and self.payloads[idx].get("sync_run") != run_id
+            ]
+            stale += [
+                point_id for point_id, point in self._pending.items()
+                if (point.payload or {}).get("sync_run") != run_id
+            ]
+            self.delete(stale)
+            return len(stale)
+
+    def search(
+        self, vector: List[float], top_k: int, with_vectors: bool = False, query_filter: Optional[SearchFilter] = None
+    ) -> List[Dict]:
+        return self.search_batch([vector], top_k, with_vectors, [query_filter])[0]
+
+    def _get_pending_index(self):
+        """(vectors, scales, ids, payloads, columns) of the pending points, or None (call under the lock)"""
+        if not self._pending:
+            return None
+        if self._pending_index is None:
+            points = list(self._pending.values())
+            payloads = [point.payload or {} for point in points]
+            q, scales = quantize([point.vector for point in points], self.dtype)
+            self._pending_index = (q, scales, [str(point.id) for point in points], payloads, PayloadColumns.from_payloads(payloads))
+        return self._pending_index
+
+    def search_batch(
+        self,
+        vectors: List[List[float]],
+        top_k: int,
+        with_vectors: bool = False,
+        query_filters: Optional[List[Optional[SearchFilter]]] = None
+    ) -> List[List[Dict]]:
+        """
+        Score all queries against the matrix in one (N x dim) @ (dim x Q) product.
+        Queries that share a filter are scored together against only the rows
+        the filter's column mask lets through. Unflushed writes are never
+        compacted here: deleted rows are skipped and pending points are scored
+        separately, then both top-k lists are merged.
+        """
+        groups: Dict[Optional[SearchFilter], List[int]] = {}
+        for q, query_filter in enumerate(query_filters or [None] * len(vectors)):
+            groups.setdefault(query_filter or None, []).append(q)
+
+        with self._lock:
+            matrix, scales, ids, payloads = self.vectors, self.scales, self.ids, self.payloads
+            deleted = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted)) if self._deleted else None
+            pending = self._get_pending_index()
+            candidates = {
+                query_filter: np.flatnonzero(self.columns.mask(query_filter)) if query_filter else None
+                for query_filter in groups
+            }
+            pending_candidates = {
+                query_filter: np.flatnonzero(pending[4].mask(query_filter)) if query_filter else None
+                for query_filter in groups
+            } if pending is not None else {}
+
+        queries = _normalize(np.asarray(vectors, dtype=np.float32))
+        results: List[List[Dict]] = [[] for _ in vectors]
+        for query_filter, members in groups.items():
+            hits = [[] for _ in members]
+            if matrix is not None and len(ids):
+                rows = candidates[query_filter]
+                if rows is not None and deleted is not None:
+                    rows = rows[~np.isin(rows, deleted)]
+                hits = self._score(matrix, scales, ids, payloads, queries[members], rows, top_k, with_vectors, deleted)
+            if pending is not None:
+                pending_vectors, pending_scales, pending_ids, pending_payloads, _ = pending
+                pending_hits = self._score(
+                    pending_vectors, pending_scales, pending_ids, pending_payloads,
+                    queries[members], pending_candidates[query_filter], top_k, with_vectors
+                )
+                hits = [
+                    sorted(base + extra, key=lambda hit: hit["score"], reverse=True)[:top_k]
+                    for base, extra in zip(hits, pending_hits)
+                ]
+            for q, query_hits in zip(members, hits):
+                results[q] = query_hits
+        return results
+
+    @staticmethod
+    def _score(
+        matrix, scales, ids, payloads, queries: np.ndarray, rows: Optional[np.ndarray], top_k: int, with_vectors: bool,
+        deleted: Optional[np.ndarray] = None
+    ) -> List[List[Dict]]:
+        """Top-k over `rows` of the matrix (all rows but `deleted` if None)"""
+        n = len(ids) if rows is None else len(rows)
+        live = n - len(deleted) if rows is None and deleted is not None else n
+        if live == 0:
+            return [[] for _ in queries]
+
+        # Score in blocks so a memory-mapped matrix is never upcast in one go
+        scores = np.empty((n, len(queries)), dtype=np.float32)
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            block_rows = slice(start, start + SEARCH_BLOCK_ROWS) if rows is None else rows[start:start + SEARCH_BLOCK_ROWS]
+            block = np.asarray(matrix[block_rows], dtype=np.float32)
+            scores[start:start + len(block)] = block @ queries.T
+        if scales is not None:
+            scores *= (scales if rows is None else scales[rows])[:, None]
+        if rows is None and deleted is not None:
+            scores[deleted] = -np.inf
+
+        k = min(top_k, live)
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]  # (k, Q)
+        results = []
+        for q in range(len(queries)):
+            column = scores[:, q]
+            ranked = top[:, q][np.argsort(-column[top[:, q]])]
+            matrix_rows = ranked if rows is None else rows[ranked]
+            hits = [
+                {"id": ids[row], "score": float(column[idx]), "payload": payloads[row]}
+                for idx, row in zip(ranked.tolist(), matrix_rows.tolist())
+            ]
+            if with_vectors:
+                # Stored rows are unit-normalized (and rescaled for int8), which is all similarity needs
+                stored = np.asarray(matrix[matrix_rows], dtype=np.float32)
+                if scales is not None:
+                    stored *= scales[matrix_rows, None]
+                for hit, row in zip(hits, stored):
+                    hit["vector"] = row.tolist()
+            results.append(hits)
+        return results
+
+    def flush(self):
+        """
+        Write the current state as a new version and (unless staging) repoint
+        CURRENT at it. Without added or deleted rows only the new sync_run tags
+        are saved, in the current version's directory.
+        """
+        with self._lock:
+            if not self._exists:
+                return
+            if not self._dirty and self.version > 0:
+                if self._sync_runs_dirty:
+                    self._write_sync_runs()
+                return
+            self._compact()
+            version = self._next_version()
+            path = self._version_dir(version)
+            os.makedirs(path, exist_ok=True)
+
+            dim = self.dimension()
+            vectors = self.vectors if self.vectors is not None else np.empty((0, dim), dtype=self.dtype)
+            np.save(os.path.join(path, "vectors.npy"), vectors)
+            if self.scales is not None:
+                np.save(os.path.join(path, "scales.npy"), self.scales)
+            self.columns.save(os.path.join(path, "columns.npz"))
+            with open(os.path.join(path, "payloads.jsonl"), "w") as f:
+                for point_id, payload in zip(self.ids, self.payloads):
+                    f.write(json.dumps({"id": point_id, "payload": payload}) + "\n")
+            with open(os.path.join(path, "meta.json"), "w") as f:
+                json.dump({"dtype": self.dtype, "count": len(self.ids), "dim": dim}, f)
+
+            if self.publish:
+                self._write_pointer(version)
+
+            previous = self._version_dir(self.version)
+            had_previous = self.version > 0
+            self.version = version
+            self._sync_runs = {}  # now in payloads.jsonl
+            self._sync_runs_dirty = False
+            self._dirty = False
+            self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            if had_previous and os.path.isdir(previous):
+                shutil.rmtree(previous, ignore_errors=True)
+
+    def _write_sync_runs(self):
+        path = os.path.join(self._version_dir(self.version), "sync_runs.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self._sync_runs, f)
+        os.replace(path + ".tmp", path)
+        self._sync_runs_dirty = False
+
+    def drop(self):
+        with self._lock:
+            if self.version > 0:
+                shutil.rmtree(self._version_dir(self.version), ignore_errors=True)
+            self._reset()
+            self.version = 0
+
+    def create_staging(self) -> "LocalBackend":
+        staging = LocalBackend(self.root, self.dtype, publish=False)
+        staging.ensure_collection()
+        return staging
+
+    def promote(self, staging: "LocalBackend") -> "LocalBackend":
+        """Flush the staging index, repoint CURRENT at it and retire this one"""
+        staging.flush()
+        with staging._lock:
+            staging.publish = True
+            staging._write_pointer(staging.version)
+        print(f"🔀 Local index now serving v{staging.version}")
+        with self._lock:
+            previous = self._version_dir(self.version)
+            if self.version > 0 and self.version != staging.version and os.path.isdir(previous):
+                shutil.rmtree(previous, ignore_errors=True)
+        return staging
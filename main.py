@@ -1,86 +1,308 @@
 # main.py
-from fastapi import FastAPI, Query, HTTPException
+from startup import get_startup, WarmupFailed
+get_startup().mark("main_import_started")
+
+from fastapi import FastAPI, Query, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, JSONResponse
-from datetime import datetime
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field, constr
+from typing import List, Optional
+from contextlib import asynccontextmanager
+import os
+import asyncio
+import time
+from datetime import datetime, date
+import json
 import logging
-from answer_generator import generate_answer
-from message_fetcher import get_messages
-from vector_store import initialize_vector_store, get_collection_stats
+import http_clients
+from message_fetcher import get_messages_async, warm_message_cache
+from answer_cache import get_answer_cache, get_in_flight
+from sessions import get_session_store
+from analytics import get_analytics
+from rate_limiter import get_embedding_limiter, get_llm_admission, Overloaded, OVERLOADED
+from metrics import (
+    REQUEST_SECONDS, render_prometheus, register_gauge, start_request_timings,
+    server_timing_header, get_profiler
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+TIMING_REQUEST_HEADER = "x-debug-timing"
+
+register_gauge("qa_embedding_rate_limit", "Current adaptive embedding request rate (req/s)", lambda: get_embedding_limiter().rate)
+register_gauge("qa_answer_cache_entries", "Answers held in the in-memory answer cache", lambda: get_answer_cache().stats()["entries"])
+register_gauge("qa_llm_in_flight", "Chat completions currently running", lambda: get_llm_admission().stats()["in_flight"])
+register_gauge("qa_llm_queued", "Chat completions waiting for an admission slot", lambda: get_llm_admission().stats()["queued"])
+register_gauge("qa_answers_in_flight", "Distinct questions being answered right now (identical ones share a run)", lambda: len(get_in_flight()))
+register_gauge("qa_sessions", "Live conversation sessions", lambda: len(get_session_store()))
+
+
+def overloaded_response(retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"error": OVERLOADED},
+        headers={"Retry-After": str(int(retry_after))}
+    )
+
+
+class BatchQuestions(BaseModel):
+    # Same per-question minimum as /ask: one empty string would fail the batch's shared embedding request
+    questions: List[constr(min_length=3)] = Field(..., min_length=1, max_length=256)
+
+
+def _import_pipeline():
+    # The modules behind /ask and /refresh pull in openai and qdrant_client
+    # (about a second); imported here, off the event loop, instead of at startup
+    import answer_generator, refresh_jobs  # noqa: F401
+
+
+async def _on_loop(fn):
+    # For warmup steps that must run on the event loop itself (per-loop clients, loop tasks)
+    fn()
+
+
+async def warmup():
+    """Everything the first /ask would otherwise pay for, in the background"""
+    boot = get_startup()
+    # Nothing else can run without the pipeline modules
+    await boot.step("imports", asyncio.to_thread(_import_pipeline), required=True)
+    from vector_store import validate_collection, get_dataset_version, get_search_profile, EMBEDDING_URL
+    from refresh_jobs import start_shared_data_watcher
+    # An unknown SEARCH_PROFILE would otherwise only fail inside search, where it reads as "no results"
+    await boot.step("search_profile", _on_loop(get_search_profile), required=True)
+    await boot.step("preconnect", http_clients.preconnect_async([EMBEDDING_URL, os.getenv("NVIDIA_BASE_URL")]))
+    await boot.step("messages", warm_message_cache())
+    await boot.step("collection", asyncio.to_thread(validate_collection))
+    await boot.step("answer_cache", asyncio.to_thread(lambda: get_answer_cache().load(get_dataset_version())))
+    await boot.step("llm_client", _on_loop(http_clients.get_async_llm_client))
+    await boot.step("shared_data_watcher", _on_loop(start_shared_data_watcher))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    boot = get_startup()
+    boot.mark("lifespan_started")
+    http_clients.startup()
+    boot.start(warmup)
+    yield
+    await boot.stop()
+    if boot.ready:
+        from refresh_jobs import cancel_refresh_jobs
+        await cancel_refresh_jobs()
+    await http_clients.shutdown()
+
+
 app = FastAPI(
     title="Question-Answering System",
     description="Ask natural language questions about member data using RAG",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+
+@app.exception_handler(WarmupFailed)
+async def warmup_failed(request: Request, exc: WarmupFailed):
+    """Requests that need the warmup get a clean 503 instead of a 500 from a half-started pipeline"""
+    return JSONResponse(status_code=503, content={"error": f"Service unavailable: {exc}"})
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
 
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """
+    Per-route latency histogram for every request. Sending `X-Debug-Timing: 1`
+    adds a Server-Timing header with the per-stage spans of that request.
+    A sampled fraction of requests is profiled (see metrics.PROFILE_SLOW_MS).
+    For streamed responses the time is measured up to the first byte.
+    """
+    start = time.perf_counter()
+    timings = start_request_timings() if request.headers.get(TIMING_REQUEST_HEADER) else None
+    profiler = get_profiler().start()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(elapsed, getattr(route, "path", "unmatched"), str(status))
+        if profiler is not None:
+            get_profiler().stop(profiler, request.url.path, elapsed)
+    if timings is not None:
+        response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    return response
+
+
 @app.get("/", include_in_schema=False)
 def root():
     return RedirectResponse(url="/docs")
 
 
 @app.get("/ask")
-def ask_question(question: str = Query(..., min_length=3)):
-    logger.info(f"Question: {question}")
+async def ask_question(
+    question: str = Query(..., min_length=3),
+    session_id: Optional[str] = Query(None, min_length=1, max_length=128)
+):
+    """Pass the same `session_id` (any string you pick) on each turn to ask follow-ups"""
+    logger.info(f"Question: {question}" + (f" (session {session_id})" if session_id else ""))
+    await get_startup().wait_ready()
+    from answer_generator import generate_answer_async
     try:
-        answer = generate_answer(question)
+        answer = await generate_answer_async(question, session_id)
+        get_startup().mark("first_answer")
+        if session_id is not None:
+            return {"answer": answer, "session_id": session_id}
         return {"answer": answer}
+    except Overloaded as e:
+        logger.warning(f"Shed question ({e}): {question}")
+        return overloaded_response(e.retry_after)
+    except TimeoutError:
+        logger.warning(f"Timed out answering: {question}")
+        return JSONResponse(status_code=504, content={"error": "Timed out while answering the question"})
     except Exception as e:
         logger.error(f"Error: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
-@app.get("/refresh")
-def refresh_cache():
-    """Force refresh embeddings (takes ~3-5 minutes)"""
+@app.post("/ask/batch")
+async def ask_questions_batch(batch: BatchQuestions):
+    """Answer many questions with one embedding request, one batched search and concurrent LLM calls"""
+    logger.info(f"Batch of {len(batch.questions)} questions")
+    await get_startup().wait_ready()
+    from answer_generator import generate_answers_batch_async
     try:
-        logger.info("Starting refresh...")
-        messages = get_messages(force_refresh=True)
-        logger.info(f"Fetched {len(messages)} messages")
-        
-        initialize_vector_store(messages, force_recreate=True)
-        
-        return {
-            "status": "success",
-            "message": f"Successfully refreshed {len(messages)} embeddings",
-            "total_messages": len(messages),
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        results = await generate_answers_batch_async(batch.questions)
+        return {"results": results}
     except Exception as e:
-        logger.error(f"Refresh error: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Batch error: {e}", exc_info=True)
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@app.get("/ask/stream")
+async def ask_question_stream(question: str = Query(..., min_length=3)):
+    """Same as /ask, but streams Server-Sent Events: retrieval, token..., done (or error)"""
+    logger.info(f"Question (stream): {question}")
+    admission = get_llm_admission()
+    if admission.full():
+        return overloaded_response(admission.retry_after())
+    await get_startup().wait_ready()
+    from answer_generator import stream_answer_async
+    
+    async def event_stream():
+        async for event in stream_answer_async(question):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.api_route("/refresh", methods=["GET", "POST"], status_code=202)
+async def refresh_cache(full: bool = Query(False, description="Rebuild into a new collection and swap it in")):
+    """
+    Start a background sync of the message feed (only new/changed messages are
+    embedded) and return its job id; poll /refresh/{job_id} for progress.
+    /ask keeps answering from the current index while the job runs.
+    """
+    await get_startup().wait_ready()
+    from refresh_jobs import start_refresh_job, RefreshInProgress
+    try:
+        job = start_refresh_job(full=full)
+    except RefreshInProgress as e:
+        # Jobs live in the worker that runs them, so this one can't report its progress
+        return JSONResponse(status_code=409, content={"error": str(e), "job_id": e.job_id})
+    logger.info(f"Refresh job {job.id} ({job.status})")
+    return {
+        "status": "accepted",
+        "job": job.to_dict(),
+        "status_url": f"/refresh/{job.id}",
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@app.get("/refresh/{job_id}")
+def refresh_status(job_id: str):
+    from refresh_jobs import get_refresh_job
+    job = get_refresh_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown refresh job: {job_id}")
+    return job.to_dict()
+
+
+@app.get("/health")
+def health():
+    """Liveness: the process is up and serving (answers while warmup is still running)"""
+    return {"status": "ok", "uptime_seconds": get_startup().report()["uptime_seconds"]}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: warmup finished (imports, preconnects, snapshot, collection check); 503 until then, or if it failed. Includes the startup breakdown"""
+    report = get_startup().report()
+    if not report["ready"]:
+        return JSONResponse(status_code=503, content=report)
+    from vector_store import get_collection_state
+    report["vector_store_problem"] = get_collection_state().problem()
+    return report
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text exposition of this process's counters and histograms"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/stats")
-def get_stats():
+async def get_stats(
+    user: Optional[str] = Query(None, description="Only this member (name, case-insensitive)"),
+    since: Optional[date] = Query(None, description="First day to count (YYYY-MM-DD, inclusive)"),
+    until: Optional[date] = Query(None, description="Last day to count (YYYY-MM-DD, inclusive)")
+):
+    """Message counts from the precomputed analytics store; filters add a per-day breakdown"""
+    await get_startup().wait_ready()
+    from vector_store import get_collection_stats_async
     try:
-        messages = get_messages()
-        user_counts = {}
-        for msg in messages:
-            user = msg['user_name']
-            user_counts[user] = user_counts.get(user, 0) + 1
-        
-        top_users = sorted(user_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-        
+        await get_messages_async()  # loads the snapshot / feed if warmup couldn't; no-op afterwards
+        analytics = get_analytics()
+        if user is None and since is None and until is None:
+            stats = analytics.summary()
+        else:
+            if since and until and since > until:
+                raise HTTPException(status_code=400, detail="since must not be after until")
+            code = None
+            if user is not None:
+                code = analytics.find_user(user)
+                if code is None:
+                    raise HTTPException(status_code=404, detail=f"Unknown member: {user}")
+            stats = analytics.query(code, since, until)
+            stats["filters"] = {
+                "user": user,
+                "since": since.isoformat() if since else None,
+                "until": until.isoformat() if until else None
+            }
+
         return {
-            "total_messages": len(messages),
-            "unique_users": len(user_counts),
-            "top_users": [{"name": name, "count": count} for name, count in top_users],
-            "vector_store": get_collection_stats(),
+            **stats,
+            "vector_store": await get_collection_stats_async(),
             "timestamp": datetime.utcnow().isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Stats error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+get_startup().mark("main_imported")
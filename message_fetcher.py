@@ -1,92 +1,433 @@
 # message_fetcher.py
-import httpx
+import os
+import io
+import json
 import time
-from typing import List, Dict
+import hashlib
+import asyncio
+import threading
+import httpx
+import zstandard
+from typing import List, Dict, AsyncIterator, Tuple, Optional
+from http_clients import get_async_client, aclose_async_client
+from metrics import span
+from analytics import get_analytics, MessageAnalytics
+from shared_corpus import get_shared_corpus, MappedMessages, SHARED_CORPUS
 
-API_URL = "https://november7-730026606190.europe-west1.run.app/messages/"
+API_URL = os.getenv("MESSAGES_API_URL", "https://november7-730026606190.europe-west1.run.app/messages/")
+PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "500"))
+FETCH_CONCURRENCY = int(os.getenv("MESSAGE_FETCH_CONCURRENCY", "8"))
+SNAPSHOT_PATH = os.getenv("MESSAGE_SNAPSHOT_PATH", "data/messages.jsonl.zst")
+SNAPSHOT_FORMAT = 1
 
-def fetch_all_messages() -> List[Dict]:
-    """Fetch all messages with retry logic and rate limit handling"""
-    
-    all_messages = []
-    skip = 0
-    limit = 4000
-    max_retries = 3
-    
-    print("Fetching messages from API...")
-    
-    while True:
-        for attempt in range(max_retries):
-            try:
-                response = httpx.get(
+
+async def fetch_page_async(skip: int, limit: int = PAGE_SIZE, max_retries: int = 3) -> Dict:
+    """Fetch one page ({"items": [...], "total": N}) with retry and rate limit handling"""
+    for attempt in range(max_retries):
+        try:
+            async with span("fetch_page"):
+                response = await get_async_client().get(
                     API_URL,
                     params={"skip": skip, "limit": limit},
-                    headers={"accept": "application/json"},
-                    timeout=30.0
+                    headers={"accept": "application/json"}
                 )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    items = data.get("items", [])
-                    
-                    if not items:
-                        print(f"✓ Fetched {len(all_messages)} messages total")
-                        return all_messages
-                    
-                    all_messages.extend(items)
-                    total = data.get("total", 0)
-                    print(f"  Fetched {len(all_messages)}/{total}")
-                    
-                    if len(all_messages) >= total:
-                        print(f"✓ Fetched all {len(all_messages)} messages")
-                        return all_messages
-                    
-                    skip += limit
-                    time.sleep(0.2)
-                    break
-                    
-                elif response.status_code == 401:
-                    print(f"⚠️ 401 Unauthorized - retrying in {2 ** attempt} seconds...")
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                    
-                elif response.status_code == 402:
-                    print(f"⚠️ Rate limit hit at {len(all_messages)} messages")
-                    if all_messages:
-                        return all_messages
-                    raise Exception("Rate limited from start")
-                    
-                else:
-                    print(f"⚠️ Status {response.status_code}, attempt {attempt + 1}/{max_retries}")
-                    time.sleep(1)
-                    
-            except httpx.TimeoutException:
-                print(f"⚠️ Timeout, attempt {attempt + 1}/{max_retries}")
-                time.sleep(2)
-                
-            except Exception as e:
-                print(f"⚠️ Error: {e}, attempt {attempt + 1}/{max_retries}")
-                if attempt == max_retries - 1:
-                    if all_messages:
-                        print(f"⚠️ Returning {len(all_messages)} messages fetched before error")
-                        return all_messages
-                    raise
-                time.sleep(2)
-        
-        if all_messages:
-            print(f"⚠️ Stopping at {len(all_messages)} messages due to repeated failures")
-            return all_messages
-        else:
-            raise Exception("Failed to fetch any messages")
-    
-    return all_messages
+
+            if response.status_code == 200:
+                return response.json()
+            elif response.status_code == 401:
+                print(f"⚠️ 401 Unauthorized - retrying in {2 ** attempt} seconds...")
+                await asyncio.sleep(2 ** attempt)  # Exponential backoff
+            elif response.status_code == 402:
+                raise Exception(f"Rate limited at skip={skip}")
+            elif response.status_code >= 500:
+                print(f"⚠️ Server error {response.status_code} at skip={skip}, attempt {attempt + 1}/{max_retries}")
+                await asyncio.sleep(2 ** attempt)
+            else:
+                print(f"⚠️ Status {response.status_code}, attempt {attempt + 1}/{max_retries}")
+                await asyncio.sleep(1)
+
+        except httpx.TransportError as e:
+            # Timeouts, but also a dropped keep-alive connection in the page fan-out
+            print(f"⚠️ {type(e).__name__} at skip={skip}, attempt {attempt + 1}/{max_retries}")
+            await asyncio.sleep(2)
+
+    raise Exception(f"Failed to fetch page at skip={skip} after {max_retries} attempts")
+
+
+async def iter_message_pages_async(start_skip: int = 0, limit: int = PAGE_SIZE) -> AsyncIterator[Tuple[int, List[Dict], int]]:
+    """Yield (skip, items, total) page by page so callers never hold the whole feed"""
+    skip = start_skip
+    while True:
+        data = await fetch_page_async(skip, limit)
+        items = data.get("items", [])
+        if not items:
+            return
+        total = data.get("total", 0)
+        yield skip, items, total
+        skip += len(items)
+        if skip >= total:
+            return
+
+
+async def fetch_all_messages_async(
+    start_skip: int = 0,
+    limit: int = PAGE_SIZE,
+    concurrency: int = FETCH_CONCURRENCY
+) -> List[Dict]:
+    """
+    Fetch every message from `start_skip` on.
+    The first page tells us `total`; the remaining pages are then fetched
+    concurrently (at most `concurrency` in flight) and stitched back in order.
+    Raises if any page fails or the pages come up short of `total`: callers
+    persist and publish the result as the whole feed, so a prefix is never returned.
+    """
+    print(f"Fetching messages from API (from {start_skip}, {concurrency} concurrent pages)...")
+
+    first = await fetch_page_async(start_skip, limit)
+    messages = list(first.get("items", []))
+    total = first.get("total", 0)
+    if not messages:
+        print(f"✓ No messages beyond {start_skip}")
+        return messages
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(skip: int) -> List[Dict]:
+        async with semaphore:
+            return (await fetch_page_async(skip, limit)).get("items", [])
+
+    skips = range(start_skip + len(messages), total, len(messages))
+    pages = await asyncio.gather(*(fetch(skip) for skip in skips), return_exceptions=True)
+
+    for skip, page in zip(skips, pages):
+        if isinstance(page, BaseException):
+            raise Exception(f"Fetch incomplete: page at skip={skip} failed: {page}") from page
+        messages.extend(page)
+
+    if start_skip + len(messages) < total:
+        raise Exception(f"Fetch incomplete: got {start_skip + len(messages)} of {total} messages")
+
+    print(f"✓ Fetched {len(messages)} messages (total {total})")
+    return messages
+
+
+def fetch_all_messages() -> List[Dict]:
+    """Sync wrapper around fetch_all_messages_async"""
+    async def run():
+        try:
+            return await fetch_all_messages_async()
+        finally:
+            await aclose_async_client()
+
+    return asyncio.run(run())
+
+
+def snapshot_version(messages: List[Dict]) -> str:
+    digest = hashlib.sha256()
+    for msg in messages:
+        digest.update(json.dumps(msg, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def make_header(messages: List[Dict], previous: Optional[Dict] = None) -> Dict:
+    """Snapshot header for `messages`, or for `previous`'s messages followed by them (without rehashing those)"""
+    version = snapshot_version(messages)
+    if previous is not None:
+        version = hashlib.sha256(f"{previous['version']}{version}".encode("utf-8")).hexdigest()[:16]
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "count": len(messages) + (previous["count"] if previous else 0),
+        "created_at": time.time()
+    }
+
+
+def save_snapshot(messages: List[Dict], path: str = SNAPSHOT_PATH) -> Dict:
+    """
+    Write messages as zstd-compressed JSONL. The first line is a header with
+    the snapshot version so readers can tell whether anything changed.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = make_header(messages)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as raw:
+        with zstandard.ZstdCompressor(level=3).stream_writer(raw) as writer:
+            writer.write((json.dumps(header) + "\n").encode("utf-8"))
+            for msg in messages:
+                writer.write((json.dumps(msg) + "\n").encode("utf-8"))
+    os.replace(tmp_path, path)
+    return header
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH) -> Optional[Tuple[Dict, List[Dict]]]:
+    """Return (header, messages), or None if there is no usable snapshot"""
+    try:
+        with open(path, "rb") as raw:
+            reader = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding="utf-8")
+            header = json.loads(reader.readline())
+            if header.get("format") != SNAPSHOT_FORMAT:
+                return None
+            messages = [json.loads(line) for line in reader]
+    except FileNotFoundError:
+        return None
+    except (zstandard.ZstdError, json.JSONDecodeError, UnicodeDecodeError) as e:
+        print(f"⚠️ Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+    if len(messages) != header.get("count"):
+        print(f"⚠️ Ignoring truncated snapshot {path}")
+        return None
+    return header, messages
 
 
 _message_cache = None
+_snapshot_header = None
+_cache_lock = threading.Lock()
+
+
+def _set_messages(messages: List[Dict], header: Optional[Dict] = None, appended: Optional[List[Dict]] = None):
+    """Swap in a new message list; `appended` is the tail that is new since the current one"""
+    global _message_cache, _snapshot_header
+    with _cache_lock:
+        if appended is not None:
+            get_analytics().append(appended)
+        else:
+            get_analytics().reset(messages or [])
+        _message_cache = messages
+        _snapshot_header = header
+
+
+def _publish_messages(messages: List[Dict], header: Optional[Dict] = None, append: bool = False):
+    """
+    SHARED_CORPUS's _set_messages: publish `messages` as a new corpus version
+    (or append them to the current one) and serve from its mapping.
+    """
+    global _message_cache, _snapshot_header
+    with _cache_lock:
+        base = _message_cache if append and isinstance(_message_cache, MappedMessages) else None
+        analytics = get_analytics()
+        if base is not None:
+            analytics.append(messages)
+            header = make_header(messages, previous=_snapshot_header)
+        else:
+            analytics.reset(messages)
+            header = header or make_header(messages)
+        corpus = get_shared_corpus().publish(messages, analytics.columns(), header, base=base)
+        _message_cache = corpus
+        _snapshot_header = corpus.header
+
+
+def _attach_corpus(corpus: MappedMessages):
+    """Serve from an already published corpus version: nothing is parsed, analytics come from its columns"""
+    global _message_cache, _snapshot_header
+    with _cache_lock:
+        get_analytics().load_columns(*corpus.columns())
+        _message_cache = corpus
+        _snapshot_header = corpus.header
+
+
+def reload_shared_corpus() -> bool:
+    """Remap if another process published a newer corpus version; True if it did"""
+    if not SHARED_CORPUS:
+        return False
+    version = get_shared_corpus().current_version()
+    current = _message_cache.version if isinstance(_message_cache, MappedMessages) else None
+    if version is None or version == current:
+        return False
+    corpus = get_shared_corpus().attach(version)
+    if corpus is None:
+        return False
+    _attach_corpus(corpus)
+    print(f"🔁 Remapped corpus v{corpus.version} ({len(corpus)} messages)")
+    return True
+
+
+def prepare_shared_corpus():
+    """
+    Preload step (gunicorn on_starting, before workers fork): publish the
+    corpus from the snapshot or the feed unless a version already exists.
+    Leaves this process's own caches untouched.
+    """
+    corpus = get_shared_corpus()
+    if not SHARED_CORPUS or corpus.current_version() is not None:
+        return
+    snapshot = load_snapshot()
+    header, messages = snapshot if snapshot is not None else (None, fetch_all_messages())
+    analytics = MessageAnalytics()
+    analytics.reset(messages)
+    corpus.publish(messages, analytics.columns(), header or make_header(messages))
+
 
 def get_messages(force_refresh=False) -> List[Dict]:
-    global _message_cache
-    
-    if _message_cache is None or force_refresh:
-        _message_cache = fetch_all_messages()
-    
+    """
+    In-memory messages, falling back to the local snapshot and then the API.
+    A snapshot hit returns immediately and kicks off a background fetch of
+    anything newer than the snapshot.
+    """
+    if _message_cache is not None and not force_refresh:
+        return _message_cache
+
+    if not force_refresh:
+        if SHARED_CORPUS and reload_shared_corpus():
+            start_background_sync()
+            return _message_cache
+        snapshot = load_snapshot()
+        if snapshot is not None:
+            header, messages = snapshot
+            if SHARED_CORPUS:
+                _publish_messages(messages, header)
+            else:
+                _set_messages(messages, header)
+            print(f"✓ Loaded {len(messages)} messages from snapshot {header['version']}")
+            start_background_sync()
+            return _message_cache
+
+    messages = fetch_all_messages()
+    if SHARED_CORPUS:
+        _publish_messages(messages)
+    else:
+        _set_messages(messages, save_snapshot(messages))
     return _message_cache
+
+
+async def get_messages_async(force_refresh=False) -> List[Dict]:
+    """Async counterpart of get_messages for code running on the event loop"""
+    if _message_cache is not None and not force_refresh:
+        return _message_cache
+
+    if not force_refresh:
+        if SHARED_CORPUS and await asyncio.to_thread(reload_shared_corpus):
+            start_background_sync()
+            return _message_cache
+        snapshot = await asyncio.to_thread(load_snapshot)
+        if snapshot is not None:
+            header, messages = snapshot
+            if SHARED_CORPUS:
+                await asyncio.to_thread(_publish_messages, messages, header)
+            else:
+                await asyncio.to_thread(_set_messages, messages, header)
+            start_background_sync()
+            return _message_cache
+
+    return await replace_messages_async(await fetch_all_messages_async())
+
+
+async def replace_messages_async(messages: List[Dict]) -> List[Dict]:
+    """Make `messages` (the whole feed, e.g. as an ingest run streamed it) the cache, snapshot and published corpus"""
+    if SHARED_CORPUS:
+        await asyncio.to_thread(_publish_messages, messages)
+    else:
+        await asyncio.to_thread(_set_messages, messages, await asyncio.to_thread(save_snapshot, messages))
+    return _message_cache
+
+
+async def sync_new_messages_async() -> int:
+    """Fetch only the pages beyond what we already hold, then re-save the snapshot (or publish a corpus version)"""
+    current = _message_cache or []
+    new_messages = await fetch_all_messages_async(start_skip=len(current))
+    if not new_messages:
+        return 0
+
+    if SHARED_CORPUS:
+        await asyncio.to_thread(_publish_messages, new_messages, None, True)
+    else:
+        messages = current + new_messages
+        header = await asyncio.to_thread(save_snapshot, messages)
+        await asyncio.to_thread(_set_messages, messages, header, new_messages)
+    print(f"✓ Appended {len(new_messages)} new messages to snapshot")
+    return len(new_messages)
+
+
+_background_sync = None
+
+
+def start_background_sync():
+    """
+    Run sync_new_messages_async without blocking the caller (at most one at a
+    time). With SHARED_CORPUS only the leader syncs; the rest remap its versions.
+    """
+    global _background_sync
+    if SHARED_CORPUS and not get_shared_corpus().try_lead():
+        return
+
+    async def run():
+        try:
+            await sync_new_messages_async()
+        except Exception as e:
+            print(f"⚠️ Background message sync failed: {e}")
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    if loop is not None:
+        if _background_sync is None or _background_sync.done():
+            _background_sync = loop.create_task(run())
+        return
+
+    async def run_in_own_loop():
+        try:
+            await run()
+        finally:
+            await aclose_async_client()
+
+    threading.Thread(target=asyncio.run, args=(run_in_own_loop(),), daemon=True).start()
+
+
+async def warm_message_cache():
+    """
+    Startup hook: map the shared corpus or load the snapshot (milliseconds)
+    and fetch anything newer in the background.
+    """
+    global _background_sync
+    if SHARED_CORPUS and await asyncio.to_thread(reload_shared_corpus):
+        print(f"✓ Mapped {len(_message_cache)} messages from corpus v{_message_cache.version}")
+        start_background_sync()
+        return
+    if SHARED_CORPUS and not get_shared_corpus().try_lead():
+        print("ℹ️ No corpus published yet, waiting for the leader worker")
+        return
+
+    snapshot = await asyncio.to_thread(load_snapshot)
+    if snapshot is not None:
+        header, messages = snapshot
+        if SHARED_CORPUS:
+            await asyncio.to_thread(_publish_messages, messages, header)
+        else:
+            await asyncio.to_thread(_set_messages, messages, header)
+        print(f"✓ Loaded {len(messages)} messages from snapshot {header['version']}")
+        start_background_sync()
+    else:
+        print("ℹ️ No message snapshot yet, fetching the feed in the background")
+
+        async def run():
+            try:
+                await get_messages_async()
+            except Exception as e:
+                print(f"⚠️ Background message fetch failed: {e}")
+
+        _background_sync = asyncio.get_running_loop().create_task(run())
+
+
+def get_member_messages(codes: List[int]) -> Optional[List[Dict]]:
+    """
+    Every in-memory message from the given members (analytics member codes),
+    oldest first per member, via the analytics row index instead of a scan.
+    None if the messages aren't loaded yet.
+    """
+    with _cache_lock:
+        if _message_cache is None:
+            return None
+        analytics = get_analytics()
+        return [_message_cache[row] for code in codes for row in analytics.rows_for_user(code).tolist()]
+
+
+def get_snapshot_header() -> Optional[Dict]:
+    return _snapshot_header
+
+
+def clear_message_cache():
+    """Drop the in-memory copy; the next get_messages() reloads it"""
+    _set_messages(None)
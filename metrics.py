@@ -0,0 +1,266 @@
+# metrics.py - in-process counters/histograms, timing spans and Prometheus export
+import os
+import time
+import random
+import bisect
+import threading
+import contextvars
+from typing import Dict, List, Optional, Tuple, Callable
+
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))          # 0 disables profiling
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.05"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+PROFILER = os.getenv("PROFILER", "cprofile").lower()                 # cprofile | pyinstrument
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+INF_LABEL = 'le="+Inf"'
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label combination"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}  # values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if idx < len(self.buckets):
+                series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """(count, sum) per label combination"""
+        with self._lock:
+            return {values: (series[-1], series[-2]) for values, series in self._series.items()}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    bucket = _label_text(self.labels, values, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+                labels = _label_text(self.labels, values)
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, values, INF_LABEL)} {series[-1]}")
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+_registry: Dict[str, object] = {}
+
+
+def _register(metric):
+    return _registry.setdefault(metric.name, metric)
+
+
+REQUEST_SECONDS = _register(Histogram(
+    "qa_http_request_seconds", "HTTP request latency by route and status", ("route", "status")
+))
+STAGE_SECONDS = _register(Histogram(
+    "qa_stage_seconds", "Latency of each pipeline stage (embedding, search, llm, ingest steps)", ("stage",)
+))
+EMBEDDING_RETRIES = _register(Counter(
+    "qa_embedding_retries_total", "Embedding requests retried, by reason", ("reason",)
+))
+RATE_LIMITED = _register(Counter(
+    "qa_rate_limited_total", "429 responses received, by upstream", ("upstream",)
+))
+CACHE_LOOKUPS = _register(Counter(
+    "qa_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result")
+))
+LLM_TOKENS = _register(Counter(
+    "qa_llm_tokens_total", "Tokens reported by the LLM, by kind", ("kind",)
+))
+CONTEXT_TOKENS = _register(Histogram(
+    "qa_context_tokens", "Estimated tokens of packed message context per prompt", buckets=COUNT_BUCKETS
+))
+INGESTED_MESSAGES = _register(Counter(
+    "qa_ingest_messages_total", "Messages handled by ingest, by outcome", ("outcome",)
+))
+AGGREGATE_QUERIES = _register(Counter(
+    "qa_aggregate_queries_total", "Count/list/per-member questions answered from exact aggregates, by intent and path", ("intent", "path")
+))
+LLM_ADMISSIONS = _register(Counter(
+    "qa_llm_admissions_total", "LLM calls by admission outcome (admitted, queued, rejected, expired)", ("outcome",)
+))
+
+
+def register_gauge(name: str, help: str, read: Callable[[], float]):
+    _registry[name] = Gauge(name, help, read)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Per-request stage timings, only collected when someone asked for them
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def record_stage(stage: str, elapsed: float):
+    STAGE_SECONDS.observe(elapsed, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, elapsed))
+
+
+class span:
+    """
+    Time a block into qa_stage_seconds (and the request's timing header, if
+    requested). Works as `with span("llm"):` or, next to other async context
+    managers, `async with span("search"), asyncio.timeout(...):`.
+    """
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        return self.__exit__(*exc_info)
+
+
+def start_request_timings() -> List[Tuple[str, float]]:
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing value, e.g. `embed_query;dur=41.2, search;dur=8.3, total;dur=912.0`"""
+    entries = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class SlowRequestProfiler:
+    """
+    Profiles a PROFILE_SAMPLE_RATE fraction of requests (one at a time, since a
+    profiler hooks the whole thread) and keeps the dump only if the request
+    took longer than PROFILE_SLOW_MS.
+    """
+
+    def __init__(self):
+        self._busy = threading.Lock()
+
+    def start(self):
+        if PROFILE_SLOW_MS <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            if PROFILER == "pyinstrument":
+                from pyinstrument import Profiler  # optional dependency
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+            else:
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+            return profiler
+        except Exception as e:
+            print(f"⚠️ Profiler unavailable: {e}")
+            self._busy.release()
+            return None
+
+    def stop(self, profiler, name: str, elapsed: float):
+        try:
+            if PROFILER == "pyinstrument":
+                profiler.stop()
+            else:
+                profiler.disable()
+            if elapsed * 1000 < PROFILE_SLOW_MS:
+                return
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            label = name.strip("/").replace("/", "_") or "root"
+            stem = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{elapsed * 1000:.0f}ms")
+            if PROFILER == "pyinstrument":
+                with open(f"{stem}.html", "w") as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.dump_stats(f"{stem}.prof")
+            print(f"🐢 Slow request {name} ({elapsed * 1000:.0f}ms), profile saved to {stem}")
+        finally:
+            self._busy.release()
+
+
+_profiler: Optional[SlowRequestProfiler] = None
+
+
+def get_profiler() -> SlowRequestProfiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = SlowRequestProfiler()
+    return _profiler
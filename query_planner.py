@@ -0,0 +1,368 @@
+# query_planner.py - search filters and exact answers for count / list / per-member questions
+import os
+import re
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Tuple
+from analytics import get_analytics
+from keyword_index import get_keyword_index, tokenize
+from message_fetcher import get_member_messages
+from context_builder import pack_in_order, serialize_messages, estimate_tokens
+from vector_store import message_point_id
+from search_filters import SearchFilter
+from metrics import span, AGGREGATE_QUERIES
+
+QUERY_PLANNER = os.getenv("QUERY_PLANNER", "true").lower() == "true"
+SEARCH_FILTERS = os.getenv("SEARCH_FILTERS", "true").lower() == "true"
+AGGREGATE_TOKEN_BUDGET = int(os.getenv("AGGREGATE_TOKEN_BUDGET", "3000"))
+MAX_LISTED_MEMBERS = 50
+
+PER_MEMBER_RE = re.compile(
+    r"\b(each|every|per) (member|user|person|client|customer)\b"
+    r"|\b(who|which (member|user|person|client|customer))\b.*\b(most|least|fewest)\b",
+    re.IGNORECASE
+)
+COUNT_RE = re.compile(r"\b(how many|how often|number of)\b", re.IGNORECASE)
+LIST_RE = re.compile(r"^\s*(please\s+)?list\b|\blist (all|every)\b|\b(every single|what are all)\b", re.IGNORECASE)
+# Counting and ranking are only about the messages themselves: "how many
+# people is the reservation for?" or "who has the most cars?" are questions
+# about what the messages say, which retrieval answers
+ABOUT_MESSAGES_RE = re.compile(
+    r"\b(messages?|requests?|requested|times|sent|send|sends|wrote|written|posted|asked|mentioned)\b",
+    re.IGNORECASE
+)
+# Only these get a number straight from the analytics counts, without the LLM
+MESSAGE_COUNT_RE = re.compile(r"\b(messages?|sent|wrote|written|posted)\b", re.IGNORECASE)
+EXTREME_RE = re.compile(r"\b(most|least|fewest)\b", re.IGNORECASE)
+NAME_TOKEN_RE = re.compile(r"[\w'’-]+", re.UNICODE)
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+# Only dates with a year: "June 3rd" on its own is usually about the content
+# of a message (when the dinner is), not when the message was sent
+DATE_RE = re.compile(
+    r"\b(?:(?P<prep>since|after|from|before|until|till|by|in|during|on|between|and)\s+)?"
+    r"(?:(?P<iso>\d{4}-\d{2}-\d{2})"
+    r"|(?P<month>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?"
+    r"(?:\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?)?,?\s+(?P<year>(?:19|20)\d{2})"
+    r"|(?P<bare_year>(?:19|20)\d{2}))\b",
+    re.IGNORECASE
+)
+# Even with a year, "a trip in December 2025" says what a message is about;
+# a date only narrows the search to when messages were sent after "since" or
+# alongside wording like this
+SEND_TIME_RE = re.compile(r"\b(sent|send|sends|posted|posts|wrote|written|messaged|texted)\b", re.IGNORECASE)
+
+# Words that describe the aggregation rather than what to look for
+INTENT_WORDS = frozenset("""
+how many often number count list all every each per single total member members user users
+client clients customer customers message messages time times sent send sends ask asked asking
+asks mention mentioned mentions mentioning request requested requests requesting say said talk
+talked about most least fewest ever made make makes different distinct unique much there
+""".split())
+
+
+def _term_variants(term: str) -> List[str]:
+    """Crude plural / past-tense folding: cars <-> car, addresses -> address, booked -> book"""
+    variants = {term, f"{term}s"}
+    if term.endswith("es") and len(term) > 4:
+        variants.add(term[:-2])
+    if term.endswith("s") and len(term) > 3:
+        variants.add(term[:-1])
+    if term.endswith("ed") and len(term) > 4:
+        variants.update((term[:-2], term[:-1]))
+    return sorted(variants)
+
+
+class _NameIndex:
+    """Full / first / last name lookups over the analytics member list"""
+
+    def __init__(self, names: List[str]):
+        self.full: Dict[str, int] = {}
+        self.parts: Dict[str, List[int]] = {}
+        for code, name in enumerate(names):
+            lowered = name.lower()
+            self.full.setdefault(lowered, code)
+            for part in lowered.split():
+                self.parts.setdefault(part, []).append(code)
+
+
+_name_index: Optional[Tuple[int, int, _NameIndex]] = None
+
+
+def _get_name_index() -> _NameIndex:
+    """Rebuilt when the member list changes (new member or full reload)"""
+    global _name_index
+    names = get_analytics().names
+    key = (id(names), len(names))
+    if _name_index is None or _name_index[:2] != key:
+        _name_index = (*key, _NameIndex(list(names)))
+    return _name_index[2]
+
+
+def match_members(question: str) -> List[int]:
+    """
+    Member codes named in the question. Full names win; otherwise a
+    capitalized first or last name ("Layla", "Vikram's") matches every member
+    who has it.
+    """
+    index = _get_name_index()
+    lowered = question.lower()
+    members = [code for name, code in index.full.items() if name in lowered]
+    if members:
+        return members
+
+    for token in NAME_TOKEN_RE.findall(question):
+        if not token[0].isupper():
+            continue  # "will", "may", "grace" as ordinary words
+        token = re.sub(r"['’]s$", "", token.lower()).strip("'’-")
+        for code in index.parts.get(token, []):
+            if code not in members:
+                members.append(code)
+    return members
+
+
+def plan_query(question: str) -> Optional[Dict]:
+    """
+    {"intent", "members", "terms", "extreme", "message_count"} for aggregate
+    questions, None for anything else. intent is "per_member" (each member /
+    who ... most) or "count" (how many / how often), both only when the
+    question is about messages or requests (ABOUT_MESSAGES_RE), or "list"
+    (list all / every single); terms are the content words left after
+    removing intent words and the members' names; extreme is "most" / "least"
+    when only the top or bottom member is wanted; message_count is set when
+    the question asks for a number of messages as such.
+    """
+    if not QUERY_PLANNER:
+        return None
+    about_messages = ABOUT_MESSAGES_RE.search(question) is not None
+    if about_messages and PER_MEMBER_RE.search(question):
+        intent = "per_member"
+    elif about_messages and COUNT_RE.search(question):
+        intent = "count"
+    elif LIST_RE.search(question):
+        intent = "list"
+    else:
+        return None
+
+    members = match_members(question)
+    names = get_analytics().names
+    name_tokens = {token for code in members for token in tokenize(names[code])}
+    terms = [t for t in tokenize(question) if t not in INTENT_WORDS and t not in name_tokens]
+    extreme = EXTREME_RE.search(question)
+    return {
+        "intent": intent,
+        "members": members,
+        "terms": list(dict.fromkeys(terms)),
+        "extreme": ("most" if extreme.group(1).lower() == "most" else "least") if extreme else None,
+        "message_count": intent != "list" and MESSAGE_COUNT_RE.search(question) is not None
+    }
+
+
+def _date_span(match: re.Match) -> Optional[Tuple[datetime, datetime]]:
+    """[start, end] (UTC) of the day, month or year a DATE_RE match names"""
+    try:
+        if match.group("iso"):
+            start = datetime.fromisoformat(match.group("iso")).replace(tzinfo=timezone.utc)
+            return start, start + timedelta(days=1) - timedelta(microseconds=1)
+        if match.group("month"):
+            year, month = int(match.group("year")), MONTHS[match.group("month")[:3].lower()]
+            if match.group("day"):
+                start = datetime(year, month, int(match.group("day")), tzinfo=timezone.utc)
+                return start, start + timedelta(days=1) - timedelta(microseconds=1)
+            start = datetime(year, month, 1, tzinfo=timezone.utc)
+            end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+            return start, end - timedelta(microseconds=1)
+        year = int(match.group("bare_year"))
+        return (datetime(year, 1, 1, tzinfo=timezone.utc),
+                datetime(year + 1, 1, 1, tzinfo=timezone.utc) - timedelta(microseconds=1))
+    except ValueError:
+        return None  # February 30th and friends
+
+
+def extract_time_window(question: str) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    (since, until) of when messages were sent, from explicit dates: "since
+    March 2025" on its own, or "messages sent in May 2025", "posted on
+    2025-05-05", "sent before 2025-06-01", "sent between Jan 2025 and March
+    2025" - any date only with send-time wording (SEND_TIME_RE).
+    A bare year only counts after a preposition ("sent in 2025").
+    """
+    since = until = None
+    send_time = SEND_TIME_RE.search(question) is not None
+    for match in DATE_RE.finditer(question):
+        prep = (match.group("prep") or "").lower()
+        if match.group("bare_year") and not prep:
+            continue
+        if prep != "since" and not send_time:
+            continue
+        date_span = _date_span(match)
+        if date_span is None:
+            continue
+        start, end = date_span
+        if prep in ("since", "from", "between"):
+            since = start
+        elif prep == "after":
+            since = end + timedelta(microseconds=1)
+        elif prep == "before":
+            until = start - timedelta(microseconds=1)
+        elif prep in ("until", "till", "by", "and"):
+            until = end
+        else:
+            since = start if since is None else min(since, start)
+            until = end if until is None else max(until, end)
+    return since, until
+
+
+def extract_filters(question: str) -> Optional[SearchFilter]:
+    """Members named in the question and any explicit time window, as a search filter"""
+    if not SEARCH_FILTERS:
+        return None
+    names = get_analytics().names
+    since, until = extract_time_window(question)
+    query_filter = SearchFilter([names[code] for code in match_members(question)], since, until)
+    return query_filter or None
+
+
+def _as_hit(msg: Dict) -> Dict:
+    """Feed message -> the shape search_relevant_messages returns"""
+    return {
+        "id": message_point_id(msg),
+        "user_name": msg["user_name"],
+        "user_id": msg["user_id"],
+        "timestamp": msg["timestamp"],
+        "message": msg["message"]
+    }
+
+
+def _match_terms(messages: List[Dict], terms: List[str]) -> Tuple[List[Dict], str]:
+    """Messages containing every term (any variant), else any term; says which"""
+    groups = [set(_term_variants(t)) for t in terms]
+    tokens = [set(tokenize(msg["message"])) for msg in messages]
+    every = [msg for msg, words in zip(messages, tokens) if all(words & group for group in groups)]
+    if every or len(groups) == 1:
+        return every, "all of"
+    return [msg for msg, words in zip(messages, tokens) if any(words & group for group in groups)], "any of"
+
+
+def _search_terms(terms: List[str]) -> Tuple[List[Dict], str]:
+    """Same as _match_terms, over the whole corpus via the keyword index postings"""
+    groups = [_term_variants(t) for t in terms]
+    index = get_keyword_index()
+    hits, how = index.matching(groups, require_all=True), "all of"
+    if not hits and len(groups) > 1:
+        hits, how = index.matching(groups, require_all=False), "any of"
+    messages = [{"id": hit["id"], **{k: hit["payload"][k] for k in ("user_name", "user_id", "timestamp", "message")}} for hit in hits]
+    messages.sort(key=lambda msg: msg["timestamp"])
+    return messages, how
+
+
+def _count_answer(plan: Dict) -> str:
+    """Message-count questions with no topic: answered straight from the analytics counts"""
+    analytics = get_analytics()
+    intent, members = plan["intent"], plan["members"]
+    if members and intent != "per_member":
+        counts = [(analytics.names[code], analytics.member_count(code)) for code in members]
+        return "; ".join(f"{name} has sent {count} message{'s' if count != 1 else ''}" for name, count in counts) + "."
+
+    counts = analytics.member_counts()
+    if intent == "per_member" and plan["extreme"] and counts:
+        target = counts[0][1] if plan["extreme"] == "most" else counts[-1][1]
+        names = [name for name, count in counts if count == target]
+        return f"{', '.join(names)} sent the {'most' if plan['extreme'] == 'most' else 'fewest'} messages ({target})."
+    if intent == "per_member":
+        shown = ", ".join(f"{name}: {count}" for name, count in counts[:MAX_LISTED_MEMBERS])
+        more = f" (and {len(counts) - MAX_LISTED_MEMBERS} more)" if len(counts) > MAX_LISTED_MEMBERS else ""
+        return f"Messages per member, most first: {shown}{more}."
+    return f"There are {len(analytics)} messages from {len(counts)} members."
+
+
+def _summary(plan: Dict, matched: List[Dict], how: str, scanned: str) -> str:
+    per_member: Dict[str, int] = {}
+    for msg in matched:
+        per_member[msg["user_name"]] = per_member.get(msg["user_name"], 0) + 1
+    ranked = sorted(per_member.items(), key=lambda item: item[1], reverse=True)
+
+    lines = [f"Exact counts over {scanned} (every message was checked, not a sample):"]
+    if plan["terms"]:
+        lines.append(f"{len(matched)} messages contain {how}: {', '.join(plan['terms'])}")
+    else:
+        lines.append(f"{len(matched)} messages")
+    lines.extend(f"- {name}: {count}" for name, count in ranked[:MAX_LISTED_MEMBERS])
+    if len(ranked) > MAX_LISTED_MEMBERS:
+        lines.append(f"- ... and {len(ranked) - MAX_LISTED_MEMBERS} more members")
+    return "\n".join(lines)
+
+
+def execute_plan(plan: Dict) -> Optional[Dict]:
+    """
+    Resolve a plan exhaustively. Returns {"answer"} when the numbers are the
+    answer (no LLM call needed), {"context", "messages"} when the LLM should
+    phrase it from a compact summary plus the matching messages, or None to
+    fall back to regular retrieval (nothing loaded yet, or nothing matched).
+    When the matches don't all fit AGGREGATE_TOKEN_BUDGET, the newest are kept.
+    """
+    intent, members, terms = plan["intent"], plan["members"], plan["terms"]
+    analytics = get_analytics()
+    if not len(analytics):
+        return None
+
+    if not terms and plan.get("message_count"):
+        return {"answer": _count_answer(plan), "messages": []}
+
+    if members:
+        member_messages = get_member_messages(members)
+        if member_messages is None:
+            return None
+        names = ", ".join(analytics.names[code] for code in members[:5])
+        if len(members) > 5:
+            names += f" and {len(members) - 5} other members"
+        scanned = f"all {len(member_messages)} messages from {names}"
+        if terms:
+            matched, how = _match_terms(member_messages, terms)
+            if not matched:
+                # Topic words that never appear verbatim ("cars" when they wrote
+                # "two vehicles"): retrieval, filtered to these members, ranks
+                # by meaning; a budget-cut slice of their history would not
+                return None
+        else:
+            matched, how = member_messages, None
+        matched = [_as_hit(msg) for msg in matched]
+    elif terms:
+        matched, how = _search_terms(terms)
+        scanned = f"all {len(analytics)} messages"
+        if not matched:
+            return None
+    else:
+        return None
+
+    plan = dict(plan, terms=terms if how else [])
+    summary = _summary(plan, matched, how, scanned)
+    # Packed newest first so a cut drops old messages, not the latest state of things
+    packed = pack_in_order(matched[::-1], budget=max(0, AGGREGATE_TOKEN_BUDGET - estimate_tokens(summary)))[::-1]
+    context = summary + "\n\nMatching messages"
+    if len(packed) < len(matched):
+        context += f" (newest {len(packed)} of {len(matched)})"
+    context += ":\n\n" + serialize_messages(packed)
+    print(f"🧮 Aggregate {intent}: {len(matched)} matching messages, {len(packed)} in context")
+    return {"context": context, "messages": packed}
+
+
+def plan_and_execute(question: str) -> Optional[Dict]:
+    """plan_query + execute_plan; None means use regular retrieval"""
+    plan = plan_query(question)
+    if plan is None:
+        return None
+    with span("aggregate"):
+        result = execute_plan(plan)
+    path = "fallback" if result is None else ("direct" if "answer" in result else "llm")
+    AGGREGATE_QUERIES.inc(1, plan["intent"], path)
+    return result
+
+
+async def plan_and_execute_async(question: str) -> Optional[Dict]:
+    # The member lookups take the message cache lock, which a reload can hold for a while
+    return await asyncio.to_thread(plan_and_execute, question)
@@ -0,0 +1,221 @@
+# rate_limiter.py - adaptive pacing and admission control for provider API calls
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from metrics import record_stage, LLM_ADMISSIONS
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate is tuned with AIMD:
+    every successful response adds `increase` requests/sec (up to `max_rate`),
+    every 429 multiplies the rate by `decrease` (down to `min_rate`) and pauses
+    all callers until the provider's Retry-After has passed.
+    """
+
+    def __init__(
+        self,
+        rate: float = 2.0,
+        burst: int = 4,
+        min_rate: float = 0.2,
+        max_rate: float = 20.0,
+        increase: float = 0.25,
+        decrease: float = 0.5
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        # Plain lock (not asyncio.Lock) so one limiter can be shared across
+        # event loops - the critical sections never await.
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token (possibly going into debt) and return how long to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            # Drop any saved-up burst so callers resume at the reduced rate
+            self._tokens = min(self._tokens, 0.0)
+
+    def stats(self) -> dict:
+        return {"rate": round(self.rate, 2), "burst": self.burst}
+
+
+_embedding_limiter = None
+
+
+def get_embedding_limiter() -> AdaptiveRateLimiter:
+    """Process-wide limiter shared by every embeddings call"""
+    global _embedding_limiter
+    if _embedding_limiter is None:
+        _embedding_limiter = AdaptiveRateLimiter(
+            rate=float(os.getenv("EMBED_RATE", "2")),
+            burst=int(os.getenv("EMBED_BURST", "4")),
+            min_rate=float(os.getenv("EMBED_MIN_RATE", "0.2")),
+            max_rate=float(os.getenv("EMBED_MAX_RATE", "20"))
+        )
+    return _embedding_limiter
+
+
+OVERLOADED = "Too many questions in flight, please retry shortly"
+
+
+class Overloaded(Exception):
+    """The call was shed: the admission queue was full or its queue deadline passed"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    At most `max_concurrency` calls run at once; up to `max_queue` more wait
+    in FIFO order, each for at most `queue_timeout` seconds. Anything beyond
+    that is rejected immediately with Overloaded, so a burst is shed at the
+    door instead of piling up provider 429s, timeouts and client retries.
+    Use as `async with controller:` around the call.
+    """
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 64, queue_timeout: float = 10.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._waiters = deque()  # (loop, future) per queued caller
+        # Plain lock for the same reason as AdaptiveRateLimiter: one controller,
+        # any number of event loops. A freed slot is handed straight to the
+        # oldest waiter, on that waiter's own loop.
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    def full(self) -> bool:
+        """True if a new caller would be rejected right now"""
+        with self._lock:
+            return self._active >= self.max_concurrency and len(self._waiters) >= self.max_queue
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                LLM_ADMISSIONS.inc(1, "admitted")
+                return
+            if len(self._waiters) >= self.max_queue:
+                LLM_ADMISSIONS.inc(1, "rejected")
+                raise Overloaded("LLM queue is full", self.retry_after())
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        LLM_ADMISSIONS.inc(1, "queued")
+
+        started = loop.time()
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await waiter[1]
+        except BaseException as e:
+            with self._lock:
+                try:
+                    self._waiters.remove(waiter)
+                    granted = False
+                except ValueError:
+                    granted = True  # the slot was handed over just as we gave up
+            if granted:
+                self.release()
+            if isinstance(e, TimeoutError):
+                LLM_ADMISSIONS.inc(1, "expired")
+                raise Overloaded(f"No LLM slot within {self.queue_timeout}s", self.retry_after()) from None
+            raise
+        record_stage("llm_queue", loop.time() - started)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(_wake, future)
+                    return
+                except RuntimeError:
+                    continue  # that waiter's loop is closed; try the next one
+            self._active -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def stats(self) -> dict:
+        return {"in_flight": self._active, "queued": len(self._waiters)}
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+_llm_admission = None
+
+
+def get_llm_admission() -> AdmissionController:
+    """Process-wide admission control for chat completions"""
+    global _llm_admission
+    if _llm_admission is None:
+        _llm_admission = AdmissionController(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "64")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+        )
+    return _llm_admission
@@ -0,0 +1,231 @@
+# refresh_jobs.py - /refresh as a background job with progress
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Optional, IO
+from answer_cache import get_answer_cache
+from ingest_pipeline import run_ingest_pipeline, rebuild_and_swap_async, CHECKPOINT_PATH
+from keyword_index import get_keyword_index
+from message_fetcher import get_messages_async, replace_messages_async, reload_shared_corpus, start_background_sync
+from shared_corpus import get_shared_corpus, SHARED_CORPUS, SHARED_CORPUS_POLL
+from vector_store import reload_shared_state
+
+try:
+    import fcntl
+except ImportError:  # Windows: no gunicorn there, so the in-process check is enough
+    fcntl = None
+
+REFRESH_JOB_HISTORY = int(os.getenv("REFRESH_JOB_HISTORY", "20"))
+# Every worker's refresh writes the same checkpoint, indexes and collections
+REFRESH_LOCK_PATH = os.getenv("REFRESH_LOCK_PATH", f"{CHECKPOINT_PATH}.lock")
+
+
+class RefreshInProgress(Exception):
+    """Another worker process is running a refresh"""
+
+    def __init__(self, job_id: Optional[str]):
+        super().__init__(f"Refresh job {job_id or '(unknown)'} is already running in another worker")
+        self.job_id = job_id
+
+
+class RefreshJob:
+    """One refresh run; progress is fed by the ingest progress_callback"""
+
+    def __init__(self, full: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.full = full
+        self.status = "queued"      # queued | running | succeeded | failed | cancelled
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.warning: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task: Optional[asyncio.Task] = None
+        self.lock_file: Optional[IO] = None
+
+    def on_progress(self, done: int, total: int, stage: str):
+        self.done = done
+        self.total = total
+        self.stage = stage
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "mode": "full" if self.full else "incremental",
+            "status": self.status,
+            "stage": self.stage,
+            "progress": {
+                "done": self.done,
+                "total": self.total,
+                "percent": round(self.done / self.total * 100, 1) if self.total else None
+            },
+            "result": self.result,
+            "error": self.error,
+            "warning": self.warning,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+_jobs: "OrderedDict[str, RefreshJob]" = OrderedDict()
+
+
+async def _run(job: RefreshJob):
+    job.status = "running"
+    job.started_at = time.time()
+    try:
+        if job.full:
+            # Built next to the live store and swapped in, so /ask keeps serving
+            summary = await rebuild_and_swap_async(progress_callback=job.on_progress, collect_messages=True)
+        else:
+            summary = await run_ingest_pipeline(progress_callback=job.on_progress, collect_messages=True)
+        job.stage = "finalize"
+        get_answer_cache().clear()  # answers were tied to the old dataset version
+        messages = summary.pop("messages", None)
+        job.result = summary
+        try:
+            # The message cache and analytics follow the feed the pipeline just
+            # streamed; only a resumed run (which skipped the first pages) refetches
+            if messages is not None:
+                await replace_messages_async(messages)
+            else:
+                await get_messages_async(force_refresh=True)
+        except Exception as e:
+            job.warning = f"Index refreshed, but the message cache wasn't updated: {e}"
+            print(f"⚠️ Refresh job {job.id}: {job.warning}")
+        job.status = "succeeded"
+        print(f"✅ Refresh job {job.id} finished: {summary['total']} messages")
+    except asyncio.CancelledError:
+        job.status = "cancelled"
+        raise
+    except Exception as e:
+        job.error = str(e)
+        job.status = "failed"
+        print(f"✗ Refresh job {job.id} failed: {e}")
+    finally:
+        job.finished_at = time.time()
+        _unlock_refresh(job)
+
+
+def _lock_refresh(job: RefreshJob):
+    """
+    Take the cross-process refresh lock for `job` and record its id in the
+    lock file. Raises RefreshInProgress (with the holder's job id) if another
+    process has it; the OS drops the lock if that process dies.
+    """
+    if fcntl is None:
+        return
+    if os.path.dirname(REFRESH_LOCK_PATH):
+        os.makedirs(os.path.dirname(REFRESH_LOCK_PATH), exist_ok=True)
+    lock_file = open(REFRESH_LOCK_PATH, "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.seek(0)
+        holder = lock_file.read().strip() or None
+        lock_file.close()
+        raise RefreshInProgress(holder)
+    lock_file.truncate(0)
+    lock_file.write(job.id)
+    lock_file.flush()
+    job.lock_file = lock_file
+
+
+def _unlock_refresh(job: RefreshJob):
+    if job.lock_file is not None:
+        fcntl.flock(job.lock_file, fcntl.LOCK_UN)
+        job.lock_file.close()
+        job.lock_file = None
+
+
+def active_job() -> Optional[RefreshJob]:
+    for job in _jobs.values():
+        if job.active:
+            return job
+    return None
+
+
+def start_refresh_job(full: bool = False) -> RefreshJob:
+    """
+    Start a refresh on the running loop and return immediately.
+    Only one refresh runs at a time: while one is active in this process it
+    is returned instead, and while another worker runs one (REFRESH_LOCK_PATH)
+    RefreshInProgress is raised.
+    """
+    job = active_job()
+    if job is not None:
+        return job
+
+    job = RefreshJob(full)
+    _lock_refresh(job)
+    _jobs[job.id] = job
+    finished = [job_id for job_id, j in _jobs.items() if not j.active]
+    for job_id in finished[:max(0, len(finished) - REFRESH_JOB_HISTORY)]:
+        del _jobs[job_id]
+
+    job.task = asyncio.get_running_loop().create_task(_run(job))
+    print(f"🚀 Refresh job {job.id} started ({'full' if full else 'incremental'})")
+    return job
+
+
+def get_refresh_job(job_id: str) -> Optional[RefreshJob]:
+    return _jobs.get(job_id)
+
+
+async def cancel_refresh_jobs():
+    """Shutdown hook: stop a running refresh (an incremental run resumes from its checkpoint) and the watcher"""
+    job = active_job()
+    for task in (job.task if job is not None else None, _watcher):
+        if task is None:
+            continue
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def reload_shared_data() -> bool:
+    """Remap whatever other workers published: corpus, local index, keyword index, dataset version"""
+    changed = reload_shared_corpus()
+    changed = reload_shared_state() or changed
+    changed = get_keyword_index().reload_if_changed() or changed
+    return changed
+
+
+_watcher: Optional[asyncio.Task] = None
+
+
+def start_shared_data_watcher():
+    """
+    Startup hook (SHARED_CORPUS): every SHARED_CORPUS_POLL seconds, remap new
+    versions published by other workers, and take over feed syncing if the
+    leader worker has gone away.
+    """
+    global _watcher
+    if not SHARED_CORPUS:
+        return
+
+    async def watch():
+        while True:
+            await asyncio.sleep(SHARED_CORPUS_POLL)
+            try:
+                await asyncio.to_thread(reload_shared_data)  # cached answers expire with the dataset version
+                if not get_shared_corpus().is_leader() and get_shared_corpus().try_lead():
+                    print("👑 Took over as leader worker")
+                    start_background_sync()
+            except Exception as e:
+                print(f"⚠️ Shared data check failed: {e}")
+
+    _watcher = asyncio.get_running_loop().create_task(watch())
@@ -0,0 +1,133 @@
+# search_filters.py - member / time-window restrictions for vector and keyword search
+import numpy as np
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Tuple
+from qdrant_client.models import Filter, FieldCondition, MatchAny, DatetimeRange, PayloadSchemaType
+
+# Payload fields Qdrant indexes on ingest (PayloadColumns is the in-process equivalent)
+PAYLOAD_INDEXES = {
+    "user_id": PayloadSchemaType.KEYWORD,
+    "user_name": PayloadSchemaType.KEYWORD,
+    "timestamp": PayloadSchemaType.DATETIME,
+}
+
+
+def parse_timestamp(value: Optional[str]) -> float:
+    """ISO-8601 timestamp -> epoch seconds (naive means UTC); NaN if missing or unparseable"""
+    if not value:
+        return float("nan")
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return float("nan")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class SearchFilter:
+    """Only messages from `user_names` (any of) and/or sent within [since, until]"""
+
+    def __init__(
+        self,
+        user_names: Optional[List[str]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ):
+        self.user_names = sorted(set(user_names or []))
+        self.since = since
+        self.until = until
+
+    def __bool__(self) -> bool:
+        return bool(self.user_names) or self.since is not None or self.until is not None
+
+    def key(self) -> Tuple:
+        return (tuple(self.user_names), self.since, self.until)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SearchFilter) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def __repr__(self) -> str:
+        parts = []
+        if self.user_names:
+            parts.append(f"members={self.user_names}")
+        if self.since is not None:
+            parts.append(f"since={self.since.isoformat()}")
+        if self.until is not None:
+            parts.append(f"until={self.until.isoformat()}")
+        return f"SearchFilter({', '.join(parts)})"
+
+    def to_qdrant(self) -> Optional[Filter]:
+        conditions = []
+        if self.user_names:
+            conditions.append(FieldCondition(key="user_name", match=MatchAny(any=self.user_names)))
+        if self.since is not None or self.until is not None:
+            conditions.append(FieldCondition(key="timestamp", range=DatetimeRange(gte=self.since, lte=self.until)))
+        return Filter(must=conditions) if conditions else None
+
+
+class PayloadColumns:
+    """
+    Per-row member code and parsed timestamp, kept parallel to an index's
+    payload list so filters become vectorized masks instead of payload scans.
+    Member codes are stable for the life of the object (names only get added).
+    """
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.user_codes = np.zeros(0, dtype=np.int32)
+        self.timestamps = np.zeros(0, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.user_codes)
+
+    def _code(self, name: str) -> int:
+        return self.codes.setdefault(name, len(self.codes))
+
+    def extend(self, payloads: List[Dict]):
+        self.user_codes = np.concatenate([
+            self.user_codes,
+            np.fromiter((self._code(p.get("user_name", "")) for p in payloads), dtype=np.int32, count=len(payloads))
+        ])
+        self.timestamps = np.concatenate([
+            self.timestamps,
+            np.fromiter((parse_timestamp(p.get("timestamp")) for p in payloads), dtype=np.float64, count=len(payloads))
+        ])
+
+    def select(self, keep):
+        """Keep only rows `keep` (a boolean mask or row indices), in that order"""
+        self.user_codes = self.user_codes[keep]
+        self.timestamps = self.timestamps[keep]
+
+    def mask(self, query_filter: SearchFilter) -> np.ndarray:
+        selected = np.ones(len(self.user_codes), dtype=bool)
+        if query_filter.user_names:
+            codes = [self.codes[name] for name in query_filter.user_names if name in self.codes]
+            selected &= np.isin(self.user_codes, codes)
+        # NaN timestamps compare False, so undated rows drop out of any time window
+        if query_filter.since is not None:
+            selected &= self.timestamps >= query_filter.since.timestamp()
+        if query_filter.until is not None:
+            selected &= self.timestamps <= query_filter.until.timestamp()
+        return selected
+
+    def save(self, path: str):
+        np.savez(path, user_codes=self.user_codes, timestamps=self.timestamps, names=np.array(list(self.codes), dtype=str))
+
+    @classmethod
+    def load(cls, path: str) -> "PayloadColumns":
+        data = np.load(path, allow_pickle=False)
+        columns = cls()
+        columns.codes = {str(name): code for code, name in enumerate(data["names"].tolist())}
+        columns.user_codes = data["user_codes"]
+        columns.timestamps = data["timestamps"]
+        return columns
+
+    @classmethod
+    def from_payloads(cls, payloads: List[Dict]) -> "PayloadColumns":
+        columns = cls()
+        columns.extend(payloads)
+        return columns
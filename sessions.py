@@ -0,0 +1,151 @@
+# sessions.py - short-lived conversation state so /ask can take follow-up questions
+import os
+import re
+import time
+import asyncio
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from keyword_index import tokenize
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))              # seconds after the last turn
+SESSION_MAX = int(os.getenv("SESSION_MAX", "500"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "30"))
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "3"))
+SESSION_ANSWER_CHARS = 200
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# A question opening like this continues the previous turn
+FOLLOW_UP_RE = re.compile(r"^\s*(and|what about|how about)\b", re.IGNORECASE)
+# A pronoun only points back at the conversation when the question says
+# little else: "where is she staying?" does, "who has a car that needs
+# servicing?" and "which restaurants are there in Tokyo?" don't
+PERSON_PRONOUNS = frozenset("she he her hers him his they them their theirs".split())
+THING_PRONOUNS = frozenset("it its there that those these then".split())
+FOLLOW_UP_FILLER = frozenset("else also same".split())
+FOLLOW_UP_MAX_TERMS = {"person": 3, "thing": 1}  # content words a pronoun follow-up may carry
+
+
+def is_anaphoric(question: str) -> bool:
+    """
+    Leads with "and" / "what about" / "how about", or leans on a pronoun with
+    at most FOLLOW_UP_MAX_TERMS other content words (a person pronoun allows
+    more than "it" / "that" / "there", which are often just grammar)
+    """
+    if FOLLOW_UP_RE.search(question):
+        return True
+    words = [w.lower() for w in _WORD_RE.findall(question)]
+    if any(w in PERSON_PRONOUNS for w in words):
+        limit = FOLLOW_UP_MAX_TERMS["person"]
+    elif any(w in THING_PRONOUNS for w in words):
+        limit = FOLLOW_UP_MAX_TERMS["thing"]
+    else:
+        return False
+    ignored = PERSON_PRONOUNS | THING_PRONOUNS | FOLLOW_UP_FILLER
+    return len([t for t in tokenize(question) if t not in ignored]) <= limit
+
+
+class Session:
+    """
+    One conversation: its turns, the messages retrieved for it so far (best
+    first, vectors kept as float32 for context dedup) and the packed context
+    built from them, which is reused until the messages change.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turns: List[Tuple[str, str]] = []
+        self.messages: List[Dict] = []
+        self.version: Optional[str] = None  # dataset version the messages came from
+        self.context: Optional[str] = None
+        self.lock = asyncio.Lock()          # one turn at a time per session
+        self.last_used = time.monotonic()
+
+    def members(self) -> List[str]:
+        return list(dict.fromkeys(msg["user_name"] for msg in self.messages))
+
+    def is_follow_up(self, question: str, named: List[str]) -> bool:
+        """Refers back to the conversation (see is_anaphoric) and names nobody new"""
+        if not self.turns or not is_anaphoric(question):
+            return False
+        return set(named) <= set(self.members())
+
+    def set_messages(self, messages: List[Dict], version: str):
+        """Start over from a fresh retrieval"""
+        self.messages = []
+        self.version = version
+        self.context = None
+        self.add_messages(messages)
+
+    def add_messages(self, messages: List[Dict]) -> int:
+        """Append messages not seen yet (while there is room); returns how many were added"""
+        seen = {msg["id"] for msg in self.messages}
+        added = 0
+        for msg in messages:
+            if len(self.messages) >= SESSION_MAX_MESSAGES:
+                break
+            if msg["id"] in seen:
+                continue
+            if msg.get("vector") is not None:
+                msg = dict(msg, vector=np.asarray(msg["vector"], dtype=np.float32))
+            self.messages.append(msg)
+            seen.add(msg["id"])
+            added += 1
+        if added:
+            self.context = None
+        return added
+
+    def record(self, question: str, answer: str):
+        self.turns.append((question, answer))
+        del self.turns[:-SESSION_HISTORY_TURNS]
+
+    def summary(self) -> str:
+        """The last few turns, answers clipped"""
+        lines = []
+        for question, answer in self.turns:
+            if len(answer) > SESSION_ANSWER_CHARS:
+                answer = answer[:SESSION_ANSWER_CHARS].rsplit(" ", 1)[0] + " ..."
+            lines.append(f"Q: {question}\nA: {answer}")
+        return "\n".join(lines)
+
+
+class SessionStore:
+    """LRU of sessions by id, capped at SESSION_MAX; a session expires SESSION_TTL seconds after its last use"""
+
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl: float = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Session:
+        """The live session with this id, or a new empty one"""
+        now = time.monotonic()
+        with self._lock:
+            # Least recently used first, so expired sessions are all at the front
+            while self._sessions and next(iter(self._sessions.values())).last_used + self.ttl < now:
+                self._sessions.popitem(last=False)
+
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Session(session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = now
+            return session
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+_session_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    global _session_store
+    if _session_store is None:
+        _session_store = SessionStore()
+    return _session_store
@@ -0,0 +1,186 @@
+# shared_corpus.py - the message corpus as versioned, memory-mapped files shared by every worker
+import os
+import json
+import mmap
+import shutil
+import numpy as np
+from collections.abc import Sequence
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no gunicorn there, so a single process owns the corpus
+    fcntl = None
+
+SHARED_CORPUS = os.getenv("SHARED_CORPUS", "true").lower() == "true"
+SHARED_CORPUS_DIR = os.getenv("SHARED_CORPUS_DIR", "data/corpus")
+SHARED_CORPUS_POLL = float(os.getenv("SHARED_CORPUS_POLL", "2"))  # seconds between checks for new versions
+SHARED_CORPUS_KEEP = 3  # versions left on disk; a slow worker may still be mapping an older one
+
+
+class MappedMessages(Sequence):
+    """
+    Read-only message list backed by one corpus version: the JSONL bytes and
+    the row offsets are memory-mapped, so every process shares the same page
+    cache and a message is only decoded when it is indexed.
+    """
+
+    def __init__(self, path: str, version: int):
+        self.path = path
+        self.version = version
+        with open(os.path.join(path, "meta.json")) as f:
+            self.header: Dict = json.load(f)
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "messages.jsonl"), "rb") as f:
+            # mmap can't map an empty file
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        return json.loads(self._data[int(self.offsets[index]):int(self.offsets[index + 1])])
+
+    def columns(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """(member names, per-row member codes, per-row days) as MessageAnalytics.columns() wrote them"""
+        with open(os.path.join(self.path, "names.json")) as f:
+            names = json.load(f)
+        user_codes = np.load(os.path.join(self.path, "user_codes.npy"), mmap_mode="r")
+        days = np.load(os.path.join(self.path, "days.npy"), mmap_mode="r")
+        return names, user_codes, days
+
+
+class SharedCorpus:
+    """
+    Corpus versions under SHARED_CORPUS_DIR (v000001, v000002, ...) with a
+    CURRENT pointer, same layout as the local vector index. Any process may
+    publish (serialized by a file lock); every process attaches to CURRENT
+    and remaps when it moves. One process at a time holds the leader lock
+    and is the one that keeps the corpus synced with the feed.
+    """
+
+    def __init__(self, root: str = SHARED_CORPUS_DIR):
+        self.root = root
+        self._leader_file = None
+
+    def _version_dir(self, version: int) -> str:
+        return os.path.join(self.root, f"v{version:06d}")
+
+    def current_version(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.root, "CURRENT")) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def attach(self, version: Optional[int] = None) -> Optional[MappedMessages]:
+        """Map CURRENT (or `version`); None if there is nothing published yet"""
+        version = self.current_version() if version is None else version
+        if version is None:
+            return None
+        try:
+            return MappedMessages(self._version_dir(version), version)
+        except FileNotFoundError:
+            return None  # retired between reading CURRENT and opening it
+
+    @contextmanager
+    def _publish_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "PUBLISH.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def publish(
+        self,
+        messages: List[Dict],
+        columns: Tuple[List[str], np.ndarray, np.ndarray],
+        header: Dict,
+        base: Optional[MappedMessages] = None
+    ) -> MappedMessages:
+        """
+        Write `messages` (appended to `base`'s rows, if given) as the next
+        version with its analytics columns and repoint CURRENT at it.
+        Appending copies base's bytes as-is - nothing already published is
+        decoded again.
+        """
+        names, user_codes, days = columns
+        with self._publish_lock():
+            existing = [int(d[1:]) for d in os.listdir(self.root) if d.startswith("v") and d[1:].isdigit()]
+            version = max(existing, default=0) + 1
+            path = self._version_dir(version)
+            tmp_path = f"{path}.tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+
+            offsets = [int(base.offsets[-1]) if base is not None else 0]
+            with open(os.path.join(tmp_path, "messages.jsonl"), "wb") as f:
+                if base is not None:
+                    f.write(base._data[:offsets[0]])
+                for msg in messages:
+                    line = (json.dumps(msg) + "\n").encode("utf-8")
+                    f.write(line)
+                    offsets.append(offsets[-1] + len(line))
+            offsets = np.asarray(offsets, dtype=np.int64)
+            if base is not None:
+                offsets = np.concatenate([base.offsets[:-1], offsets])
+
+            np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+            np.save(os.path.join(tmp_path, "user_codes.npy"), np.asarray(user_codes, dtype=np.int32))
+            np.save(os.path.join(tmp_path, "days.npy"), np.asarray(days, dtype=np.int64))
+            with open(os.path.join(tmp_path, "names.json"), "w") as f:
+                json.dump(names, f)
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump(header, f)
+            os.replace(tmp_path, path)
+
+            tmp_pointer = os.path.join(self.root, "CURRENT.tmp")
+            with open(tmp_pointer, "w") as f:
+                f.write(str(version))
+            os.replace(tmp_pointer, os.path.join(self.root, "CURRENT"))
+
+            # Workers still mapping a retired version keep reading it (the
+            # mapping outlives the unlink) until their watcher remaps
+            for old in sorted(existing)[:-SHARED_CORPUS_KEEP + 1]:
+                shutil.rmtree(self._version_dir(old), ignore_errors=True)
+
+        print(f"📤 Published corpus v{version} ({len(offsets) - 1} messages)")
+        return MappedMessages(path, version)
+
+    def try_lead(self) -> bool:
+        """
+        Take the leader lock if no live process holds it. The OS drops the lock
+        when its holder exits, so a follower can take over on its next try.
+        Only call this from workers: a lock taken before fork is shared by the children.
+        """
+        if self._leader_file is not None or fcntl is None:
+            return True
+        os.makedirs(self.root, exist_ok=True)
+        leader_file = open(os.path.join(self.root, "LEADER.lock"), "a")
+        try:
+            fcntl.flock(leader_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            leader_file.close()
+            return False
+        self._leader_file = leader_file
+        return True
+
+    def is_leader(self) -> bool:
+        return self._leader_file is not None or fcntl is None
+
+
+_shared_corpus: Optional[SharedCorpus] = None
+
+
+def get_shared_corpus() -> SharedCorpus:
+    global _shared_corpus
+    if _shared_corpus is None:
+        _shared_corpus = SharedCorpus()
+    return _shared_corpus
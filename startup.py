@@ -0,0 +1,118 @@
+# startup.py - background warmup, readiness and a startup-time breakdown
+import os
+import time
+import asyncio
+from typing import Dict, Optional, Awaitable, Callable
+
+WARMUP_STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", "30"))
+
+
+class WarmupFailed(Exception):
+    """A required warmup step failed, so requests that need the warmup can't be served"""
+
+
+def _process_started_at() -> float:
+    """Wall-clock time this process was spawned (Linux); else when this module was imported"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesised command name; starttime is field 22 overall
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+class Startup:
+    """
+    Startup timeline of this process: milestones (seconds since the process
+    was spawned) and the duration of each warmup step. The warmup runs as a
+    background task, so the server binds and answers /health right away
+    while the heavy imports, pool preconnects, snapshot load and collection
+    check happen; requests that need them await wait_ready().
+    The warmup always ends in a terminal state: ready, or failed with the
+    reason (a required step failed, or the warmup itself raised).
+    """
+
+    def __init__(self):
+        self.process_started = _process_started_at()
+        self.milestones: Dict[str, float] = {}
+        self.steps: Dict[str, Dict] = {}
+        self.ready = False
+        self.failed: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def mark(self, milestone: str):
+        """Record a milestone the first time it happens"""
+        self.milestones.setdefault(milestone, round(time.time() - self.process_started, 3))
+
+    async def step(self, name: str, work: Awaitable, required: bool = False) -> bool:
+        """
+        Run one warmup step under WARMUP_STEP_TIMEOUT; True if it succeeded.
+        A failure is recorded, not raised - unless the step is `required`,
+        which raises WarmupFailed and ends the warmup.
+        """
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(WARMUP_STEP_TIMEOUT):
+                await work
+            self.steps[name] = {"seconds": round(time.perf_counter() - started, 3)}
+            return True
+        except Exception as e:
+            self.steps[name] = {"seconds": round(time.perf_counter() - started, 3), "error": str(e) or type(e).__name__}
+            print(f"⚠️ Warmup step {name} failed: {self.steps[name]['error']}")
+            if required:
+                raise WarmupFailed(f"Warmup step {name} failed: {self.steps[name]['error']}") from e
+            return False
+
+    def start(self, warmup: Callable[[], Awaitable]):
+        async def run():
+            self.mark("warmup_started")
+            try:
+                await warmup()
+            except Exception as e:
+                self.failed = str(e) or type(e).__name__
+                self.mark("warmup_failed")
+                print(f"✗ Warmup failed, not serving /ask: {self.failed}")
+                return
+            self.ready = True
+            self.mark("ready")
+            breakdown = ", ".join(f"{name} {info['seconds']}s" for name, info in self.steps.items())
+            print(f"🚀 Ready {self.milestones['ready']}s after process start ({breakdown})")
+
+        self._task = asyncio.get_running_loop().create_task(run())
+
+    async def wait_ready(self):
+        """Wait for the warmup to finish (immediately true once it has); never cancels it. Raises WarmupFailed if it failed"""
+        if self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+        if self.failed is not None:
+            raise WarmupFailed(self.failed)
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def report(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "failed": self.failed,
+            "uptime_seconds": round(time.time() - self.process_started, 3),
+            "milestones": dict(self.milestones),
+            "warmup_steps": {name: dict(info) for name, info in self.steps.items()}
+        }
+
+
+_startup: Optional[Startup] = None
+
+
+def get_startup() -> Startup:
+    global _startup
+    if _startup is None:
+        _startup = Startup()
+    return _startup
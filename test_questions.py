@@ -17,30 +17,31 @@ test_cases = [
     "What did Sophia book for Friday?"
 ]
 
-print("🧪 Testing Question-Answering System\n")
-print("=" * 80)
-
-for i, question in enumerate(test_cases, 1):
-    print(f"\n{i}. Question: {question}")
-    print("-" * 80)
-    
-    try:
-        response = requests.get(
-            f"{BASE_URL}/ask",
-            params={"question": question},
-            timeout=60
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            answer = data.get("answer", "No answer")
-            print(f"✅ Answer: {answer}")
-        else:
-            print(f"❌ Error {response.status_code}: {response.text}")
-            
-    except Exception as e:
-        print(f"❌ Exception: {e}")
-    
-    print("-" * 80)
-
-print("\n✅ Testing complete!")
+if __name__ == "__main__":
+    print("🧪 Testing Question-Answering System\n")
+    print("=" * 80)
+
+    for i, question in enumerate(test_cases, 1):
+        print(f"\n{i}. Question: {question}")
+        print("-" * 80)
+
+        try:
+            response = requests.get(
+                f"{BASE_URL}/ask",
+                params={"question": question},
+                timeout=60
+            )
+
+            if response.status_code == 200:
+                data = response.json()
+                answer = data.get("answer", "No answer")
+                print(f"✅ Answer: {answer}")
+            else:
+                print(f"❌ Error {response.status_code}: {response.text}")
+
+        except Exception as e:
+            print(f"❌ Exception: {e}")
+
+        print("-" * 80)
+
+    print("\n✅ Testing complete!")
@@ -0,0 +1,43 @@
+# tests/conftest.py - a small in-memory corpus for planner tests
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import keyword_index
+import message_fetcher
+from vector_store import message_payload, message_point_id
+
+
+def make_messages(rows):
+    """(user_name, message) pairs -> feed messages, one hour apart from 2025-01-01"""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    user_ids = {}
+    return [
+        {
+            "id": f"m{i}",
+            "user_id": user_ids.setdefault(name, f"u{len(user_ids)}"),
+            "user_name": name,
+            "timestamp": (start + timedelta(hours=i)).isoformat(),
+            "message": text
+        }
+        for i, (name, text) in enumerate(rows)
+    ]
+
+
+@pytest.fixture
+def load_corpus(tmp_path, monkeypatch):
+    """Serve `rows` as the in-memory message cache, analytics and keyword index"""
+    def load(rows):
+        messages = make_messages(rows)
+        index = keyword_index.KeywordIndex(str(tmp_path / "keyword_index.npz"), load=False)
+        index.upsert([message_point_id(msg) for msg in messages], [message_payload(msg) for msg in messages])
+        monkeypatch.setattr(keyword_index, "_keyword_index", index)
+        message_fetcher._set_messages(messages)
+        return messages
+
+    yield load
+    message_fetcher._set_messages(None)
@@ -0,0 +1,116 @@
+import query_planner
+from query_planner import plan_query, execute_plan, extract_time_window, AGGREGATE_TOKEN_BUDGET
+
+FILLER = "Please book a table for two at a quiet place downtown this weekend, thanks so much"
+
+
+def test_plan_query_count_for_named_member(load_corpus):
+    load_corpus([("Vikram Desai", "hello"), ("Layla Kawaguchi", "hi")])
+    plan = plan_query("How many times did Vikram Desai mention cars?")
+    assert plan == {"intent": "count", "members": [0], "terms": ["cars"], "extreme": None, "message_count": False}
+
+
+def test_plan_query_per_member_extreme(load_corpus):
+    load_corpus([("Vikram Desai", "hello")])
+    plan = plan_query("Who sent the most messages?")
+    assert plan["intent"] == "per_member"
+    assert plan["extreme"] == "most"
+    assert plan["terms"] == []
+
+
+def test_plan_query_list_strips_names_and_intent_words(load_corpus):
+    load_corpus([("Layla Kawaguchi", "hello")])
+    plan = plan_query("List all of Layla's restaurant requests")
+    assert plan["intent"] == "list"
+    assert plan["members"] == [0]
+    assert plan["terms"] == ["restaurant"]
+
+
+def test_plan_query_ignores_non_aggregate_questions(load_corpus):
+    load_corpus([("Layla Kawaguchi", "hello")])
+    assert plan_query("What does Layla want?") is None
+
+
+def test_plan_query_needs_a_question_about_messages(load_corpus):
+    load_corpus([("Sophia Al-Farsi", "hello"), ("Fatima El-Tahir", "hi")])
+    assert plan_query("Can you count on Sophia?") is None
+    assert plan_query("How many people is Fatima's dinner reservation for?") is None
+    assert plan_query("Who has the most cars?") is None
+    assert plan_query("What is the total cost of all the trips?") is None
+    assert plan_query("Does anyone need a car in all of Europe?") is None
+
+
+def test_count_without_topic_is_answered_from_analytics(load_corpus):
+    load_corpus([("Vikram Desai", "a"), ("Vikram Desai", "b"), ("Layla Kawaguchi", "c")])
+    result = execute_plan(plan_query("How many messages has Vikram Desai sent?"))
+    assert result == {"answer": "Vikram Desai has sent 2 messages.", "messages": []}
+
+
+def test_count_of_requests_goes_to_the_llm(load_corpus):
+    # "requests" are not every message, so the analytics total isn't the answer
+    load_corpus([("Vikram Desai", "Book a car"), ("Vikram Desai", "thanks!")])
+    result = execute_plan(plan_query("How many requests has Vikram Desai made?"))
+    assert "answer" not in result
+    assert len(result["messages"]) == 2
+
+
+def test_unmatched_topic_for_member_falls_back_to_retrieval(load_corpus):
+    # The answer only says "vehicles"; handing the LLM a budget-cut slice of
+    # the member's history would drop it, so retrieval has to take over
+    rows = [("Vikram Desai", FILLER)] * 400 + [("Vikram Desai", "I now own two vehicles")]
+    load_corpus(rows)
+    assert execute_plan(plan_query("How many times did Vikram Desai mention cars?")) is None
+
+
+def test_truncated_matches_keep_the_newest(load_corpus):
+    rows = [("Vikram Desai", f"{FILLER}, and the car needs a wash {i}") for i in range(400)]
+    rows.append(("Vikram Desai", "Sold one car, I have two cars now"))
+    load_corpus(rows)
+    result = execute_plan(plan_query("How many times did Vikram Desai mention cars?"))
+    assert result is not None
+    assert 0 < len(result["messages"]) < 401
+    assert result["messages"][-1]["message"] == "Sold one car, I have two cars now"
+    assert f"newest {len(result['messages'])} of 401" in result["context"]
+    assert "401 messages contain all of: cars" in result["context"]
+
+
+def test_corpus_wide_topic_uses_keyword_postings(load_corpus):
+    load_corpus([
+        ("Vikram Desai", "Book the opera in Milan"),
+        ("Layla Kawaguchi", "Any opera tickets left?"),
+        ("Layla Kawaguchi", "Need a car in Tokyo")
+    ])
+    result = execute_plan(plan_query("How many opera requests were made?"))
+    assert [msg["user_name"] for msg in result["messages"]] == ["Vikram Desai", "Layla Kawaguchi"]
+    assert "2 messages contain all of: opera" in result["context"]
+
+
+def test_corpus_wide_topic_without_matches_falls_back(load_corpus):
+    load_corpus([("Vikram Desai", "Book the opera in Milan")])
+    assert execute_plan(plan_query("How many yacht charters were requested?")) is None
+
+
+def test_nothing_loaded_falls_back(load_corpus):
+    load_corpus([])
+    assert execute_plan({"intent": "count", "members": [], "terms": ["car"], "extreme": None, "message_count": False}) is None
+
+
+def test_budget_is_respected(load_corpus):
+    load_corpus([("Vikram Desai", f"{FILLER} car {i}") for i in range(400)])
+    result = execute_plan(plan_query("How many times did Vikram Desai mention cars?"))
+    assert query_planner.estimate_tokens(result["context"]) <= AGGREGATE_TOKEN_BUDGET + 50
+
+
+def test_content_dates_are_not_send_time_filters():
+    assert extract_time_window("When is Layla's trip in December 2025?") == (None, None)
+    assert extract_time_window("What did Sophia plan for 2026?") == (None, None)
+    assert extract_time_window("Who has a dinner between Jan 2025 and March 2025?") == (None, None)
+
+
+def test_send_time_wording_gives_a_window():
+    since, until = extract_time_window("Which messages did Layla send in December 2025?")
+    assert (since.isoformat(), until.date().isoformat()) == ("2025-12-01T00:00:00+00:00", "2025-12-31")
+    since, until = extract_time_window("What was posted between Jan 2025 and March 2025?")
+    assert (since.date().isoformat(), until.date().isoformat()) == ("2025-01-01", "2025-03-31")
+    since, until = extract_time_window("What did Hans ask about since March 2025?")
+    assert since.date().isoformat() == "2025-03-01" and until is None
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rate_limiter import AdmissionController, Overloaded
+
+
+async def _queued(controller: AdmissionController, count: int):
+    """Let the event loop run until `count` callers are waiting"""
+    while controller.stats()["queued"] < count:
+        await asyncio.sleep(0)
+
+
+def test_full_queue_rejects_immediately():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5)
+        await controller.acquire()
+        waiter = asyncio.create_task(controller.acquire())
+        await _queued(controller, 1)
+        assert controller.full()
+
+        started = time.monotonic()
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire()
+        assert time.monotonic() - started < 0.5
+        assert rejected.value.retry_after == 5
+
+        controller.release()  # hands the slot to the queued caller
+        await waiter
+        assert controller.stats() == {"in_flight": 1, "queued": 0}
+        controller.release()
+        assert controller.stats() == {"in_flight": 0, "queued": 0}
+
+    asyncio.run(run())
+
+
+def test_queue_timeout_sheds_the_waiter():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=0.01)
+        await controller.acquire()
+        with pytest.raises(Overloaded):
+            await controller.acquire()
+        assert controller.stats() == {"in_flight": 1, "queued": 0}
+        controller.release()
+        assert controller.stats() == {"in_flight": 0, "queued": 0}
+
+    asyncio.run(run())
+
+
+def test_slot_granted_as_the_waiter_times_out_is_passed_on():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=0.01)
+        await controller.acquire()
+        first = asyncio.create_task(controller.acquire())
+        await _queued(controller, 1)
+
+        # Block the loop past the first waiter's deadline, then free the slot:
+        # it is handed to that waiter, whose timeout fires on the same loop turn
+        time.sleep(0.05)
+        controller.release()
+        second = asyncio.create_task(asyncio.wait_for(_acquire_patiently(controller), 5))
+
+        with pytest.raises(Overloaded):
+            await first
+        await second  # the granted slot went to the next caller instead of leaking
+        assert controller.stats() == {"in_flight": 1, "queued": 0}
+        controller.release()
+        assert controller.stats() == {"in_flight": 0, "queued": 0}
+
+    asyncio.run(run())
+
+
+async def _acquire_patiently(controller: AdmissionController):
+    controller.queue_timeout = 5
+    await controller.acquire()
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_passed_on():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+        await controller.acquire()
+        cancelled = asyncio.create_task(controller.acquire())
+        await _queued(controller, 1)
+        patient = asyncio.create_task(controller.acquire())
+        await _queued(controller, 2)
+
+        controller.release()  # handed to `cancelled`...
+        cancelled.cancel()    # ...which gives up before it runs again
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        await asyncio.wait_for(patient, 5)
+        assert controller.stats() == {"in_flight": 1, "queued": 0}
+
+    asyncio.run(run())
+
+
+def test_waiter_on_a_closed_loop_is_skipped():
+    closed = asyncio.new_event_loop()
+    stale = closed.create_future()
+    closed.close()
+
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+        await controller.acquire()
+        controller._waiters.append((closed, stale))
+        live = asyncio.create_task(controller.acquire())
+        await _queued(controller, 2)
+
+        controller.release()
+        await asyncio.wait_for(live, 5)
+        assert controller.stats() == {"in_flight": 1, "queued": 0}
+        controller.release()
+        assert controller.stats() == {"in_flight": 0, "queued": 0}
+
+    asyncio.run(run())
+
+
+def test_slot_is_handed_to_a_waiter_on_another_loop():
+    controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+    admitted = threading.Event()
+
+    def other_loop():
+        async def wait():
+            await controller.acquire()
+            admitted.set()
+            controller.release()
+        asyncio.run(wait())
+
+    async def run():
+        await controller.acquire()
+        thread = threading.Thread(target=other_loop)
+        thread.start()
+        while controller.stats()["queued"] < 1:
+            await asyncio.sleep(0.001)
+        controller.release()
+        await asyncio.to_thread(thread.join, 5)
+
+    asyncio.run(run())
+    assert admitted.is_set()
+    assert controller.stats() == {"in_flight": 0, "queued": 0}
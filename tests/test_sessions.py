@@ -0,0 +1,42 @@
+import pytest
+
+from sessions import Session
+
+
+@pytest.fixture
+def layla_session():
+    session = Session("s1")
+    session.set_messages([{"id": "m1", "user_name": "Layla Kawaguchi", "message": "Book me a villa in Santorini"}], "v1")
+    session.record("What does Layla want?", "A villa in Santorini.")
+    return session
+
+
+@pytest.mark.parametrize("question", [
+    "Where is she staying?",
+    "What did she book for Friday?",
+    "What else does she want?",
+    "And for how long?",
+    "What about her flights?",
+    "When is it?",
+])
+def test_anaphoric_questions_are_follow_ups(layla_session, question):
+    assert layla_session.is_follow_up(question, [])
+
+
+@pytest.mark.parametrize("question", [
+    "Which restaurants are there in Tokyo?",
+    "Who has a car that needs servicing?",
+    "Who requested tickets to the opera in Milan?",
+    "What kind of car does she prefer and which color for the trip?",
+])
+def test_standalone_questions_are_not_follow_ups(layla_session, question):
+    assert not layla_session.is_follow_up(question, [])
+
+
+def test_naming_someone_new_is_not_a_follow_up(layla_session):
+    assert not layla_session.is_follow_up("What about Sophia Al-Farsi?", ["Sophia Al-Farsi"])
+    assert layla_session.is_follow_up("What about Layla's flights?", ["Layla Kawaguchi"])
+
+
+def test_first_turn_is_never_a_follow_up():
+    assert not Session("s2").is_follow_up("Where is she staying?", [])
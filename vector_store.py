@@ -1,70 +1,145 @@
-# vector_store.py - add rate limit handling
+# vector_store.py - embeddings and pluggable retrieval backends
 import os
+import uuid
 import asyncio
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from typing import List, Dict, Optional, Callable
+import hashlib
+import threading
+import time
+import weakref
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PointIdsList,
+    Filter, FieldCondition, MatchValue, FilterSelector, SearchRequest,
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation,
+    HnswConfigDiff, SearchParams, QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig,
+    ScalarType, BinaryQuantization, BinaryQuantizationConfig
+)
+from typing import List, Dict, Optional, Callable, Set
 from dotenv import load_dotenv
 import httpx
-import time
+from embedding_cache import get_embedding_cache
+from keyword_index import get_keyword_index, reciprocal_rank_fusion
+from http_clients import get_async_client, get_sync_client, aclose_async_client
+from rate_limiter import get_embedding_limiter, parse_retry_after
+from search_filters import SearchFilter, PAYLOAD_INDEXES
+from metrics import span, EMBEDDING_RETRIES, RATE_LIMITED, CACHE_LOOKUPS
 
 load_dotenv()
 
 _client = None
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncQdrantClient
+QDRANT_LOCATION = os.getenv("QDRANT_LOCATION")  # ":memory:" or a directory: embedded Qdrant, no server
 COLLECTION_NAME = "member_messages"
 EXPECTED_DIM = 1024
+EMBEDDING_URL = os.getenv("EMBEDDING_URL", "https://integrate.api.nvidia.com/v1/embeddings")
+EMBEDDING_MODEL = "nvidia/nv-embedqa-e5-v5"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "50"))
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant").lower()
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+RRF_K = int(os.getenv("RRF_K", "60"))
+COLLECTION_STATE_TTL = float(os.getenv("COLLECTION_STATE_TTL", "60"))
+DATASET_VERSION_PATH = os.getenv("DATASET_VERSION_PATH", "data/dataset_version")
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "10"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "10"))
+SEARCH_PROFILE = os.getenv("SEARCH_PROFILE", "default")
 
 
 def get_client():
     global _client
     if _client is None:
-        _client = QdrantClient(
+        if QDRANT_LOCATION == ":memory:":
+            _client = QdrantClient(location=":memory:")
+        elif QDRANT_LOCATION:
+            _client = QdrantClient(path=QDRANT_LOCATION)
+        else:
+            _client = QdrantClient(
+                url=os.getenv("QDRANT_URL"),
+                api_key=os.getenv("QDRANT_API_KEY"),
+                timeout=60
+            )
+    return _client
+
+
+def get_async_qdrant_client() -> AsyncQdrantClient:
+    """AsyncQdrantClient for the running event loop (its connections are loop-bound)"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncQdrantClient(
             url=os.getenv("QDRANT_URL"),
             api_key=os.getenv("QDRANT_API_KEY"),
             timeout=60
         )
-    return _client
+        _async_clients[loop] = client
+    return client
 
 
-async def get_embedding_async(text: str, input_type: str = "passage", max_retries: int = 5) -> List[float]:
-    """Get embedding with retry logic for rate limits"""
-    url = "https://integrate.api.nvidia.com/v1/embeddings"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('NVIDIA_API_KEY')}",
-        "Content-Type": "application/json"
+def message_to_text(msg: Dict) -> str:
+    return f"User: {msg['user_name']}\nDate: {msg['timestamp']}\nMessage: {msg['message']}"
+
+
+def message_point_id(msg: Dict) -> str:
+    """
+    Stable point id derived from the message's identity and content.
+    Same message -> same id regardless of feed order; an edited message gets a
+    new id, so the old point is dropped and the new one embedded on sync.
+    """
+    key = "\x00".join(str(msg.get(field, "")) for field in ("id", "user_id", "timestamp", "message"))
+    return str(uuid.UUID(bytes=hashlib.sha256(key.encode("utf-8")).digest()[:16]))
+
+
+def message_payload(msg: Dict) -> Dict:
+    return {
+        "user_name": msg['user_name'],
+        "user_id": msg['user_id'],
+        "timestamp": msg['timestamp'],
+        "message": msg['message']
     }
-    payload = {
-        "input": text,
-        "model": "nvidia/nv-embedqa-e5-v5",
+
+
+def _embedding_payload(texts, input_type: str) -> Dict:
+    return {
+        "input": texts,
+        "model": EMBEDDING_MODEL,
         "encoding_format": "float",
         "input_type": input_type,
         "truncate": "END"
     }
+
+
+async def get_embeddings_async(texts: List[str], input_type: str = "passage", max_retries: int = 5) -> List[List[float]]:
+    """Embed many texts in one request, paced by the shared adaptive limiter"""
+    headers = {
+        "Authorization": f"Bearer {os.getenv('NVIDIA_API_KEY')}",
+        "Content-Type": "application/json"
+    }
+    payload = _embedding_payload(texts, input_type)
+    limiter = get_embedding_limiter()
     
     for attempt in range(max_retries):
+        await limiter.acquire()
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                
-                if response.status_code == 429:  # Rate limit
-                    wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s, 8s, 16s
-                    print(f"⚠️ Rate limit hit, waiting {wait_time}s...")
-                    await asyncio.sleep(wait_time)
-                    continue
-                
-                response.raise_for_status()
-                data = response.json()
-                return data["data"][0]["embedding"]
+            response = await get_async_client().post(EMBEDDING_URL, json=payload, headers=headers)
+            
+            if response.status_code == 429:  # Rate limit
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                limiter.on_rate_limited(retry_after)
+                RATE_LIMITED.inc(1, "embeddings")
+                EMBEDDING_RETRIES.inc(1, "rate_limited")
+                print(f"⚠️ Rate limit hit (attempt {attempt + 1}/{max_retries}), slowing to {limiter.rate:.2f} req/s")
+                continue
+            
+            response.raise_for_status()
+            limiter.on_success()
+            data = sorted(response.json()["data"], key=lambda d: d["index"])
+            return [d["embedding"] for d in data]
                 
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 429 and attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                print(f"⚠️ Rate limit (attempt {attempt + 1}/{max_retries}), waiting {wait_time}s...")
-                await asyncio.sleep(wait_time)
-            else:
-                raise
+        except httpx.HTTPStatusError:
+            raise
         except Exception as e:
             if attempt < max_retries - 1:
+                EMBEDDING_RETRIES.inc(1, "error")
+                print(f"⚠️ Embedding error: {e}, attempt {attempt + 1}/{max_retries}")
                 await asyncio.sleep(1)
             else:
                 raise
@@ -72,104 +147,788 @@ async def get_embedding_async(text: str, input_type: str = "passage", max_retrie
     raise Exception("Max retries exceeded")
 
 
+async def get_embeddings_cached_async(texts: List[str], input_type: str = "passage") -> List[List[float]]:
+    """Like get_embeddings_async, but only texts missing from the on-disk cache hit the API"""
+    cache = get_embedding_cache()
+    cached = cache.get_many(texts, EMBEDDING_MODEL, input_type)
+    missing = [idx for idx in range(len(texts)) if idx not in cached]
+    CACHE_LOOKUPS.inc(len(cached), "embedding", "hit")
+    CACHE_LOOKUPS.inc(len(missing), "embedding", "miss")
+    
+    if missing:
+        missing_texts = [texts[idx] for idx in missing]
+        with span("embed_passages"):
+            fresh = await get_embeddings_async(missing_texts, input_type=input_type)
+        cache.put_many(missing_texts, fresh, EMBEDDING_MODEL, input_type)
+        cached.update(zip(missing, fresh))
+    
+    return [cached[idx] for idx in range(len(texts))]
+
+
+async def get_embedding_async(text: str, input_type: str = "passage", max_retries: int = 5) -> List[float]:
+    """Get embedding with retry logic for rate limits"""
+    embeddings = await get_embeddings_async([text], input_type=input_type, max_retries=max_retries)
+    return embeddings[0]
+
+
 def get_embedding_sync(text: str, input_type: str = "passage") -> List[float]:
     """Synchronous version for /ask queries"""
-    url = "https://integrate.api.nvidia.com/v1/embeddings"
     headers = {
         "Authorization": f"Bearer {os.getenv('NVIDIA_API_KEY')}",
         "Content-Type": "application/json"
     }
-    payload = {
-        "input": text,
-        "model": "nvidia/nv-embedqa-e5-v5",
-        "encoding_format": "float",
-        "input_type": input_type,
-        "truncate": "END"
+    payload = _embedding_payload(text, input_type)
+    
+    response = get_sync_client().post(EMBEDDING_URL, json=payload, headers=headers)
+    response.raise_for_status()
+    data = response.json()
+    return data["data"][0]["embedding"]
+
+
+async def get_query_embeddings_async(texts: List[str]) -> List[List[float]]:
+    """
+    Embed many questions (/ask/batch) in EMBED_BATCH_SIZE requests. Unlike a
+    single /ask question these go through the adaptive limiter and its
+    429 / retry handling, so one rate-limited request doesn't fail the batch.
+    """
+    chunks = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    results = await asyncio.gather(*(get_embeddings_async(chunk, input_type="query") for chunk in chunks))
+    return [embedding for chunk in results for embedding in chunk]
+
+
+async def get_query_embedding_async(text: str) -> List[float]:
+    """
+    Single query embedding for /ask. Deliberately bypasses the ingest rate
+    limiter so a running /refresh can't queue user-facing requests.
+    """
+    headers = {
+        "Authorization": f"Bearer {os.getenv('NVIDIA_API_KEY')}",
+        "Content-Type": "application/json"
     }
+    payload = _embedding_payload(text, "query")
     
-    with httpx.Client(timeout=30.0) as client:
-        response = client.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return data["data"][0]["embedding"]
+    response = await get_async_client().post(EMBEDDING_URL, json=payload, headers=headers)
+    response.raise_for_status()
+    return response.json()["data"][0]["embedding"]
 
 
-def get_collection_stats() -> Dict:
-    try:
-        client = get_client()
-        count = client.count(COLLECTION_NAME).count
-        collection_info = get_client().get_collection(COLLECTION_NAME)
-        vector_size = collection_info.config.params.vectors.size
-        
+class RetrievalBackend:
+    """
+    Storage + nearest-neighbour search for message embeddings.
+    Points go in as qdrant PointStructs (id, vector, payload); search returns
+    dicts with the point id, similarity score and payload.
+    """
+    name = "base"
+    
+    def ensure_collection(self, force_recreate: bool = False):
+        raise NotImplementedError
+    
+    def dimension(self) -> Optional[int]:
+        """Vector size of the collection, or None if it doesn't exist"""
+        raise NotImplementedError
+    
+    def count(self) -> int:
+        raise NotImplementedError
+    
+    def all_ids(self) -> Set[str]:
+        raise NotImplementedError
+    
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        raise NotImplementedError
+    
+    def upsert(self, points: List[PointStruct]):
+        raise NotImplementedError
+    
+    def delete(self, ids: List[str]):
+        raise NotImplementedError
+    
+    def mark_seen(self, ids: List[str], run_id: str):
+        """Tag points as present in ingest run `run_id`"""
+        raise NotImplementedError
+    
+    def delete_unseen(self, run_id: str) -> int:
+        """Delete every point not tagged with `run_id`; returns how many went"""
+        raise NotImplementedError
+    
+    def search(
+        self, vector: List[float], top_k: int, with_vectors: bool = False, query_filter: Optional[SearchFilter] = None
+    ) -> List[Dict]:
+        """
+        Hits carry the stored embedding as "vector" only when with_vectors is set.
+        `query_filter` restricts the candidates before nearest-neighbour search.
+        """
+        raise NotImplementedError
+    
+    async def search_async(
+        self, vector: List[float], top_k: int, with_vectors: bool = False, query_filter: Optional[SearchFilter] = None
+    ) -> List[Dict]:
+        """Non-blocking search; backends with a native async client override this"""
+        return await asyncio.to_thread(self.search, vector, top_k, with_vectors, query_filter)
+    
+    def search_batch(
+        self,
+        vectors: List[List[float]],
+        top_k: int,
+        with_vectors: bool = False,
+        query_filters: Optional[List[Optional[SearchFilter]]] = None
+    ) -> List[List[Dict]]:
+        """`query_filters`, if given, holds one filter (or None) per vector"""
+        filters = query_filters or [None] * len(vectors)
+        return [self.search(vector, top_k, with_vectors, f) for vector, f in zip(vectors, filters)]
+    
+    async def search_batch_async(
+        self,
+        vectors: List[List[float]],
+        top_k: int,
+        with_vectors: bool = False,
+        query_filters: Optional[List[Optional[SearchFilter]]] = None
+    ) -> List[List[Dict]]:
+        return await asyncio.to_thread(self.search_batch, vectors, top_k, with_vectors, query_filters)
+    
+    def flush(self):
+        """Persist pending writes (no-op for remote stores)"""
+    
+    def create_staging(self) -> "RetrievalBackend":
+        """An empty store, invisible to searches, for a full rebuild to write into"""
+        raise NotImplementedError
+    
+    def promote(self, staging: "RetrievalBackend") -> "RetrievalBackend":
+        """Atomically make `staging` the live store; returns the backend to serve from"""
+        raise NotImplementedError
+    
+    def drop(self):
+        """Delete the store outright (discards a failed staging build)"""
+        raise NotImplementedError
+    
+    def reload_if_changed(self) -> bool:
+        """Pick up a version another process published; True if it did (no-op for remote stores)"""
+        return False
+
+
+MESSAGE_FIELDS = ["user_name", "user_id", "timestamp", "message"]  # all that to_messages reads
+
+
+class SearchProfile:
+    """
+    How the Qdrant collection is built and searched.
+    Collection side: HNSW m / ef_construct, quantization ("none", "scalar"
+    int8 or "binary", kept in RAM) and original vectors on disk - these only
+    apply when a collection is created, i.e. on a full /refresh.
+    Search side: hnsw_ef, exact (brute force), rescoring with the original
+    vectors after `oversampling` x top_k quantized candidates, and which
+    payload fields come back - these apply to the next search.
+    None leaves Qdrant's default in place.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        m: Optional[int] = None,
+        ef_construct: Optional[int] = None,
+        hnsw_ef: Optional[int] = None,
+        exact: bool = False,
+        quantization: str = "none",
+        on_disk: bool = False,
+        rescore: bool = True,
+        oversampling: Optional[float] = None,
+        payload_fields: Optional[List[str]] = MESSAGE_FIELDS
+    ):
+        if quantization not in ("none", "scalar", "binary"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.name = name
+        self.m = m
+        self.ef_construct = ef_construct
+        self.hnsw_ef = hnsw_ef
+        self.exact = exact
+        self.quantization = quantization
+        self.on_disk = on_disk
+        self.rescore = rescore
+        self.oversampling = oversampling
+        self.payload_fields = payload_fields
+    
+    def vector_params(self) -> VectorParams:
+        return VectorParams(size=EXPECTED_DIM, distance=Distance.COSINE, on_disk=self.on_disk or None)
+    
+    def hnsw_config(self) -> Optional[HnswConfigDiff]:
+        if self.m is None and self.ef_construct is None:
+            return None
+        return HnswConfigDiff(m=self.m, ef_construct=self.ef_construct)
+    
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+    
+    def search_params(self) -> Optional[SearchParams]:
+        quantization = None
+        if self.quantization != "none":
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        if self.hnsw_ef is None and not self.exact and quantization is None:
+            return None
+        return SearchParams(hnsw_ef=self.hnsw_ef, exact=self.exact, quantization=quantization)
+    
+    def with_payload(self):
+        return self.payload_fields if self.payload_fields is not None else True
+    
+    def describe(self) -> Dict:
         return {
-            "total_documents": count, 
-            "initialized": True, 
-            "type": "qdrant_cloud",
-            "dimension": vector_size,
-            "dimension_match": vector_size == EXPECTED_DIM
+            "m": self.m,
+            "ef_construct": self.ef_construct,
+            "hnsw_ef": self.hnsw_ef,
+            "exact": self.exact,
+            "quantization": self.quantization,
+            "on_disk": self.on_disk,
+            "rescore": self.rescore,
+            "oversampling": self.oversampling,
+            "payload_fields": self.payload_fields
+        }
+
+
+# Presets for SEARCH_PROFILE; `python -m benchmarks.retrieval` measures each against exact search
+SEARCH_PROFILES = {
+    "default": SearchProfile("default"),
+    "exact": SearchProfile("exact", exact=True),
+    "hnsw_m8": SearchProfile("hnsw_m8", m=8, ef_construct=64, hnsw_ef=32),
+    "hnsw_m32": SearchProfile("hnsw_m32", m=32, ef_construct=256, hnsw_ef=128),
+    "scalar": SearchProfile("scalar", quantization="scalar", oversampling=2.0),
+    "scalar_on_disk": SearchProfile("scalar_on_disk", quantization="scalar", on_disk=True, oversampling=2.0),
+    "binary": SearchProfile("binary", quantization="binary", oversampling=3.0),
+    "full_payload": SearchProfile("full_payload", payload_fields=None)
+}
+
+
+def get_search_profile() -> SearchProfile:
+    """Profile selected by SEARCH_PROFILE"""
+    if SEARCH_PROFILE not in SEARCH_PROFILES:
+        raise ValueError(f"Unknown SEARCH_PROFILE: {SEARCH_PROFILE} (one of {', '.join(SEARCH_PROFILES)})")
+    return SEARCH_PROFILES[SEARCH_PROFILE]
+
+
+class QdrantBackend(RetrievalBackend):
+    name = "qdrant_cloud"
+    
+    def __init__(
+        self,
+        client: Optional[QdrantClient] = None,
+        collection_name: str = COLLECTION_NAME,
+        profile: Optional[SearchProfile] = None,
+        versioned: bool = False
+    ):
+        """
+        With `versioned`, `collection_name` is an alias: collections are created
+        as <name>_v<ms> behind it, so a rebuild or recreate can be swapped in
+        without ever leaving the name unbound.
+        """
+        self._client = client
+        self.collection_name = collection_name
+        self._profile = profile
+        self.versioned = versioned
+    
+    @property
+    def profile(self) -> SearchProfile:
+        return self._profile or get_search_profile()
+    
+    @property
+    def client(self) -> QdrantClient:
+        return self._client or get_client()
+    
+    def _alias_target(self) -> Optional[str]:
+        """Physical collection behind `collection_name` if it is an alias, else None"""
+        for alias in self.client.get_aliases().aliases:
+            if alias.alias_name == self.collection_name:
+                return alias.collection_name
+        return None
+    
+    def ensure_collection(self, force_recreate: bool = False):
+        """
+        Create the collection if missing; replace it on force or dimension mismatch.
+        A versioned backend creates the replacement first and swaps the alias
+        over, then drops the old one; anything else is deleted and recreated.
+        """
+        client = self.client
+        # Deleting through an alias isn't allowed, so work on the collection behind it
+        target = self._alias_target()
+        name = target or self.collection_name
+        collections = client.get_collections().collections
+        exists = any(c.name == name for c in collections)
+        
+        if exists:
+            if force_recreate:
+                print("🔄 Replacing existing collection...")
+            else:
+                vector_size = client.get_collection(name).config.params.vectors.size
+                if vector_size == EXPECTED_DIM:
+                    self._ensure_payload_indexes(name)
+                    return
+                print(f"⚠️ Wrong dimensions ({vector_size}), recreating...")
+            if not (self.versioned and target is not None):
+                # A plain collection (or a pre-alias deployment's) holds the name itself
+                client.delete_collection(name)
+        
+        if not self.versioned:
+            self._create(name)
+            return
+        
+        fresh = self._versioned_name()
+        self._create(fresh)
+        self._point_alias(fresh, self._alias_target())
+        if exists and target is not None:
+            client.delete_collection(target)
+    
+    def _versioned_name(self) -> str:
+        return f"{self.collection_name}_v{int(time.time() * 1000)}"
+    
+    def _create(self, name: str):
+        profile = self.profile
+        print(f"📝 Creating collection {name} ({EXPECTED_DIM}-dim, {profile.name} profile)")
+        self.client.create_collection(
+            collection_name=name,
+            vectors_config=profile.vector_params(),
+            hnsw_config=profile.hnsw_config(),
+            quantization_config=profile.quantization_config()
+        )
+        self._ensure_payload_indexes(name)
+    
+    def _point_alias(self, target: str, previous: Optional[str]):
+        """Bind the `collection_name` alias to `target`, re-pointing it in one call if it is bound to `previous`"""
+        operations = []
+        if previous is not None:
+            operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=self.collection_name)))
+        operations.append(CreateAliasOperation(create_alias=CreateAlias(
+            collection_name=target, alias_name=self.collection_name
+        )))
+        self.client.update_collection_aliases(change_aliases_operations=operations)
+        print(f"🔀 Alias {self.collection_name} -> {target}")
+    
+    def _ensure_payload_indexes(self, name: str):
+        """Keyword indexes on user_id / user_name and a datetime index on timestamp, for filtered search"""
+        existing = self.client.get_collection(name).payload_schema or {}
+        for field, schema in PAYLOAD_INDEXES.items():
+            if field not in existing:
+                print(f"🗂️ Creating {schema.value} payload index on {field}")
+                self.client.create_payload_index(name, field_name=field, field_schema=schema)
+    
+    def dimension(self) -> Optional[int]:
+        try:
+            return self.client.get_collection(self.collection_name).config.params.vectors.size
+        except Exception:
+            return None
+    
+    def count(self) -> int:
+        return self.client.count(self.collection_name).count
+    
+    def all_ids(self) -> Set[str]:
+        """All point ids currently in the collection (ids only, no payloads or vectors)"""
+        ids = set()
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False
+            )
+            ids.update(str(r.id) for r in records)
+            if offset is None:
+                return ids
+    
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        found = self.client.retrieve(self.collection_name, ids=ids, with_payload=False, with_vectors=False)
+        return {str(r.id) for r in found}
+    
+    def upsert(self, points: List[PointStruct]):
+        self.client.upsert(collection_name=self.collection_name, points=points)
+    
+    def delete(self, ids: List[str]):
+        for i in range(0, len(ids), 1000):
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=PointIdsList(points=ids[i:i + 1000])
+            )
+    
+    def mark_seen(self, ids: List[str], run_id: str):
+        self.client.set_payload(self.collection_name, payload={"sync_run": run_id}, points=ids)
+    
+    def delete_unseen(self, run_id: str) -> int:
+        stale_filter = Filter(must_not=[FieldCondition(key="sync_run", match=MatchValue(value=run_id))])
+        stale = self.client.count(self.collection_name, count_filter=stale_filter).count
+        if stale:
+            self.client.delete(self.collection_name, points_selector=FilterSelector(filter=stale_filter))
+        return stale
+    
+    @staticmethod
+    def _hits(results) -> List[Dict]:
+        hits = []
+        for r in results:
+            hit = {"id": str(r.id), "score": r.score, "payload": r.payload}
+            if r.vector is not None:
+                hit["vector"] = r.vector
+            hits.append(hit)
+        return hits
+    
+    def search(
+        self, vector: List[float], top_k: int, with_vectors: bool = False, query_filter: Optional[SearchFilter] = None
+    ) -> List[Dict]:
+        results = self.client.search(
+            collection_name=self.collection_name,
+            query_vector=vector,
+            query_filter=query_filter.to_qdrant() if query_filter else None,
+            search_params=self.profile.search_params(),
+            limit=top_k,
+            with_payload=self.profile.with_payload(),
+            with_vectors=with_vectors
+        )
+        return self._hits(results)
+    
+    async def search_async(
+        self, vector: List[float], top_k: int, with_vectors: bool = False, query_filter: Optional[SearchFilter] = None
+    ) -> List[Dict]:
+        if QDRANT_LOCATION:
+            # Embedded mode holds the data in this process's sync client only
+            return await super().search_async(vector, top_k, with_vectors, query_filter)
+        results = await get_async_qdrant_client().search(
+            collection_name=self.collection_name,
+            query_vector=vector,
+            query_filter=query_filter.to_qdrant() if query_filter else None,
+            search_params=self.profile.search_params(),
+            limit=top_k,
+            with_payload=self.profile.with_payload(),
+            with_vectors=with_vectors
+        )
+        return self._hits(results)
+    
+    def _search_requests(self, vectors, top_k: int, with_vectors: bool, query_filters) -> List[SearchRequest]:
+        profile = self.profile
+        return [
+            SearchRequest(
+                vector=vector,
+                filter=query_filter.to_qdrant() if query_filter else None,
+                params=profile.search_params(),
+                limit=top_k,
+                with_payload=profile.with_payload(),
+                with_vector=with_vectors
+            )
+            for vector, query_filter in zip(vectors, query_filters or [None] * len(vectors))
+        ]
+    
+    def search_batch(
+        self,
+        vectors: List[List[float]],
+        top_k: int,
+        with_vectors: bool = False,
+        query_filters: Optional[List[Optional[SearchFilter]]] = None
+    ) -> List[List[Dict]]:
+        batches = self.client.search_batch(
+            collection_name=self.collection_name,
+            requests=self._search_requests(vectors, top_k, with_vectors, query_filters)
+        )
+        return [self._hits(results) for results in batches]
+    
+    async def search_batch_async(
+        self,
+        vectors: List[List[float]],
+        top_k: int,
+        with_vectors: bool = False,
+        query_filters: Optional[List[Optional[SearchFilter]]] = None
+    ) -> List[List[Dict]]:
+        if QDRANT_LOCATION:
+            return await super().search_batch_async(vectors, top_k, with_vectors, query_filters)
+        batches = await get_async_qdrant_client().search_batch(
+            collection_name=self.collection_name,
+            requests=self._search_requests(vectors, top_k, with_vectors, query_filters)
+        )
+        return [self._hits(results) for results in batches]
+    
+    def create_staging(self) -> "QdrantBackend":
+        """A new versioned collection (member_messages_v<ms>) next to the live one"""
+        staging = QdrantBackend(self._client, self._versioned_name(), self._profile)
+        staging.ensure_collection()
+        return staging
+    
+    def promote(self, staging: "QdrantBackend") -> "QdrantBackend":
+        """
+        Point the `collection_name` alias at the staging collection in one
+        update_collection_aliases call, then drop the collection it replaced.
+        Searches keep going through the alias, so they never see a gap.
+        Versioned backends create their collection behind the alias from the
+        start, so only a deployment that predates aliases still has a real
+        collection under the name; Qdrant can't alias over it, so that one
+        swap has to delete it first (the rebuilt data is already complete in
+        staging, which is kept if the alias call then fails).
+        """
+        client = self.client
+        previous = self._alias_target()
+        if previous is None and client.collection_exists(self.collection_name):
+            print(f"⚠️ Moving pre-alias collection {self.collection_name} behind an alias")
+            client.delete_collection(self.collection_name)
+            try:
+                self._point_alias(staging.collection_name, None)
+            except Exception as e:
+                raise RuntimeError(
+                    f"Deleted {self.collection_name} but could not alias it to {staging.collection_name} "
+                    f"(kept, holds the rebuilt data): {e}"
+                ) from e
+            return self
+        self._point_alias(staging.collection_name, previous)
+        if previous is not None and previous != staging.collection_name:
+            client.delete_collection(previous)
+        return self
+    
+    def drop(self):
+        self.client.delete_collection(self._alias_target() or self.collection_name)
+
+
+_backend = None
+
+
+def get_backend() -> RetrievalBackend:
+    """Backend selected by VECTOR_BACKEND: "qdrant" (default) or "local" (in-process NumPy)"""
+    global _backend
+    if _backend is None:
+        if VECTOR_BACKEND == "local":
+            from local_index import LocalBackend
+            _backend = LocalBackend()
+        elif VECTOR_BACKEND == "qdrant":
+            _backend = QdrantBackend(versioned=True)
+        else:
+            raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+    return _backend
+
+
+def promote_backend(staging: RetrievalBackend):
+    """Swap a fully built staging store in for the live one"""
+    global _backend
+    _backend = get_backend().promote(staging)
+    get_collection_state().invalidate()
+
+
+def _read_dataset_version() -> str:
+    try:
+        with open(DATASET_VERSION_PATH) as f:
+            return f.read().strip() or "unversioned"
+    except FileNotFoundError:
+        return "unversioned"
+
+
+def reload_shared_state() -> bool:
+    """
+    Remap a local index version and pick up a dataset version published by
+    another process (worker). True if anything changed.
+    """
+    changed = get_backend().reload_if_changed()
+    if changed or get_collection_state().snapshot()["version"] != _read_dataset_version():
+        get_collection_state().invalidate()
+        changed = True
+    return changed
+
+
+def bump_dataset_version(version: str):
+    """Record that ingest changed the indexed data (lets caches keyed on it expire)"""
+    if os.path.dirname(DATASET_VERSION_PATH):
+        os.makedirs(os.path.dirname(DATASET_VERSION_PATH), exist_ok=True)
+    tmp_path = f"{DATASET_VERSION_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, DATASET_VERSION_PATH)
+    get_collection_state().invalidate()
+
+
+class CollectionState:
+    """
+    Cached existence / dimension / point count / dataset version of the active collection.
+    Validated once at startup and refreshed only when ingest calls
+    invalidate() or, if COLLECTION_STATE_TTL > 0, when the entry is older
+    than the TTL (picks up changes made by other processes).
+    """
+    
+    def __init__(self, ttl: float = COLLECTION_STATE_TTL):
+        self.ttl = ttl
+        self._state = None
+        self._lock = threading.Lock()
+    
+    def _expired(self) -> bool:
+        return self.ttl > 0 and time.monotonic() - self._state["checked_at"] > self.ttl
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            if self._state is None or self._expired():
+                self._state = self._load()
+            return self._state
+    
+    def _load(self) -> Dict:
+        backend = get_backend()
+        state = {
+            "type": backend.name,
+            "exists": False,
+            "dimension": None,
+            "count": 0,
+            "version": _read_dataset_version(),
+            "checked_at": time.monotonic()
         }
-    except:
+        try:
+            state["dimension"] = backend.dimension()
+            if state["dimension"] is not None:
+                state["exists"] = True
+                state["count"] = backend.count()
+        except Exception as e:
+            state["error"] = str(e)
+        return state
+    
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+    
+    async def snapshot_async(self) -> Dict:
+        """snapshot() for the event loop: a fresh entry is returned in place, only a reload goes to a thread"""
+        state = self._state
+        if state is not None and not (self.ttl > 0 and time.monotonic() - state["checked_at"] > self.ttl):
+            return state
+        return await asyncio.to_thread(self.snapshot)
+
+    async def problem_async(self) -> Optional[str]:
+        # Only the (rare) reload touches the backend, so keep the hot path on the loop
+        if self._state is not None and not self._expired():
+            return self.problem()
+        return await asyncio.to_thread(self.problem)
+    
+    def problem(self) -> Optional[str]:
+        """Why the collection can't serve searches, or None if it can"""
+        state = self.snapshot()
+        if not state["exists"]:
+            return f"Collection not found{': ' + state['error'] if 'error' in state else ''}"
+        if state["count"] == 0:
+            return "Vector store is empty"
+        if state["dimension"] != EXPECTED_DIM:
+            return f"Dimension mismatch: {state['dimension']} vs {EXPECTED_DIM}"
+        return None
+
+
+_collection_state = None
+
+
+def get_collection_state() -> CollectionState:
+    global _collection_state
+    if _collection_state is None:
+        _collection_state = CollectionState()
+    return _collection_state
+
+
+def get_dataset_version() -> str:
+    return get_collection_state().snapshot()["version"]
+
+
+async def get_dataset_version_async() -> str:
+    return (await get_collection_state().snapshot_async())["version"]
+
+
+def validate_collection():
+    """Startup check: load the collection state once and report it"""
+    problem = get_collection_state().problem()
+    if problem:
+        print(f"⚠️ Vector store not ready: {problem}")
+    else:
+        state = get_collection_state().snapshot()
+        print(f"✓ Vector store ready: {state['count']} points, {state['dimension']}-dim ({state['type']})")
+
+
+def get_collection_stats() -> Dict:
+    return _collection_stats(get_collection_state().snapshot())
+
+
+async def get_collection_stats_async() -> Dict:
+    return _collection_stats(await get_collection_state().snapshot_async())
+
+
+def _collection_stats(state: Dict) -> Dict:
+    if not state["exists"]:
         return {
             "total_documents": 0, 
             "initialized": False, 
-            "type": "qdrant_cloud"
+            "type": state["type"]
         }
+    return {
+        "total_documents": state["count"], 
+        "initialized": True, 
+        "type": state["type"],
+        "dimension": state["dimension"],
+        "dimension_match": state["dimension"] == EXPECTED_DIM
+    }
+
+
+def to_messages(results: List[Dict]) -> List[Dict]:
+    """Backend / keyword-index hits -> the flat message dicts search_relevant_messages returns"""
+    messages = []
+    for r in results:
+        msg = {
+            'id': r['id'],
+            'user_name': r['payload']['user_name'],
+            'user_id': r['payload']['user_id'],
+            'timestamp': r['payload']['timestamp'],
+            'message': r['payload']['message']
+        }
+        if r.get('vector') is not None:
+            msg['vector'] = r['vector']  # keyword-only hits have none
+        messages.append(msg)
+    return messages
+
+
+def _filter_attempts(query_filter: Optional[SearchFilter]) -> List[Optional[SearchFilter]]:
+    """Filtered first; unfiltered if that comes back empty (a name or date the data doesn't have)"""
+    if query_filter:
+        print(f"🎯 Searching within {query_filter}")
+        return [query_filter, None]
+    return [None]
+
+
+def _log_hits(relevant_messages: List[Dict]):
+    if relevant_messages:
+        print(f"🔍 Found {len(relevant_messages)} relevant messages")
+    else:
+        print(f"🔍 No relevant messages found for query")
 
-def search_relevant_messages(question: str, top_k: int = 15) -> List[Dict]:
+
+def search_relevant_messages(question: str, top_k: int = 15, query_filter: Optional[SearchFilter] = None) -> List[Dict]:
     """
-    Search for relevant messages
+    Search for relevant messages (within `query_filter`, falling back to the
+    whole collection if nothing passes it)
     Returns:
         - List of messages if successful (can be empty if no matches)
         - None if vector store doesn't exist
     """
-    client = get_client()
+    backend = get_backend()
     
-    try:
-        collection_info = client.get_collection(COLLECTION_NAME)
-        count = client.count(COLLECTION_NAME).count
-        
-        if count == 0:
-            print("⚠️ Vector store is empty")
-            return None  # Collection exists but is empty
-        
-        vector_size = collection_info.config.params.vectors.size
-        if vector_size != EXPECTED_DIM:
-            print(f"❌ Dimension mismatch: {vector_size} vs {EXPECTED_DIM}")
-            return None  # Wrong dimensions
-            
-    except Exception as e:
-        print(f"❌ Collection not found: {e}")
-        return None  # If Collection doesn't exist
+    with span("collection_check"):
+        problem = get_collection_state().problem()
+    if problem:
+        print(f"❌ {problem}")
+        return None  # Missing, empty or wrong dimensions
     
     # Generate query embedding
     try:
-        question_embedding = get_embedding_sync(question, input_type="query")
+        with span("embed_query"):
+            question_embedding = get_embedding_sync(question, input_type="query")
     except Exception as e:
         print(f"❌ Error generating query embedding: {e}")
         return []
     
     try:
-        results = client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=question_embedding,
-            limit=top_k
-        )
-        
-        relevant_messages = [
-            {
-                'user_name': r.payload['user_name'],
-                'user_id': r.payload['user_id'],
-                'timestamp': r.payload['timestamp'],
-                'message': r.payload['message']
-            }
-            for r in results
-        ]
-        
-        if relevant_messages:
-            print(f"🔍 Found {len(relevant_messages)} relevant messages")
-        else:
-            print(f"🔍 No relevant messages found for query")
+        with span("search"):
+            for attempt_filter in _filter_attempts(query_filter):
+                results = backend.search(question_embedding, top_k, query_filter=attempt_filter)
+                
+                if HYBRID_SEARCH:
+                    # BM25 catches exact names/places the dense model ranks too low
+                    keyword_results = get_keyword_index().search(question, top_k, attempt_filter)
+                    if keyword_results:
+                        results = reciprocal_rank_fusion([results, keyword_results], top_k, k=RRF_K)
+                if results:
+                    break
         
+        relevant_messages = to_messages(results)
+        _log_hits(relevant_messages)
         return relevant_messages
         
     except Exception as e:
@@ -177,30 +936,131 @@ def search_relevant_messages(question: str, top_k: int = 15) -> List[Dict]:
         return []
 
 
-async def embed_batch_async(messages: List[Dict], start_idx: int) -> List[PointStruct]:
-    """Embed a batch with delay between requests"""
-    points = []
+async def search_relevant_messages_async(
+    question: str,
+    top_k: int = 15,
+    query_embedding: Optional[List[float]] = None,
+    with_vectors: bool = False,
+    query_filter: Optional[SearchFilter] = None
+) -> List[Dict]:
+    """
+    Event-loop version of search_relevant_messages (same return contract).
+    Embedding and search each run under their own timeout; TimeoutError is
+    propagated so the caller can tell a slow stage from an empty result.
+    Pass `query_embedding` if the caller already embedded the question, and
+    `with_vectors` to get each dense hit's stored embedding as msg["vector"].
+    """
+    backend = get_backend()
     
-    for idx, msg in enumerate(messages):
-        text = f"User: {msg['user_name']}\nDate: {msg['timestamp']}\nMessage: {msg['message']}"
-        
-        if idx > 0:
-            await asyncio.sleep(0.1)
-        
-        embedding = await get_embedding_async(text, input_type="passage")
-        
-        points.append(PointStruct(
-            id=start_idx + idx,
-            vector=embedding,
-            payload={
-                "user_name": msg['user_name'],
-                "user_id": msg['user_id'],
-                "timestamp": msg['timestamp'],
-                "message": msg['message']
-            }
-        ))
+    with span("collection_check"):
+        problem = await get_collection_state().problem_async()
+    if problem:
+        print(f"❌ {problem}")
+        return None  # Missing, empty or wrong dimensions
+    
+    try:
+        if query_embedding is not None:
+            question_embedding = query_embedding
+        else:
+            async with span("embed_query"), asyncio.timeout(EMBED_TIMEOUT):
+                question_embedding = await get_query_embedding_async(question)
+    except TimeoutError:
+        print(f"⏱️ Query embedding timed out after {EMBED_TIMEOUT}s")
+        raise
+    except Exception as e:
+        print(f"❌ Error generating query embedding: {e}")
+        return []
+    
+    try:
+        async with span("search"), asyncio.timeout(SEARCH_TIMEOUT):
+            for attempt_filter in _filter_attempts(query_filter):
+                if HYBRID_SEARCH:
+                    results, keyword_results = await asyncio.gather(
+                        backend.search_async(question_embedding, top_k, with_vectors, attempt_filter),
+                        asyncio.to_thread(get_keyword_index().search, question, top_k, attempt_filter)
+                    )
+                    if keyword_results:
+                        results = reciprocal_rank_fusion([results, keyword_results], top_k, k=RRF_K)
+                else:
+                    results = await backend.search_async(question_embedding, top_k, with_vectors, attempt_filter)
+                if results:
+                    break
+    except TimeoutError:
+        print(f"⏱️ Search timed out after {SEARCH_TIMEOUT}s")
+        raise
+    except Exception as e:
+        print(f"❌ Search error: {e}")
+        return []
+    
+    relevant_messages = to_messages(results)
+    _log_hits(relevant_messages)
+    return relevant_messages
+
+
+async def search_relevant_messages_batch_async(
+    questions: List[str],
+    query_embeddings: List[List[float]],
+    top_k: int = 15,
+    with_vectors: bool = False,
+    query_filters: Optional[List[Optional[SearchFilter]]] = None
+) -> Optional[List[List[Dict]]]:
+    """
+    Retrieve for many already-embedded questions with a single backend
+    search_batch call (BM25 runs per question alongside it).
+    `query_filters` holds one filter (or None) per question; questions whose
+    filter matches nothing are searched again unfiltered in one more batch.
+    Returns None if the vector store isn't ready.
+    """
+    backend = get_backend()
+    
+    with span("collection_check"):
+        problem = await get_collection_state().problem_async()
+    if problem:
+        print(f"❌ {problem}")
+        return None
+    
+    async def search_batch(batch_questions, batch_embeddings, batch_filters):
+        if HYBRID_SEARCH:
+            dense_batches, keyword_batches = await asyncio.gather(
+                backend.search_batch_async(batch_embeddings, top_k, with_vectors, batch_filters),
+                asyncio.to_thread(lambda: [
+                    get_keyword_index().search(q, top_k, f) for q, f in zip(batch_questions, batch_filters)
+                ])
+            )
+            return [
+                reciprocal_rank_fusion([dense, keyword], top_k, k=RRF_K) if keyword else dense
+                for dense, keyword in zip(dense_batches, keyword_batches)
+            ]
+        return await backend.search_batch_async(batch_embeddings, top_k, with_vectors, batch_filters)
+    
+    filters = query_filters or [None] * len(questions)
+    async with span("search_batch"), asyncio.timeout(SEARCH_TIMEOUT):
+        dense_batches = await search_batch(questions, query_embeddings, filters)
+        retry = [idx for idx, results in enumerate(dense_batches) if not results and filters[idx]]
+        if retry:
+            retried = await search_batch(
+                [questions[idx] for idx in retry], [query_embeddings[idx] for idx in retry], [None] * len(retry)
+            )
+            for idx, results in zip(retry, retried):
+                dense_batches[idx] = results
+    
+    print(f"🔍 Batch search for {len(questions)} questions")
+    return [to_messages(results) for results in dense_batches]
+
+
+async def embed_batch_async(messages: List[Dict], extra_payload: Optional[Dict] = None) -> List[PointStruct]:
+    """Embed a batch of messages with a single multi-input request (cache misses only)"""
+    texts = [message_to_text(msg) for msg in messages]
+    embeddings = await get_embeddings_cached_async(texts, input_type="passage")
     
-    return points
+    return [
+        PointStruct(
+            id=message_point_id(msg),
+            vector=embedding,
+            payload={**message_payload(msg), **(extra_payload or {})}
+        )
+        for msg, embedding in zip(messages, embeddings)
+    ]
 
 
 async def initialize_vector_store_async(
@@ -208,82 +1068,71 @@ async def initialize_vector_store_async(
     force_recreate: bool = False,
     progress_callback: Optional[Callable] = None,
     concurrent_batches: int = 3
-):
-    """Initialize vector store with rate limit handling"""
-    client = get_client()
-    
-    # Check/create collection
-    collections = client.get_collections().collections
-    exists = any(c.name == COLLECTION_NAME for c in collections)
-    
-    if exists:
-        if force_recreate:
-            print("🔄 Deleting existing collection...")
-            client.delete_collection(COLLECTION_NAME)
-        else:
-            try:
-                collection_info = client.get_collection(COLLECTION_NAME)
-                vector_size = collection_info.config.params.vectors.size
-                count = client.count(COLLECTION_NAME).count
-                
-                if vector_size != EXPECTED_DIM:
-                    print(f"⚠️ Wrong dimensions, recreating...")
-                    client.delete_collection(COLLECTION_NAME)
-                elif count == len(messages):
-                    print(f"✓ Already has {count} embeddings")
-                    return
-                else:
-                    print(f"⚠️ Count mismatch, recreating...")
-                    client.delete_collection(COLLECTION_NAME)
-            except:
-                pass
-    
-    print(f"📝 Creating collection ({EXPECTED_DIM}-dim)")
-    client.create_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=EXPECTED_DIM, distance=Distance.COSINE)
-    )
-    
-    batch_size = 20
-    all_points = []
-    
-    print(f"🔧 Embedding {len(messages)} messages ({concurrent_batches} concurrent batches)...")
-    print(f"⏱️ Estimated time: ~{len(messages) * 0.15 / 60:.1f} minutes")
-    
-    for i in range(0, len(messages), batch_size * concurrent_batches):
-        batch_groups = []
-        for j in range(concurrent_batches):
-            start = i + (j * batch_size)
-            end = min(start + batch_size, len(messages))
-            if start < len(messages):
-                batch_groups.append((messages[start:end], start))
-        
-        tasks = [embed_batch_async(batch, start_idx) for batch, start_idx in batch_groups]
+) -> Dict:
+    """
+    Bring the collection in line with `messages`.
+    Only new or changed messages are embedded (and only on a cache miss) and
+    upserted; points whose message disappeared from the feed are deleted.
+    """
+    backend = get_backend()
+    backend.ensure_collection(force_recreate)
+    
+    wanted = {}
+    for msg in messages:
+        wanted[message_point_id(msg)] = msg
+    existing = backend.all_ids()
+    
+    keyword_index = get_keyword_index()
+    keyword_index.replace_all(list(wanted), [message_payload(msg) for msg in wanted.values()])
+    
+    to_add = [msg for point_id, msg in wanted.items() if point_id not in existing]
+    to_delete = [point_id for point_id in existing if point_id not in wanted]
+    print(f"🔎 Sync plan: {len(to_add)} to add, {len(to_delete)} to delete, "
+          f"{len(wanted) - len(to_add)} unchanged")
+    
+    if to_delete:
+        backend.delete(to_delete)
+        print(f"🗑️ Deleted {len(to_delete)} stale points")
+    
+    batch_size = EMBED_BATCH_SIZE
+    added = 0
+    
+    if to_add:
+        print(f"🔧 Embedding {len(to_add)} messages ({concurrent_batches} concurrent batches of {batch_size})...")
+    
+    for i in range(0, len(to_add), batch_size * concurrent_batches):
+        group = to_add[i:i + batch_size * concurrent_batches]
+        tasks = [embed_batch_async(group[j:j + batch_size]) for j in range(0, len(group), batch_size)]
         batch_results = await asyncio.gather(*tasks)
         
         for batch_points in batch_results:
-            all_points.extend(batch_points)
+            backend.upsert(batch_points)
+            added += len(batch_points)
         
-        progress = len(all_points)
-        percentage = progress / len(messages) * 100
-        print(f"  📊 {progress}/{len(messages)} ({percentage:.1f}%)")
+        percentage = added / len(to_add) * 100
+        print(f"  📊 {added}/{len(to_add)} ({percentage:.1f}%)")
         
         if progress_callback:
-            progress_callback(progress, len(messages), "embedding")
-        
-        await asyncio.sleep(0.5)
-    
-    print("💾 Uploading to Qdrant...")
-    upload_batch_size = 100
+            progress_callback(added, len(to_add), "embedding")
     
-    for i in range(0, len(all_points), upload_batch_size):
-        batch = all_points[i:i+upload_batch_size]
-        client.upsert(collection_name=COLLECTION_NAME, points=batch)
-        print(f"  📤 Uploaded {min(i + upload_batch_size, len(all_points))}/{len(all_points)}")
-    
-    print(f"✅ Successfully stored {len(messages)} embeddings")
+    backend.flush()
+    keyword_index.flush()
+    bump_dataset_version(uuid.uuid4().hex)
+    print(f"✅ Vector store in sync: {len(wanted)} messages")
+    return {
+        "added": added,
+        "deleted": len(to_delete),
+        "unchanged": len(wanted) - len(to_add),
+        "total": len(wanted)
+    }
 
 
-def initialize_vector_store(messages: List[Dict], force_recreate: bool = False):
+def initialize_vector_store(messages: List[Dict], force_recreate: bool = False) -> Dict:
     """Sync wrapper"""
-    asyncio.run(initialize_vector_store_async(messages, force_recreate))
+    async def run():
+        try:
+            return await initialize_vector_store_async(messages, force_recreate)
+        finally:
+            await aclose_async_client()
+    
+    return asyncio.run(run())